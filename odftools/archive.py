@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-15 -*-
+
+"""Content-addressed archive of ODF files in a SQLite database.
+
+Each document is split into its Zip file members, and each member is stored
+only once under the SHA-256 hash of its data, no matter how many documents
+contain it. Templates and their descendants typically share styles.xml,
+settings and images, which are thus not stored again and again.
+
+The members are kept compressed as found in the Zip file and split into
+chunks, so documents are rebuilt by copying the chunks into a new Zip file,
+without decompressing anything or holding a whole member in memory.
+
+"""
+
+import os, sys
+import time
+import zipfile
+import zlib
+from cStringIO import StringIO
+
+try:
+    from sqlite3 import dbapi2 as sqlite    # Python25
+except ImportError:
+    from pysqlite2 import dbapi2 as sqlite  # Python24 and pysqlite
+
+from hashlib import sha256
+
+import odfmeta
+
+
+# Size of the chunks the member data is stored in
+CHUNK_SIZE = 1 << 20
+
+
+# Exceptions for this module
+
+class ArchiveError(Exception):
+    """Thrown if the archive cannot be opened or used."""
+    pass
+
+
+# Main class
+
+class DocumentArchive(object):
+    """Archive of ODF files storing each distinct Zip file member once.
+
+    Documents are identified by the integer returned by add().
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            self.db = sqlite.connect(filename, timeout=60, isolation_level=None)
+            self.db.execute("CREATE TABLE IF NOT EXISTS document ("
+                            "id INTEGER PRIMARY KEY, name TEXT, added REAL)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS member ("
+                            "document INTEGER, position INTEGER, filename TEXT,"
+                            " date_time TEXT, hash TEXT,"
+                            " PRIMARY KEY (document, position))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS member_hash ON member (hash)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS blob ("
+                            "hash TEXT PRIMARY KEY, compress_type INTEGER,"
+                            " crc INTEGER, file_size INTEGER, compress_size INTEGER)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS chunk ("
+                            "hash TEXT, position INTEGER, data BLOB,"
+                            " PRIMARY KEY (hash, position))")
+        except sqlite.Error, e:
+            raise ArchiveError(e)
+
+    def _hash(self, zf, filename):
+        digest = sha256()
+        f = zf.open(filename)
+        data = f.read(CHUNK_SIZE)
+        while data:
+            digest.update(data)
+            data = f.read(CHUNK_SIZE)
+        return digest.hexdigest()
+
+    def add(self, src, name=None):
+        """Store the ODF file src (a file name or file object).
+
+        name defaults to the file name of src. Returns the document id.
+
+        """
+        if name is None and isinstance(src, basestring):
+            name = src
+        try:
+            zf = zipfile.ZipFile(src, 'r')
+        except (IOError, zipfile.BadZipfile), e:
+            raise odfmeta.ReadError(e)
+
+        db = self.db
+        try:
+            try:
+                db.execute("BEGIN")
+                document = db.execute("INSERT INTO document (name, added) "
+                                      "VALUES (?, ?)", (name, time.time())).lastrowid
+                for position, info in enumerate(zf.infolist()):
+                    digest = self._hash(zf, info.filename)
+                    filename = info.filename
+                    if not isinstance(filename, unicode):
+                        filename = filename.decode('cp437') # Zip default
+                    db.execute("INSERT INTO member VALUES (?, ?, ?, ?, ?)",
+                               (document, position, filename,
+                                '%04d-%02d-%02d %02d:%02d:%02d' % info.date_time,
+                                digest))
+                    if db.execute("INSERT OR IGNORE INTO blob VALUES (?, ?, ?, ?, ?)",
+                                  (digest, info.compress_type, info.CRC,
+                                   info.file_size, info.compress_size)).rowcount:
+                        db.executemany("INSERT INTO chunk VALUES (?, ?, ?)",
+                                       ((digest, i, sqlite.Binary(data))
+                                        for i, data in enumerate(
+                                        odfmeta.iter_raw_member(zf, info.filename,
+                                                            CHUNK_SIZE))))
+                db.execute("COMMIT")
+            except:
+                # Corrupt members must not leave the transaction open either
+                error = sys.exc_info()[1]
+                try:
+                    db.execute("ROLLBACK")
+                except sqlite.Error:
+                    pass # BEGIN failed
+                if isinstance(error, sqlite.Error):
+                    raise ArchiveError(error)
+                if isinstance(error, (IOError, KeyError, zlib.error,
+                                      zipfile.BadZipfile)):
+                    raise odfmeta.ReadError(error)
+                raise
+        finally:
+            zf.close()
+        return document
+
+    def documents(self):
+        """Return a list of (id, name) tuples of all stored documents."""
+        try:
+            return self.db.execute("SELECT id, name FROM document "
+                                   "ORDER BY id").fetchall()
+        except sqlite.Error, e:
+            raise ArchiveError(e)
+
+    def _chunks(self, digest):
+        """Iterate over the stored data of digest, one chunk at a time."""
+        position = 0
+        while True:
+            row = self.db.execute("SELECT data FROM chunk WHERE hash = ? "
+                                  "AND position = ?", (digest, position)).fetchone()
+            if row is None:
+                return
+            yield str(row[0])
+            position += 1
+
+    def write(self, id, dst):
+        """Rebuild the document id as Zip file dst (a file name or object)."""
+        try:
+            members = self.db.execute(
+                    "SELECT filename, date_time, member.hash, compress_type, crc,"
+                    " file_size, compress_size FROM member JOIN blob"
+                    " ON member.hash = blob.hash WHERE document = ?"
+                    " ORDER BY position", (id,)).fetchall()
+        except sqlite.Error, e:
+            raise ArchiveError(e)
+        if not members:
+            raise ArchiveError('No such document: %r' % id)
+
+        try:
+            zf = zipfile.ZipFile(dst, 'w', allowZip64=True)
+        except IOError, e:
+            raise odfmeta.WriteError(e)
+        try:
+            for (filename, date_time, digest, compress_type, crc,
+                 file_size, compress_size) in members:
+                date_time = [int(x) for x in date_time.replace('-', ' ')
+                             .replace(':', ' ').split()]
+                zipinfo = zipfile.ZipInfo(filename, tuple(date_time))
+                zipinfo.compress_type = compress_type
+                zipinfo.CRC = crc
+                zipinfo.file_size = file_size
+                zipinfo.compress_size = compress_size
+                odfmeta.write_raw_member(zf, zipinfo, self._chunks(digest))
+        finally:
+            zf.close()
+
+    def load(self, id, lazy=False):
+        """Return the document id as Document, see odfmeta.load()."""
+        f = StringIO()
+        self.write(id, f)
+        return odfmeta.loads(f.getvalue(), lazy)
+
+    def remove(self, id):
+        """Remove the document id and all data no other document uses."""
+        db = self.db
+        try:
+            db.execute("BEGIN")
+            db.execute("DELETE FROM document WHERE id = ?", (id,))
+            db.execute("DELETE FROM member WHERE document = ?", (id,))
+            db.execute("DELETE FROM blob WHERE hash NOT IN "
+                       "(SELECT hash FROM member)")
+            db.execute("DELETE FROM chunk WHERE hash NOT IN "
+                       "(SELECT hash FROM blob)")
+            db.execute("COMMIT")
+        except sqlite.Error, e:
+            try:
+                db.execute("ROLLBACK")
+            except sqlite.Error:
+                pass # BEGIN failed
+            raise ArchiveError(e)
+
+    def sizes(self):
+        """Return the compressed size of all documents and the size stored."""
+        try:
+            total = self.db.execute(
+                    "SELECT COALESCE(SUM(compress_size), 0) FROM member JOIN blob"
+                    " ON member.hash = blob.hash").fetchone()[0]
+            stored = self.db.execute(
+                    "SELECT COALESCE(SUM(compress_size), 0) FROM blob").fetchone()[0]
+        except sqlite.Error, e:
+            raise ArchiveError(e)
+        return total, stored
+
+    def close(self):
+        self.db.close()
+
+
+# vim: et sts=4 sw=4
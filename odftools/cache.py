@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-15 -*-
+
+"""Persistent cache for data derived from ODF files (text, HTML, author, ...).
+
+The cache is a SQLite database in a cache directory. Entries are keyed by
+the absolute file name, modification time and size of the ODF file, or
+optionally by a hash of its content, so unchanged files are served without
+opening the Zip file. The least recently used entries are removed when the
+cache grows beyond its maximum size.
+
+"""
+
+import os, sys
+import time
+
+try:
+    from sqlite3 import dbapi2 as sqlite    # Python25
+except ImportError:
+    from pysqlite2 import dbapi2 as sqlite  # Python24 and pysqlite
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1             # Python24
+
+
+# Default maximum size of the cached data in bytes
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+
+# Exceptions for this module
+
+class CacheError(Exception):
+    """Thrown if the cache cannot be opened or used."""
+    pass
+
+
+# Main class
+
+class DocumentCache(object):
+    """Size-bounded persistent cache of data derived from documents.
+
+    Each entry is stored under a document key (see key()) and a kind like
+    "txt" or "author". Unicode strings are returned as Unicode strings,
+    everything else as byte strings.
+
+    """
+
+    filename = 'odftools-cache.sqlite'
+
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        try:
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            self.db = sqlite.connect(os.path.join(directory, self.filename),
+                                     timeout=60, isolation_level=None)
+            # Losing the last entries after a crash doesn't harm a cache
+            self.db.execute("PRAGMA synchronous=OFF")
+            self.db.execute("CREATE TABLE IF NOT EXISTS entry ("
+                            "key TEXT, kind TEXT, data BLOB, is_unicode INTEGER,"
+                            " size INTEGER, used REAL, PRIMARY KEY (key, kind))")
+            self.db.execute("CREATE INDEX IF NOT EXISTS entry_used ON entry (used)")
+            self.size = self.db.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM entry").fetchone()[0]
+        except (OSError, sqlite.Error), e:
+            raise CacheError(e)
+
+    def key(self, filename, content_hash=False):
+        """Return the cache key of the file filename.
+
+        By default the key depends on the absolute file name, the
+        modification time and the size. If content_hash is True, the key is a
+        hash of the file data instead, which survives copying and touching.
+
+        """
+        if content_hash:
+            digest = sha1()
+            f = open(filename, 'rb')
+            try:
+                data = f.read(1 << 20)
+                while data:
+                    digest.update(data)
+                    data = f.read(1 << 20)
+            finally:
+                f.close()
+            return 'sha1:' + digest.hexdigest()
+
+        stat = os.stat(filename)
+        path = os.path.abspath(filename)
+        if isinstance(path, unicode):
+            path = path.encode('utf-8')
+        return sha1('%s\0%r\0%d' % (path, stat.st_mtime, stat.st_size)).hexdigest()
+
+    def get(self, key, kind):
+        """Return the cached data or None if there is no such entry."""
+        try:
+            row = self.db.execute("SELECT data, is_unicode FROM entry "
+                                  "WHERE key = ? AND kind = ?",
+                                  (key, kind)).fetchone()
+            if row is None:
+                return None
+            self.db.execute("UPDATE entry SET used = ? WHERE key = ? AND kind = ?",
+                            (time.time(), key, kind))
+        except sqlite.Error, e:
+            raise CacheError(e)
+
+        data = str(row[0])
+        if row[1]:
+            data = data.decode('utf-8')
+        return data
+
+    def set(self, key, kind, data):
+        """Store data under key and kind, evicting old entries if necessary."""
+        is_unicode = isinstance(data, unicode)
+        if is_unicode:
+            data = data.encode('utf-8')
+        try:
+            old = self.db.execute("SELECT size FROM entry WHERE key = ? AND kind = ?",
+                                  (key, kind)).fetchone()
+            self.db.execute("INSERT OR REPLACE INTO entry VALUES (?, ?, ?, ?, ?, ?)",
+                            (key, kind, sqlite.Binary(data), int(is_unicode),
+                             len(data), time.time()))
+        except sqlite.Error, e:
+            raise CacheError(e)
+
+        self.size += len(data) - (old and old[0] or 0)
+        if self.size > self.max_size:
+            self.evict()
+
+    def evict(self, ratio=0.9):
+        """Remove least recently used entries until the cache size is below
+        ratio * max_size."""
+        try:
+            # Other processes may have changed the cache, so count again
+            self.size = self.db.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM entry").fetchone()[0]
+            limit = self.max_size * ratio
+            if self.size <= limit:
+                return
+            removed = []
+            rows = self.db.execute("SELECT key, kind, size FROM entry "
+                                   "ORDER BY used, rowid").fetchall()
+            for key, kind, size in rows:
+                removed.append((key, kind))
+                self.size -= size
+                if self.size <= limit:
+                    break
+            self.db.execute("BEGIN")
+            self.db.executemany("DELETE FROM entry WHERE key = ? AND kind = ?",
+                                removed)
+            self.db.execute("COMMIT")
+        except sqlite.Error, e:
+            raise CacheError(e)
+
+    def close(self):
+        self.db.close()
+
+
+# One cache per process and directory, so worker processes don't share
+# database connections.
+_caches = {}
+
+def open_cache(directory, max_size=DEFAULT_MAX_SIZE):
+    """Return the DocumentCache for directory, opening it if necessary."""
+    key = (os.getpid(), os.path.abspath(directory))
+    if key not in _caches:
+        _caches[key] = DocumentCache(directory, max_size)
+    return _caches[key]
+
+
+# vim: et sts=4 sw=4
@@ -0,0 +1,350 @@
+# -*- coding: iso-8859-15 -*-
+
+"""Base class for the XML components of a document."""
+
+import os, sys
+import re
+import sre_constants
+from cStringIO import StringIO
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    from elementtree.cElementTree import ElementTree as ET
+
+from namespaces import clark, compile_path
+
+
+# Exceptions for this module
+
+class ReCompileError(Exception):
+    """Thrown if regular expression cannot be compiled."""
+    pass
+
+
+# Search and replace
+
+def _trie_pattern(words):
+    """Return a regular expression matching the longest of the given words.
+
+    The words are arranged as a prefix tree, so the expression never has to
+    try more than one alternative per character.
+
+    """
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = None # end of a word
+
+    def edges(node):
+        """Return the (label, node) of the children of node.
+
+        Chains of nodes with a single child and no word end are joined into
+        one label, so every character is escaped once.
+
+        """
+        result = []
+        for char in sorted([c for c in node if c]):
+            label = [char]
+            child = node[char]
+            while len(child) == 1 and '' not in child:
+                char = child.keys()[0]
+                label.append(char)
+                child = child[char]
+            result.append((''.join(label), child))
+        return result
+
+    # Build the expressions of the nodes bottom up, the words may be longer
+    # than the recursion limit
+    patterns = {} # id(node) -> expression
+    stack = [(trie, None)]
+    while stack:
+        node, children = stack.pop()
+        if children is None:
+            children = edges(node)
+            stack.append((node, children))
+            stack.extend([(child, None) for label, child in children])
+            continue
+
+        alternatives = []
+        chars = []
+        for label, child in children:
+            tail = patterns.pop(id(child))
+            if tail or len(label) > 1:
+                alternatives.append(re.escape(label) + tail)
+            else:
+                chars.append(re.escape(label))
+        if len(chars) == 1:
+            alternatives.append(chars[0])
+        elif chars:
+            alternatives.append('[' + ''.join(chars) + ']')
+
+        if not alternatives:
+            pattern = ''
+        elif len(alternatives) == 1:
+            pattern = alternatives[0]
+        else:
+            pattern = '(?:' + '|'.join(alternatives) + ')'
+        if pattern and '' in node:
+            if len(pattern) > 1 and pattern[:3] != '(?:':
+                pattern = '(?:' + pattern + ')'
+            pattern += '?'
+        patterns[id(node)] = pattern
+
+    return patterns[id(trie)]
+
+
+def _compile_literals(words):
+    """Compile a regular expression matching the longest of the given words.
+
+    Prefixes shared by many words nest the groups of _trie_pattern() too
+    deeply for the regular expression compiler, in that case the words are
+    tried one by one, longest first.
+
+    """
+    try:
+        return re.compile(_trie_pattern(words), re.UNICODE)
+    except RuntimeError:
+        words = sorted(words, key=len, reverse=True)
+        return re.compile('|'.join([re.escape(word) for word in words]),
+                          re.UNICODE)
+
+
+class Replacer(object):
+    """Replaces all occurences of many search strings in a single pass.
+
+    pairs is a sequence of (search, replace) tuples. Literal search strings
+    are compiled into one regular expression (see _trie_pattern), the longest
+    match at a position wins. If regex is True, each search string is a
+    regular expression compiled once and applied in the given order.
+
+    counts maps each search string to the number of replacements made.
+
+    """
+
+    def __init__(self, pairs, regex=False):
+        pairs = [(search, replace) for search, replace in pairs if search]
+        self.counts = dict([(search, 0) for search, replace in pairs])
+        self.regex = regex
+        try:
+            if regex:
+                self._patterns = [(re.compile(search), replace, search)
+                                  for search, replace in pairs]
+            else:
+                self._replacements = dict(pairs)
+                self._pattern = pairs and _compile_literals(
+                        self._replacements.keys()) or None
+        except (sre_constants.error, TypeError, OverflowError), v:
+            raise ReCompileError(v)
+
+    def finders(self):
+        """Return one function per pass over a text to find the matches.
+
+        Each function takes a text and yields (start, end, replacement,
+        search) for every match, without changing counts. This allows to
+        replace in texts which are spread across several nodes.
+
+        """
+        if self.regex:
+            return [lambda text, pattern=pattern, replace=replace, search=search:
+                    ((match.start(), match.end(), match.expand(replace), search)
+                     for match in pattern.finditer(text))
+                    for pattern, replace, search in self._patterns]
+        elif self._pattern is not None:
+            replacements = self._replacements
+            return [lambda text: ((match.start(), match.end(),
+                                   replacements[match.group(0)], match.group(0))
+                                  for match in self._pattern.finditer(text))]
+        return []
+
+    def _replace_literal(self, match):
+        search = match.group(0)
+        self.counts[search] += 1
+        return self._replacements[search]
+
+    def sub(self, text):
+        """Return text with all search strings replaced."""
+        if self.regex:
+            for pattern, replace, search in self._patterns:
+                text, count = pattern.subn(replace, text)
+                self.counts[search] += count
+        elif self._pattern is not None:
+            text = self._pattern.sub(self._replace_literal, text)
+        return text
+
+    def reset(self):
+        """Reset all replacement counts to 0."""
+        for search in self.counts:
+            self.counts[search] = 0
+
+
+# Main class
+
+class Component(object):
+    """An XML component of the document (content.xml, styles.xml, ...).
+
+    The XML data is only parsed when root is accessed for the first time.
+    Instead of a string, data may also be a callable returning the string,
+    so even reading the data (e.g. from a Zip file) is deferred until then.
+
+    """
+
+    def __init__(self, data=''):
+        self.source = data # the data or callable given on creation
+        self._data = data
+        self._root = None
+        self._index = None # elements by tag, see index_tags()
+
+    def _get_data(self):
+        """Return the raw XML data, reading it first if necessary."""
+        if callable(self._data):
+            self._data = self._data()
+        return self._data
+
+    def _get_root(self):
+        if self._root is None:
+            data = self._get_data()
+            if data:
+                self._root = ET.fromstring(data)
+        return self._root
+
+    def _set_root(self, root):
+        self._root = root
+        self._index = None
+
+    root = property(_get_root, _set_root,
+                    doc="Root element of the component, parsed on demand.")
+
+    def _open_source(self):
+        """Return a file object for parsing unparsed data incrementally.
+
+        The Zip file member is read directly if possible. Returns None if
+        the data has already been parsed or is empty.
+
+        """
+        if self._root is None and self._data:
+            if hasattr(self._data, 'open'):
+                return self._data.open()
+            return StringIO(self._get_data())
+        return None
+
+    def is_parsed(self):
+        """Return True if the XML data has already been parsed."""
+        return self._root is not None
+
+    # Queries with prefixed names, see namespaces.compile_path()
+
+    def find(self, path):
+        """Return the first element matching path or None.
+
+        path is an ElementPath expression like "office:body/office:text".
+
+        """
+        if self.root is None:
+            return None
+        return self.root.find(compile_path(path))
+
+    def findall(self, path):
+        """Return a list of all elements matching path."""
+        if self.root is None:
+            return []
+        return self.root.findall(compile_path(path))
+
+    def findtext(self, path, default=None):
+        """Return the text of the first element matching path or default."""
+        if self.root is None:
+            return default
+        return self.root.findtext(compile_path(path), default)
+
+    def iter(self, name=None):
+        """Iterate over all elements named name (e.g. "text:p").
+
+        All elements are returned if name is None or "*". The elements are
+        taken from the index if index_tags() has been called.
+
+        """
+        if self.root is None:
+            return iter([])
+        tag = name and name != '*' and clark(name) or None
+        if tag is not None and self._index is not None:
+            return iter(self._index.get(tag, ()))
+        return iter(self.root.getiterator(tag))
+
+    def index_tags(self):
+        """Index all elements by tag in one pass, to speed up iter().
+
+        The index is not updated when elements are added or removed, call
+        index_tags() again then.
+
+        """
+        index = {}
+        if self.root is not None:
+            for node in self.root.getiterator():
+                if node.tag in index:
+                    index[node.tag].append(node)
+                else:
+                    index[node.tag] = [node]
+        self._index = index
+
+    # Convert the component to other formats
+
+    def tostring(self, encoding="utf-8"):
+        """Return the XML representation of the component.
+
+        Unparsed components are returned as read, without parsing them.
+
+        """
+        if self._root is None:
+            data = self._get_data()
+            if not data or encoding.lower().replace('_', '-') in ('utf-8', 'utf8'):
+                return data
+        return ET.tostring(self.root, encoding=encoding)
+
+    # Operations
+
+    def replace(self, search, replace):
+        """Replace all occurences of search in content by replace.
+
+        Regular expressions are fully supported for search and replace.
+
+        Returns the number of replacements made.
+
+        """
+        if not search:
+            return 0
+
+        try:
+            replacer = Replacer([(search, replace)], regex=True)
+        except ReCompileError, v:
+            print >>sys.stderr, 'Warning: could not compile regular expression:', v
+            return 0
+
+        try:
+            return self.replace_all(replacer)
+        except (sre_constants.error, TypeError), v:
+            print >>sys.stderr, 'Warning: could not compile regular expression:', v
+            return 0
+
+    def replace_all(self, replacer):
+        """Apply all replacements of the Replacer replacer in one pass.
+
+        Returns the number of text nodes changed, replacer.counts holds the
+        number of replacements per search string.
+
+        """
+        if self.root is None:
+            return 0
+
+        count = 0
+        sub = replacer.sub
+        for node in self.root.getiterator():
+            if node.text:
+                replaced = sub(node.text)
+                if replaced != node.text:
+                    node.text = replaced
+                    count += 1
+        return count
+
+# vim: et sts=4 sw=4
@@ -5,12 +5,19 @@
 import os, sys
 import re
 import sre_constants
+from array import array
+from bisect import bisect_right
+from itertools import chain, repeat
+from xml.sax.saxutils import escape, quoteattr
 
 try:
     import xml.etree.cElementTree as ET
 except ImportError:
     from elementtree.cElementTree import ElementTree as ET
 
+from component import Component
+from styles import automatic_styles
+
 
 # Exceptions for this module
 
@@ -22,12 +29,80 @@ class PathNotFoundError(Exception):
     """Thrown if a file reference contains a nonexistant path."""
     pass
 
-# Main class
+# Namespaces and element names
+
+TEXT_NS = "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
+OFFICE_NS = "{urn:oasis:names:tc:opendocument:xmlns:office:1.0}"
+TABLE_NS = "{urn:oasis:names:tc:opendocument:xmlns:table:1.0}"
+DRAW_NS = "{urn:oasis:names:tc:opendocument:xmlns:drawing:1.0}"
+STYLE_NS = "{urn:oasis:names:tc:opendocument:xmlns:style:1.0}"
+XLINK_NS = "{http://www.w3.org/1999/xlink}"
+
+# Elements holding a flow of text
+_paragraph_tags = dict.fromkeys((TEXT_NS + 'p', TEXT_NS + 'h'))
+_flow_tags = dict.fromkeys(_paragraph_tags.keys() + [OFFICE_NS + 'annotation'])
+
+# Elements representing white space characters
+_space_chars = {TEXT_NS + 's': u' ', TEXT_NS + 'tab': u'\t',
+                TEXT_NS + 'line-break': u'\n'}
+
+# Table elements and the value types stored as floats
+_table_tag = TABLE_NS + 'table'
+_row_tag = TABLE_NS + 'table-row'
+_cell_tags = dict.fromkeys((TABLE_NS + 'table-cell',
+                            TABLE_NS + 'covered-table-cell'))
+_float_types = dict.fromkeys(('float', 'percentage', 'currency'))
+
+# HTML elements and attributes for the elements of office:body. Other
+# elements are left out, but not their content, unless they are listed in
+# _html_skipped. Void elements have no end tag.
+_html_elements = {
+    TEXT_NS + 'p': ('p', {TEXT_NS + 'style-name': 'class'}),
+    TEXT_NS + 'h': ('h1', {TEXT_NS + 'style-name': 'class'}),
+    TEXT_NS + 'span': ('span', {TEXT_NS + 'style-name': 'class'}),
+    TEXT_NS + 'a': ('a', {XLINK_NS + 'href': 'href',
+                          TEXT_NS + 'style-name': 'class'}),
+    TEXT_NS + 'list': ('ul', {TEXT_NS + 'style-name': 'class'}),
+    TEXT_NS + 'list-header': ('li', {}),
+    TEXT_NS + 'list-item': ('li', {}),
+    TEXT_NS + 'line-break': ('br', {}),
+    TABLE_NS + 'table': ('table', {TABLE_NS + 'style-name': 'class'}),
+    TABLE_NS + 'table-header-rows': ('thead', {}),
+    TABLE_NS + 'table-row': ('tr', {TABLE_NS + 'style-name': 'class'}),
+    TABLE_NS + 'table-cell': ('td', {TABLE_NS + 'style-name': 'class',
+                                     TABLE_NS + 'number-columns-spanned': 'colspan',
+                                     TABLE_NS + 'number-rows-spanned': 'rowspan'}),
+    DRAW_NS + 'image': ('img', {XLINK_NS + 'href': 'src'}),
+    }
+_html_void = dict.fromkeys(('br', 'img'))
+_html_skipped = dict.fromkeys((OFFICE_NS + 'annotation', OFFICE_NS + 'forms',
+                               TEXT_NS + 'tracked-changes',
+                               TEXT_NS + 'sequence-decls',
+                               TEXT_NS + 'variable-decls',
+                               TABLE_NS + 'covered-table-cell'))
+_body_tag = OFFICE_NS + 'body'
+_list_tag = TEXT_NS + 'list'
+_list_style_tag = TEXT_NS + 'list-style'
+_number_level_tag = TEXT_NS + 'list-level-style-number'
+
+# Attributes holding links, which may only use these schemes or be relative
+_html_url_attributes = dict.fromkeys(('href', 'src'))
+_safe_url_schemes = dict.fromkeys(('http', 'https', 'mailto'))
+_url_scheme = re.compile(r'^([a-zA-Z][a-zA-Z0-9+.-]*):')
+# Browsers ignore these characters in URLs, e.g. "java\tscript:"
+_url_ignored = re.compile(r'[\x00-\x20\x7f]+')
 
-class Content(object):
 
-    def __init__(self, text):
-        self.root = ET.fromstring(text)
+def _is_safe_url(url):
+    """Return True if url is relative or uses one of _safe_url_schemes."""
+    match = _url_scheme.match(_url_ignored.sub(u'', url))
+    return match is None or match.group(1).lower() in _safe_url_schemes
+
+
+# Main class
+
+class Content(Component):
+    """Contents of the document: text and data."""
 
     # Convert the document to other formats
 
@@ -39,50 +114,693 @@ class Content(object):
 
     def to_text(self, skip_blank_lines=True):
         """Return the content of the document as a plain-text Unicode string."""
-        textlist = (node.text for node in self.root.getiterator()
-                    if not skip_blank_lines or node.text)
-        return unicode(os.linesep).join(textlist)
+        return unicode(os.linesep).join(self.iter_text(skip_blank_lines))
 
-    # Operations
+    def iter_text(self, skip_blank_lines=True):
+        """Iterate over the text of all nodes in document order.
+
+        Unparsed content is parsed incrementally by iter_text(), directly from
+        the Zip file member if possible, without building the element tree.
+
+        """
+        source = self._open_source()
+        if source is not None:
+            return iter_text(source, skip_blank_lines)
+        if self.root is None:
+            return iter([])
+        return (node.text or u'' for node in self.root.getiterator()
+                if not skip_blank_lines or node.text)
+
+    def iter_paragraphs(self):
+        """Iterate over (number, text) of all paragraphs and headings.
 
-    def replace(self, search, replace):
-        """Replace all occurences of search in content by replace.
+        Like iter_text(), unparsed content is parsed incrementally, see the
+        function iter_paragraphs().
+
+        """
+        source = self._open_source()
+        if source is not None:
+            return iter_paragraphs(source)
+        if self.root is None:
+            return iter([])
+        return _paragraphs_from_events(_tree_events(self.root))
 
-        Regular expressions are fully supported for search and replace.
+    def iter_tables(self):
+        """Iterate over the tables of the document as _Table objects.
 
-        Returns the number of replacements made.
+        Like iter_text(), unparsed content is parsed incrementally and only
+        the cell values are kept.
 
         """
-        if not search:
-            return 0
+        source = self._open_source()
+        if source is not None:
+            return iter_tables(source, self)
+        if self.root is None:
+            return iter([])
+        return _tables_from_rows(
+                _row_runs_from_events(_tree_events(self.root)), self)
+
+    def get_tables(self):
+        """Return a list of all tables in the document, see iter_tables()."""
+        return list(self.iter_tables())
+
+    def iter_table_rows(self):
+        """Iterate over the rows of all tables, see iter_table_rows().
+
+        Unparsed content is parsed incrementally and no table is ever held
+        in memory as a whole.
+
+        """
+        source = self._open_source()
+        if source is not None:
+            return iter_table_rows(source)
+        if self.root is None:
+            return iter([])
+        return _rows_from_events(_tree_events(self.root))
+
+    def get_automatic_styles(self):
+        """Return the style elements of office:automatic-styles.
+
+        Unparsed content is only parsed up to office:body.
+
+        """
+        source = self._open_source()
+        if source is not None:
+            try:
+                return automatic_styles(ET.iterparse(source, ('start', 'end')))
+            finally:
+                source.close()
+        if self.root is None:
+            return []
+        return automatic_styles(_tree_events(self.root))
+
+    def iter_html(self):
+        """Iterate over the HTML of office:body as Unicode strings.
 
-        try:
-            _replace = re.compile(search).sub
-            search = lambda x, y: find(x, y)
-        except (sre_constants.error, TypeError), v:
-            print >>sys.stderr, 'Warning: could not compile regular expression:', v
+        Like iter_text(), unparsed content is converted while it is parsed
+        incrementally, see iter_html().
+
+        """
+        source = self._open_source()
+        if source is not None:
+            return iter_html(source)
+        if self.root is None:
+            return iter([])
+        return _html_from_events(_tree_events(self.root))
+
+    # Operations
+
+    def replace_all(self, replacer):
+        """Apply all replacements of the Replacer replacer in one pass.
+
+        The text of each paragraph and heading is matched as a whole, so
+        search strings are also found across <text:span> and other inline
+        elements. The replacement is put where the match starts and the rest
+        of the match is removed from the following texts and tails. Matches
+        including spaces, tabs or line breaks stored as elements are skipped.
+
+        Returns the number of text nodes changed, replacer.counts holds the
+        number of replacements per search string.
+
+        """
+        if self.root is None:
             return 0
 
         count = 0
-        for node in self.root.getiterator():
-            if node.text:
-                try:
-                    replaced = _replace(replace, node.text)
-                    if replaced != node.text:
-                        node.text = replaced
-                        count += 1
-                except (sre_constants.error, TypeError), v:
-                    print >>sys.stderr, 'Warning: could not compile regular expression:', v
-                    return 0
+        counts = replacer.counts
+        finders = replacer.finders()
+        for paragraph in self.root.getiterator():
+            if paragraph.tag not in _paragraph_tags:
+                continue
+            for find in finders:
+                slots = _text_slots(paragraph)
+                text = u''.join([value for node, attr, value in slots])
+                if not text:
+                    break
+
+                spaces = []
+                pos = 0
+                for node, attr, value in slots:
+                    if node is None:
+                        spaces.append((pos, pos + len(value)))
+                    pos += len(value)
+
+                edits = []
+                for start, end, replacement, search in find(text):
+                    for space_start, space_end in spaces:
+                        if start < space_end and end > space_start:
+                            break
+                    else:
+                        edits.append((start, end, replacement))
+                        counts[search] += 1
+                if edits:
+                    count += _apply_edits(slots, edits)
         return count
 
+
+# Paragraph text
+
+def _text_slots(paragraph):
+    """Return the text slots of paragraph in document order.
+
+    Each slot is a tuple (node, attribute, value), where attribute is "text"
+    or "tail". White space elements get a slot (None, None, characters).
+    Nested text flows like paragraphs in frames are left out, except their
+    tails.
+
+    """
+    slots = [(paragraph, 'text', paragraph.text or u'')]
+    stack = [(paragraph, iter(paragraph))]
+    while stack:
+        node, children = stack[-1]
+        for child in children:
+            if child.tag in _space_chars:
+                chars = _space_chars[child.tag]
+                if child.tag == TEXT_NS + 's':
+                    chars *= int(child.get(TEXT_NS + 'c', 1))
+                slots.append((None, None, chars))
+            elif child.tag not in _flow_tags:
+                slots.append((child, 'text', child.text or u''))
+                stack.append((child, iter(child)))
+                break
+            slots.append((child, 'tail', child.tail or u''))
+        else:
+            stack.pop()
+            if stack:
+                slots.append((node, 'tail', node.tail or u''))
+    return slots
+
+
+def _apply_edits(slots, edits):
+    """Apply edits to the text slots, return the number of changed nodes.
+
+    edits is a sorted list of non-overlapping (start, end, replacement)
+    tuples referring to the joined text of all slots. The replacement goes
+    to the first editable slot ending after start.
+
+    """
+    editable = []
+    bounds = []
+    pos = 0
+    for index, (node, attr, value) in enumerate(slots):
+        bounds.append((pos, pos + len(value)))
+        pos += len(value)
+        if node is not None:
+            editable.append(index)
+
+    # Find the slot receiving each replacement
+    homes = []
+    j = 0
+    for start, end, replacement in edits:
+        while j < len(editable) - 1 and bounds[editable[j]][1] <= start:
+            j += 1
+        homes.append(editable[j])
+
+    changed = 0
+    i = 0
+    for index in editable:
+        node, attr, value = slots[index]
+        a, b = bounds[index]
+        while i < len(edits) and edits[i][1] <= a and edits[i][0] < a:
+            i += 1
+
+        pieces = []
+        pos = a
+        m = i
+        while m < len(edits) and (edits[m][0] < b or homes[m] == index):
+            start, end, replacement = edits[m]
+            start = max(start, a)
+            if start > pos:
+                pieces.append(value[pos - a:start - a])
+            if homes[m] == index:
+                pieces.append(replacement)
+            pos = max(pos, min(end, b))
+            m += 1
+        pieces.append(value[pos - a:])
+
+        new = u''.join(pieces)
+        if new != value:
+            setattr(node, attr, new or None)
+            changed += 1
+    return changed
+
+
+# Streaming access
+
+def iter_text(source, skip_blank_lines=True):
+    """Iterate over the text of all nodes of the XML file object source.
+
+    The text is yielded in document order while source is parsed, and every
+    element is discarded as soon as it is closed, so memory usage doesn't
+    depend on the document size. source is closed when done.
+
+    """
+    stack = []
+    pending = None # element whose text has not been yielded yet
+    try:
+        for event, node in ET.iterparse(source, ('start', 'end')):
+            if event == 'start':
+                # The text of the parent is complete when its first child
+                # starts, the text of a leaf is complete when it ends.
+                if pending is not None and (pending.text or not skip_blank_lines):
+                    yield pending.text or u''
+                pending = node
+                stack.append(node)
+            else:
+                if pending is node and (node.text or not skip_blank_lines):
+                    yield node.text or u''
+                pending = None
+                stack.pop()
+                node.clear()
+                if stack:
+                    stack[-1].remove(node)
+    finally:
+        source.close()
+
+
+def iter_html(source):
+    """Iterate over the HTML of office:body in the XML file object source.
+
+    The HTML is yielded in chunks while source is parsed, without building
+    an element tree, and elements are discarded as soon as their text and
+    tail have been written. The element names are mapped by _html_elements.
+    source is closed when done.
+
+    """
+    try:
+        for chunk in _html_from_events(ET.iterparse(source, ('start', 'end')),
+                                       True):
+            yield chunk
+    finally:
+        source.close()
+
+
+def _html_from_events(events, discard=False):
+    """Yield the HTML of office:body in the (event, node) pairs.
+
+    The text of an element is complete at the next event, so it is written
+    then (pending). If discard is True, elements are cleared and removed
+    once their tail has been written.
+
+    """
+    out = []
+    stack = [] # (node, end tag) of the open elements
+    pending = None # (node, "text" or "tail", visible)
+    inside = False # within office:body
+    skipped = 0 # depth within left out elements
+    numbered = {} # names of the list styles with numbers on the first level
+    lists = [] # HTML tags of the open lists
+    for event, node in events:
+        if pending is not None:
+            pending_node, attribute, visible = pending
+            text = getattr(pending_node, attribute)
+            if visible and text:
+                out.append(escape(text))
+            if discard and attribute == 'tail':
+                pending_node.clear()
+                if stack:
+                    stack[-1][0].remove(pending_node)
+            pending = None
+
+        tag = node.tag
+        if event == 'start':
+            end = None
+            if not inside:
+                inside = tag == _body_tag
+                if tag == _number_level_tag and node.get(TEXT_NS + 'level') == '1' \
+                        and stack and stack[-1][0].tag == _list_style_tag:
+                    numbered[stack[-1][0].get(STYLE_NS + 'name')] = True
+            elif skipped or tag in _html_skipped:
+                skipped += 1
+            elif tag in _html_elements:
+                end, attributes = _html_elements[tag]
+                if end == 'h1':
+                    level = node.get(TEXT_NS + 'outline-level', '1')
+                    end = 'h%d' % min(max(level.isdigit() and int(level), 1), 6)
+                elif tag == _list_tag:
+                    # Nested lists without style continue the enclosing list
+                    style = node.get(TEXT_NS + 'style-name')
+                    if style is None and lists:
+                        end = lists[-1]
+                    elif style in numbered:
+                        end = 'ol'
+                    lists.append(end)
+                out.append('<' + end)
+                for key, name in attributes.items():
+                    value = node.get(key)
+                    if value is not None and (name not in _html_url_attributes
+                                              or _is_safe_url(value)):
+                        out.append(' %s=%s' % (name, quoteattr(value)))
+                out.append('>')
+                if end in _html_void:
+                    end = None
+            elif tag in _space_chars:
+                chars = _space_chars[tag]
+                if tag == TEXT_NS + 's':
+                    chars = u'\xa0' * int(node.get(TEXT_NS + 'c', 1))
+                out.append(chars)
+            stack.append((node, end))
+            pending = (node, 'text', inside and not skipped)
+        else:
+            end = stack.pop()[1]
+            if end is not None:
+                out.append('</%s>' % end)
+                if tag == _list_tag:
+                    lists.pop()
+            if skipped:
+                skipped -= 1
+            elif tag == _body_tag:
+                inside = False
+            pending = (node, 'tail', inside and not skipped)
+            if len(out) > 500:
+                yield u''.join(out)
+                del out[:]
+    if out:
+        yield u''.join(out)
+
+
+def iter_paragraphs(source):
+    """Iterate over the paragraphs and headings in the XML file object source.
+
+    Yields (number, text) tuples, where number counts the paragraphs in
+    document order, starting at 0, and text is the whole text of the
+    paragraph including spans, spaces, tabs and line breaks. Paragraphs
+    nested in a paragraph (e.g. in frames or annotations) are yielded
+    separately, before the enclosing one. Elements are discarded once the
+    outermost paragraph is complete. source is closed when done.
+
+    """
+    try:
+        for item in _paragraphs_from_events(ET.iterparse(source, ('start', 'end')),
+                                            True):
+            yield item
+    finally:
+        source.close()
+
+
+def _paragraphs_from_events(events, discard=False):
+    """Yield (number, text) for the paragraphs in the (event, node) pairs."""
+    stack = []
+    numbers = [] # numbers of the open paragraphs
+    count = 0
+    for event, node in events:
+        if event == 'start':
+            if node.tag in _paragraph_tags:
+                numbers.append(count)
+                count += 1
+            stack.append(node)
+            continue
+
+        stack.pop()
+        if node.tag in _paragraph_tags:
+            yield numbers.pop(), u''.join([value for n, attr, value
+                                           in _text_slots(node)])
+        if discard and not numbers:
+            # Keep the elements (and tails) of enclosing paragraphs
+            node.clear()
+            if stack:
+                stack[-1].remove(node)
+
+
+def iter_tables(source, parent=None):
+    """Iterate over the tables in the XML file object source.
+
+    Each table is yielded as a _Table with the given parent as soon as it is
+    closed. source is closed when done.
+
+    """
+    return _tables_from_rows(_iter_row_runs(source), parent)
+
+
+def iter_table_rows(source):
+    """Iterate over the rows of all tables in the XML file object source.
+
+    Yields (name, row, count) tuples, where name is the name of the table,
+    row is a tuple of cell values (see _cell_value()) without the empty
+    cells at its end and count is the number of times the row is repeated.
+    Each table starts with a (name, None, 0) tuple. Repeated rows are never
+    expanded and all elements are discarded once their values are taken,
+    so memory usage doesn't depend on the number of rows. source is closed
+    when done.
+
+    """
+    return _expand_cells(_iter_row_runs(source))
+
+
+def _iter_row_runs(source):
+    """Like iter_table_rows(), but with the cells of rows as runs."""
+    try:
+        for item in _row_runs_from_events(
+                ET.iterparse(source, ('start', 'end')), True):
+            yield item
+    finally:
+        source.close()
+
+
+def _tree_events(root):
+    """Yield the iterparse() events of the parsed element root."""
+    stack = [(root, iter(root))]
+    yield 'start', root
+    while stack:
+        node, children = stack[-1]
+        for child in children:
+            yield 'start', child
+            stack.append((child, iter(child)))
+            break
+        else:
+            stack.pop()
+            yield 'end', node
+
+
+def _expand_cells(rows):
+    """Yield the items of rows with the runs of cells expanded to tuples."""
+    for name, runs, count in rows:
+        if runs is None:
+            yield name, None, count
+            continue
+        row = []
+        for value, repeat in runs:
+            row.extend([value] * repeat)
+        yield name, tuple(row), count
+
+
+def _rows_from_events(events, discard=False):
+    """Yield the rows of the outermost tables in the (event, node) pairs.
+
+    See iter_table_rows() for the items yielded.
+
+    """
+    return _expand_cells(_row_runs_from_events(events, discard))
+
+
+def _row_runs_from_events(events, discard=False):
+    """Yield the rows of the outermost tables in the (event, node) pairs.
+
+    Like iter_table_rows(), but each row is a tuple of (value, repeat) runs
+    of cells with equal values as given by table:number-columns-repeated.
+    Tables nested in cells are part of the cell value. If discard is True,
+    elements are cleared and removed once they have been used.
+
+    """
+    name_key = TABLE_NS + 'name'
+    rows_key = TABLE_NS + 'number-rows-repeated'
+    columns_key = TABLE_NS + 'number-columns-repeated'
+    stack = []
+    depth = 0 # number of open tables
+    name = cells = None
+    for event, node in events:
+        tag = node.tag
+        if event == 'start':
+            if tag == _table_tag:
+                depth += 1
+                if depth == 1:
+                    name = node.get(name_key)
+                    yield name, None, 0
+            elif tag == _row_tag and depth == 1:
+                cells = []
+            stack.append(node)
+            continue
+
+        stack.pop()
+        if tag in _cell_tags and depth == 1:
+            value = _cell_value(node)
+            repeat = int(node.get(columns_key, 1))
+            if value is None and cells and cells[-1][0] is None:
+                cells[-1] = (None, cells[-1][1] + repeat)
+            else:
+                cells.append((value, repeat))
+        elif tag == _row_tag and depth == 1:
+            if cells and cells[-1][0] is None:
+                cells.pop()
+            yield name, tuple(cells), int(node.get(rows_key, 1))
+            cells = None
+        elif tag == _table_tag:
+            depth -= 1
+        elif depth:
+            continue # keep the content of cells until they are complete
+
+        if discard:
+            node.clear()
+            if stack:
+                stack[-1].remove(node)
+
+
+def _tables_from_rows(rows, parent=None):
+    """Build a _Table from the rows of each table, see _iter_row_runs()."""
+    table = None
+    for name, row, count in rows:
+        if row is None:
+            if table is not None:
+                table._finish()
+                yield table
+            table = _Table(parent, name)
+        else:
+            table._add_row(row, count)
+    if table is not None:
+        table._finish()
+        yield table
+
+
+def _cell_value(cell):
+    """Return the value of a table cell element.
+
+    Numbers (also percentages and currencies) are returned as floats,
+    booleans as bools, dates and times as the ISO strings stored in the
+    document, everything else as the Unicode text of the cell. Empty cells
+    have the value None.
+
+    """
+    value_type = cell.get(OFFICE_NS + 'value-type')
+    try:
+        if value_type in _float_types:
+            return float(cell.get(OFFICE_NS + 'value'))
+    except (TypeError, ValueError):
+        pass
+    if value_type == 'boolean':
+        return cell.get(OFFICE_NS + 'boolean-value') == 'true'
+    if value_type == 'date' and cell.get(OFFICE_NS + 'date-value'):
+        return unicode(cell.get(OFFICE_NS + 'date-value'))
+    if value_type == 'time' and cell.get(OFFICE_NS + 'time-value'):
+        return unicode(cell.get(OFFICE_NS + 'time-value'))
+
+    text = u'\n'.join([u''.join([value for node, attr, value in _text_slots(p)])
+                       for p in cell if p.tag in _paragraph_tags])
+    if not text and value_type is None:
+        return None
+    return text
+
+
 # Classes for content node types
 
 class _Table(object):
-    """Table, embedded in a document or standalone as a spreadsheet."""
+    """Table, embedded in a document or standalone as a spreadsheet.
 
-    def __init__(self, parent):
+    The cell values are stored by runs of identical rows and columns:
+    row_starts holds the index of the first row of each row run, col_starts
+    the index of the first column of each column run, and columns holds one
+    list per column run with one value per row run. Rows and cells repeated
+    with table:number-rows-repeated or table:number-columns-repeated are a
+    single run and only expanded when iterating, so a formatted row repeated
+    a million times or a cell repeated across thousands of columns costs no
+    more than a single one. Empty cells at the end of rows and empty rows at
+    the end of the table are dropped, nrows and ncols give the size of the
+    remaining area.
+
+    """
+
+    def __init__(self, parent, name=None):
         self.parent = parent
+        self.name = name
+        self.nrows = 0
+        self.ncols = 0
+        self.row_starts = array('l')
+        self.col_starts = array('l')
+        self.columns = []
+        self._used_runs = 0
+
+    def _split(self, col):
+        """Start a column run at col, splitting or adding runs as needed."""
+        if col > self.ncols:
+            self.col_starts.append(self.ncols)
+            self.columns.append([None] * len(self.row_starts))
+            self.ncols = col
+        elif col < self.ncols:
+            i = bisect_right(self.col_starts, col) - 1
+            if self.col_starts[i] != col:
+                self.col_starts.insert(i + 1, col)
+                self.columns.insert(i + 1, list(self.columns[i]))
+
+    def _add_row(self, runs, count=1):
+        """Append count rows with the (value, repeat) runs of cells runs."""
+        ends = []
+        col = 0
+        for value, repeat in runs:
+            col += repeat
+            self._split(col - repeat)
+            ends.append(col)
+        self._split(col)
+
+        self.row_starts.append(self.nrows)
+        self.nrows += count
+        j = 0
+        for start, column in zip(self.col_starts, self.columns):
+            while j < len(ends) and ends[j] <= start:
+                j += 1
+            if j < len(ends):
+                column.append(runs[j][0])
+            else:
+                column.append(None)
+        if runs:
+            self._used_runs = len(self.row_starts)
+
+    def _finish(self):
+        """Drop the empty rows at the end of the table."""
+        runs = self._used_runs
+        if runs < len(self.row_starts):
+            self.nrows = self.row_starts[runs]
+            del self.row_starts[runs:]
+            for column in self.columns:
+                del column[runs:]
+
+    def _run_lengths(self, starts, end):
+        return [b - a for a, b in zip(starts, starts[1:].tolist() + [end])]
+
+    def cell(self, row, col):
+        """Return the value of the cell in row row and column col."""
+        if not (0 <= row < self.nrows and 0 <= col < self.ncols):
+            return None
+        return self.columns[bisect_right(self.col_starts, col) - 1][
+                bisect_right(self.row_starts, row) - 1]
+
+    def iter_column(self, col):
+        """Iterate over the values of column col, expanding repeated rows."""
+        if not 0 <= col < self.ncols:
+            raise IndexError('column index out of range: %d' % col)
+        column = self.columns[bisect_right(self.col_starts, col) - 1]
+        return chain(*[repeat(value, count) for value, count in
+                       zip(column, self._run_lengths(self.row_starts,
+                                                     self.nrows))])
+
+    def column(self, col):
+        """Return a list of the values of column col."""
+        return list(self.iter_column(col))
+
+    def iter_row_runs(self):
+        """Iterate over (row, count) tuples, row is a tuple of cell values
+        and count the number of times the row is repeated."""
+        widths = self._run_lengths(self.col_starts, self.ncols)
+        for i, count in enumerate(self._run_lengths(self.row_starts,
+                                                    self.nrows)):
+            row = []
+            for column, width in zip(self.columns, widths):
+                row.extend([column[i]] * width)
+            yield tuple(row), count
+
+    def iter_rows(self):
+        """Iterate over the rows as tuples of cell values."""
+        for row, count in self.iter_row_runs():
+            for i in xrange(count):
+                yield row
 
 
 class _Chart(object):
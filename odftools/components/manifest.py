@@ -21,43 +21,171 @@ class PathNotFoundError(Exception):
     pass
 
 
+# Namespaces and element names
+
+MANIFEST_NS = "{urn:oasis:names:tc:opendocument:xmlns:manifest:1.0}"
+
+_file_entry_tag = MANIFEST_NS + 'file-entry'
+_encryption_data_tag = MANIFEST_NS + 'encryption-data'
+_full_path_attribute = MANIFEST_NS + 'full-path'
+_media_type_attribute = MANIFEST_NS + 'media-type'
+_size_attribute = MANIFEST_NS + 'size'
+
+
+def _entry_from_node(node):
+    """Return (media type, size, encryption) of a manifest:file-entry."""
+    size = node.get(_size_attribute)
+    if size is not None:
+        try:
+            size = int(size)
+        except ValueError:
+            size = None
+    encryption = None
+    data = node.find(_encryption_data_tag)
+    if data is not None:
+        # e.g. {'algorithm': {'algorithm-name': 'Blowfish CFB', ...}, ...}
+        encryption = {}
+        for child in data.getiterator():
+            encryption[child.tag[len(MANIFEST_NS):]] = dict(
+                    [(key[len(MANIFEST_NS):], value)
+                     for key, value in child.items()
+                     if key.startswith(MANIFEST_NS)])
+    return node.get(_media_type_attribute, ''), size, encryption
+
+
 # Main class
 
 class Manifest(Component):
-    """Manifest of all components comprising the document.""" 
+    """Manifest of all components comprising the document.
 
-    # Operations
+    The file entries are indexed by path on first access, see get_entries().
 
-    def replace(self, search, replace):
-        """Replace all occurences of search in content by replace.
+    """
 
-        Regular expressions are fully supported for search and replace.
+    def __init__(self, data=''):
+        Component.__init__(self, data)
+        self._entries = None # path -> (media type, size, encryption)
+        self._nodes = None # path -> manifest:file-entry, once parsed
 
-        Returns the number of replacements made.
+    def _set_root(self, root):
+        Component._set_root(self, root)
+        self._entries = None
+        self._nodes = None
 
-        """
-        if not search:
-            return 0
+    root = property(Component._get_root, _set_root,
+                    doc="Root element of the component, parsed on demand.")
 
-        import re, sre_constants
+    def get_entries(self):
+        """Return a dictionary mapping the paths in the package to entries.
 
-        try:
-            _replace = re.compile(search).sub
-            search = lambda x, y: find(x, y)
-        except (sre_constants.error, TypeError), v:
-            print >>sys.stderr, 'Warning: could not compile regular expression:', v
-            return 0
-
-        count = 0
-        for node in self.content.getiterator():
-            if node.text:
+        Each entry is a (media type, size, encryption) tuple. The media type
+        may be empty, size is the uncompressed size of encrypted files
+        (otherwise None) and encryption None or a dictionary mapping the
+        names of manifest:encryption-data and its child elements to their
+        attributes. Unparsed data is indexed without building the element
+        tree, so the manifest is copied unchanged by odf.dump().
+
+        """
+        if self._entries is None:
+            entries = {}
+            source = self._open_source()
+            if source is not None:
                 try:
-                    replaced = _replace(replace, node.text)
-                    if replaced != node.text:
-                        node.text = replaced
-                        count += 1
-                except (sre_constants.error, TypeError), v:
-                    print >>sys.stderr, 'Warning: could not compile regular expression:', v
-                    return 0
-        return count
+                    for event, node in ET.iterparse(source):
+                        if node.tag == _file_entry_tag:
+                            entries[node.get(_full_path_attribute)] = \
+                                    _entry_from_node(node)
+                            node.clear()
+                finally:
+                    source.close()
+            elif self.root is not None:
+                for node in self.root.getiterator(_file_entry_tag):
+                    entries[node.get(_full_path_attribute)] = \
+                            _entry_from_node(node)
+            self._entries = entries
+        return self._entries
+
+    def get_entry(self, path):
+        """Return the (media type, size, encryption) of path or None."""
+        return self.get_entries().get(path)
+
+    def has_entry(self, path):
+        """Return True if path is listed in the manifest."""
+        return path in self.get_entries()
+
+    def get_media_type(self, path, default=None):
+        """Return the media type of path in the package or default."""
+        entry = self.get_entries().get(path)
+        if entry is None or not entry[0]:
+            return default
+        return entry[0]
+
+    def is_encrypted(self, path):
+        """Return True if path is an encrypted file of the package."""
+        entry = self.get_entries().get(path)
+        return entry is not None and entry[2] is not None
 
+    # Operations
+
+    def _find_node(self, path):
+        if self._nodes is None:
+            self._nodes = dict([(node.get(_full_path_attribute), node) for node
+                                in self.root.getiterator(_file_entry_tag)])
+        return self._nodes.get(path)
+
+    def set_entry(self, path, media_type=''):
+        """Add path to the manifest or change its media type."""
+        entries = self.get_entries()
+        if path in entries and entries[path][0] == media_type:
+            return
+        if self.root is None:
+            self.root = ET.Element(MANIFEST_NS + 'manifest')
+            entries = self._entries = {}
+        node = self._find_node(path)
+        if node is None:
+            node = ET.SubElement(self.root, _file_entry_tag)
+            node.set(_full_path_attribute, path)
+            self._nodes[path] = node
+        node.set(_media_type_attribute, media_type)
+        entries[path] = _entry_from_node(node)
+
+    def remove_entry(self, path):
+        """Remove path from the manifest."""
+        entries = self.get_entries()
+        if path not in entries:
+            return
+        self.root.remove(self._find_node(path))
+        del self._nodes[path]
+        del entries[path]
+
+    def update(self, names, get_media_type=lambda path: ''):
+        """Make the file entries match the files names of the package.
+
+        Entries of missing files and of directories without files are
+        removed, files without entry are added with the media type returned
+        by get_media_type. The root entry "/" and META-INF/ are left alone.
+        Returns True if the manifest has been changed.
+
+        """
+        entries = self.get_entries()
+        names = dict.fromkeys(names)
+        directories = {'/': True}
+        for name in names:
+            slash = name.find('/')
+            while slash >= 0:
+                directories[name[:slash + 1]] = True
+                slash = name.find('/', slash + 1)
+
+        changed = False
+        for path in entries.keys():
+            if path not in names and path not in directories:
+                self.remove_entry(path)
+                changed = True
+        for name in sorted(names):
+            if name not in self.get_entries() and name[:9] != 'META-INF/':
+                self.set_entry(name, get_media_type(name))
+                changed = True
+        return changed
+
+
+# vim: et sts=4 sw=4
@@ -20,6 +20,63 @@ class PathNotFoundError(Exception):
     pass
 
 
+# Namespaces and element names
+
+OFFICE_NS = "{urn:oasis:names:tc:opendocument:xmlns:office:1.0}"
+META_NS = "{urn:oasis:names:tc:opendocument:xmlns:meta:1.0}"
+DC_NS = "{http://purl.org/dc/elements/1.1/}"
+
+_prefixes = {META_NS: 'meta:', DC_NS: 'dc:'}
+_meta_tag = OFFICE_NS + 'meta'
+_keyword_tag = META_NS + 'keyword'
+_user_defined_tag = META_NS + 'user-defined'
+_statistic_tag = META_NS + 'document-statistic'
+
+
+def _metadata_from_events(events):
+    """Return the metadata dictionary from (event, node) iterparse events."""
+    metadata = {}
+    for event, node in events:
+        if event != 'end':
+            continue
+        if node.tag == _meta_tag:
+            break # nothing of interest follows
+        namespace = node.tag[:node.tag.find('}') + 1]
+        if namespace not in _prefixes:
+            continue
+        name = _prefixes[namespace] + node.tag[len(namespace):]
+        if node.tag == _keyword_tag:
+            if node.text:
+                metadata.setdefault(name, []).append(node.text)
+        elif node.tag == _user_defined_tag:
+            metadata.setdefault(name, {})[node.get(META_NS + 'name', u'')] = \
+                    node.text or u''
+        elif node.tag == _statistic_tag:
+            metadata[name] = dict([(key[len(META_NS):], int(value))
+                                   for key, value in node.items()
+                                   if key.startswith(META_NS) and value.isdigit()])
+        elif node.text and name not in metadata:
+            metadata[name] = node.text
+    return metadata
+
+
+def read_metadata(source):
+    """Return the metadata in the meta.xml file object source.
+
+    The dictionary maps the prefixed names of the Dublin Core and meta:
+    elements to their text, e.g. "dc:creator" or "meta:creation-date".
+    "meta:keyword" is a list, "meta:user-defined" maps the names of the user
+    defined fields to their values and "meta:document-statistic" maps the
+    counts (e.g. "page-count") to integers. source is parsed incrementally
+    up to the end of the metadata and closed when done.
+
+    """
+    try:
+        return _metadata_from_events(ET.iterparse(source, ('end',)))
+    finally:
+        source.close()
+
+
 # Main class
 
 class Meta(Component):
@@ -27,53 +84,27 @@ class Meta(Component):
 
     # Get document information
 
+    def get_metadata(self):
+        """Return the metadata of this document as dictionary.
+
+        Unparsed metadata is read without building the element tree, see
+        read_metadata().
+
+        """
+        source = self._open_source()
+        if source is not None:
+            return read_metadata(source)
+        if self.root is None:
+            return {}
+        meta = self.root.find(_meta_tag)
+        if meta is None:
+            return {}
+        return _metadata_from_events([('end', node) for node in meta])
+
     def get_author(self):
         """Return the author of this document if available."""
-        author = ''
-        if self.root:
-            for node in self.root.getElementsByTagName("dc:creator"):
-                if (node.firstChild.nodeType == node.TEXT_NODE) and node.firstChild.data:
-                    author = node.firstChild.data
-                    break
-
-        return author
+        return self.get_metadata().get('dc:creator', '')
 
     def get_extension(self):
         """Return ODF extension for given mimetype."""
         return get_extension(self.mimetype)
-
-    # Operations
-
-    def replace(self, search, replace):
-        """Replace all occurences of search in content by replace.
-
-        Regular expressions are fully supported for search and replace.
-
-        Returns the number of replacements made.
-
-        """
-        if not search:
-            return 0
-
-        import re, sre_constants
-
-        try:
-            _replace = re.compile(search).sub
-            search = lambda x, y: find(x, y)
-        except (sre_constants.error, TypeError), v:
-            print >>sys.stderr, 'Warning: could not compile regular expression:', v
-            return 0
-
-        count = 0
-        for node in self.root.getiterator():
-            if node.text:
-                try:
-                    replaced = _replace(replace, node.text)
-                    if replaced != node.text:
-                        node.text = replaced
-                        count += 1
-                except (sre_constants.error, TypeError), v:
-                    print >>sys.stderr, 'Warning: could not compile regular expression:', v
-                    return 0
-        return count
-
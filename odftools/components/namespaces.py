@@ -0,0 +1,146 @@
+# -*- coding: iso-8859-15 -*-
+
+"""Namespace prefixes of ODF and path queries using them.
+
+ElementTree stores names in Clark notation ({uri}local), so a query for
+"office:body" has to be written as
+"{urn:oasis:names:tc:opendocument:xmlns:office:1.0}body". The functions in
+this module translate prefixed names and ElementPath expressions using the
+prefixes registered in namespaces, e.g.
+
+    root.find(compile_path('office:body/office:text'))
+
+Translated paths are cached, so repeated queries cost a dictionary lookup.
+
+"""
+
+import re
+
+
+# Exceptions for this module
+
+class NamespaceError(Exception):
+    """Thrown if a name uses an unknown namespace prefix."""
+    pass
+
+
+# Prefixes as used by OpenOffice.org and LibreOffice
+namespaces = {
+    'anim': 'urn:oasis:names:tc:opendocument:xmlns:animation:1.0',
+    'calcext': 'urn:org:documentfoundation:names:experimental:calc:xmlns:calcext:1.0',
+    'chart': 'urn:oasis:names:tc:opendocument:xmlns:chart:1.0',
+    'config': 'urn:oasis:names:tc:opendocument:xmlns:config:1.0',
+    'db': 'urn:oasis:names:tc:opendocument:xmlns:database:1.0',
+    'dc': 'http://purl.org/dc/elements/1.1/',
+    'dom': 'http://www.w3.org/2001/xml-events',
+    'dr3d': 'urn:oasis:names:tc:opendocument:xmlns:dr3d:1.0',
+    'draw': 'urn:oasis:names:tc:opendocument:xmlns:drawing:1.0',
+    'fo': 'urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0',
+    'form': 'urn:oasis:names:tc:opendocument:xmlns:form:1.0',
+    'loext': 'urn:org:documentfoundation:names:experimental:office:xmlns:loext:1.0',
+    'manifest': 'urn:oasis:names:tc:opendocument:xmlns:manifest:1.0',
+    'math': 'http://www.w3.org/1998/Math/MathML',
+    'meta': 'urn:oasis:names:tc:opendocument:xmlns:meta:1.0',
+    'number': 'urn:oasis:names:tc:opendocument:xmlns:datastyle:1.0',
+    'of': 'urn:oasis:names:tc:opendocument:xmlns:of:1.2',
+    'office': 'urn:oasis:names:tc:opendocument:xmlns:office:1.0',
+    'ooo': 'http://openoffice.org/2004/office',
+    'oooc': 'http://openoffice.org/2004/calc',
+    'ooow': 'http://openoffice.org/2004/writer',
+    'presentation': 'urn:oasis:names:tc:opendocument:xmlns:presentation:1.0',
+    'script': 'urn:oasis:names:tc:opendocument:xmlns:script:1.0',
+    'smil': 'urn:oasis:names:tc:opendocument:xmlns:smil-compatible:1.0',
+    'style': 'urn:oasis:names:tc:opendocument:xmlns:style:1.0',
+    'svg': 'urn:oasis:names:tc:opendocument:xmlns:svg-compatible:1.0',
+    'table': 'urn:oasis:names:tc:opendocument:xmlns:table:1.0',
+    'text': 'urn:oasis:names:tc:opendocument:xmlns:text:1.0',
+    'xforms': 'http://www.w3.org/2002/xforms',
+    'xhtml': 'http://www.w3.org/1999/xhtml',
+    'xlink': 'http://www.w3.org/1999/xlink',
+    'xsd': 'http://www.w3.org/2001/XMLSchema',
+    'xsi': 'http://www.w3.org/2001/XMLSchema-instance',
+    }
+
+# Caches of translated names and paths
+_names = {}
+_prefixed = {}
+_paths = {}
+_MAX_PATHS = 1000
+
+# Prefixed names outside of quoted attribute values
+_name_pattern = re.compile(r"""('[^']*'|"[^"]*"|\{[^}]*\})"""
+                           r"|([A-Za-z_][\w.-]*):([A-Za-z_*][\w.-]*)")
+
+
+def register_namespace(prefix, uri):
+    """Register or replace the namespace uri for prefix."""
+    namespaces[prefix] = uri
+    _names.clear()
+    _prefixed.clear()
+    _paths.clear()
+
+
+def _translate(match):
+    if match.group(1):
+        return match.group(1)
+    prefix = match.group(2)
+    try:
+        return '{%s}%s' % (namespaces[prefix], match.group(3))
+    except KeyError:
+        raise NamespaceError('Unknown namespace prefix: %s' % prefix)
+
+
+def clark(name):
+    """Return the prefixed name (e.g. "text:p") in Clark notation.
+
+    Names without prefix are returned unchanged.
+
+    """
+    try:
+        return _names[name]
+    except KeyError:
+        pass
+    if ':' in name and name[0] != '{':
+        prefix, local = name.split(':', 1)
+        if prefix not in namespaces:
+            raise NamespaceError('Unknown namespace prefix: %s' % prefix)
+        _names[name] = '{%s}%s' % (namespaces[prefix], local)
+    else:
+        _names[name] = name
+    return _names[name]
+
+
+def prefixed(name):
+    """Return the name in Clark notation as prefixed name, if possible."""
+    try:
+        return _prefixed[name]
+    except KeyError:
+        pass
+    _prefixed[name] = name
+    if name[:1] == '{':
+        uri, local = name[1:].split('}', 1)
+        for prefix, known in namespaces.items():
+            if known == uri:
+                _prefixed[name] = '%s:%s' % (prefix, local)
+                break
+    return _prefixed[name]
+
+
+def compile_path(path):
+    """Return the ElementPath expression path with names in Clark notation.
+
+    Prefixed names in element and attribute steps are translated, quoted
+    attribute values are left alone.
+
+    """
+    try:
+        return _paths[path]
+    except KeyError:
+        pass
+    if len(_paths) >= _MAX_PATHS:
+        _paths.clear()
+    _paths[path] = _name_pattern.sub(_translate, path)
+    return _paths[path]
+
+
+# vim: et sts=4 sw=4
@@ -1,6 +1,14 @@
 # -*- coding: iso-8859-15 -*-
 
+"""Style definitions of the document and their conversion to CSS."""
+
 import os, sys
+import re
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1             # Python24
 
 try:
     import xml.etree.cElementTree as ET
@@ -8,19 +16,410 @@ except ImportError:
     from elementtree.cElementTree import ElementTree as ET
 
 from component import Component
+from namespaces import prefixed
+
+
+# Namespaces and element names
+
+OFFICE_NS = "{urn:oasis:names:tc:opendocument:xmlns:office:1.0}"
+STYLE_NS = "{urn:oasis:names:tc:opendocument:xmlns:style:1.0}"
+FO_NS = "{urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0}"
+SVG_NS = "{urn:oasis:names:tc:opendocument:xmlns:svg-compatible:1.0}"
+TEXT_NS = "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
+TABLE_NS = "{urn:oasis:names:tc:opendocument:xmlns:table:1.0}"
+DRAW_NS = "{urn:oasis:names:tc:opendocument:xmlns:drawing:1.0}"
+
+_style_tag = STYLE_NS + 'style'
+_default_style_tag = STYLE_NS + 'default-style'
+_font_face_tag = STYLE_NS + 'font-face'
+_styles_tag = OFFICE_NS + 'styles'
+_automatic_styles_tag = OFFICE_NS + 'automatic-styles'
+_body_tag = OFFICE_NS + 'body'
+_font_size = ('text-properties', FO_NS + 'font-size')
+
+# CSS properties for the formatting properties, special cases are handled
+# in _declarations()
+_css_properties = dict([(FO_NS + name, name) for name in (
+        'font-size', 'font-weight', 'font-style', 'font-variant', 'color',
+        'background-color', 'text-align', 'text-indent', 'text-transform',
+        'line-height', 'letter-spacing', 'margin', 'margin-left',
+        'margin-right', 'margin-top', 'margin-bottom', 'padding',
+        'padding-left', 'padding-right', 'padding-top', 'padding-bottom',
+        'border', 'border-left', 'border-right', 'border-top',
+        'border-bottom')])
+_css_properties[STYLE_NS + 'width'] = 'width'
+_css_properties[STYLE_NS + 'vertical-align'] = 'vertical-align'
+_text_align = {'start': 'left', 'end': 'right'}
+_generic_fonts = {'roman': 'serif', 'swiss': 'sans-serif',
+                  'modern': 'monospace', 'script': 'cursive',
+                  'decorative': 'fantasy'}
+
+# The properties elements are applied in this order, so the background of
+# a paragraph wins over the background of its text
+_property_kinds = ('text-properties', 'paragraph-properties',
+                   'table-properties', 'table-row-properties',
+                   'table-cell-properties')
+
+# HTML elements written for each style family, see content._html_elements
+_css_selectors = {
+    'paragraph': ('p', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'),
+    'text': ('span', 'a'),
+    'table': ('table',),
+    'table-row': ('tr',),
+    'table-cell': ('td',),
+    }
+
+_kind_order = dict([(kind, i) for i, kind in enumerate(_property_kinds)])
+
+# Style families of the elements and their style name attributes
+_element_families = {
+    TEXT_NS + 'p': 'paragraph', TEXT_NS + 'h': 'paragraph',
+    TEXT_NS + 'span': 'text', TEXT_NS + 'a': 'text',
+    TABLE_NS + 'table': 'table', TABLE_NS + 'table-row': 'table-row',
+    TABLE_NS + 'table-column': 'table-column',
+    TABLE_NS + 'table-cell': 'table-cell',
+    DRAW_NS + 'frame': 'graphic',
+    }
+_style_name_attributes = (TEXT_NS + 'style-name', TABLE_NS + 'style-name',
+                          DRAW_NS + 'style-name')
+
+# Number of compiled style sheets kept, see get_stylesheet()
+MAX_STYLESHEETS = 32
+
+_stylesheets = {}
+
+
+# Style definitions
+
+def _properties(node):
+    """Return the formatting properties of the style element node.
+
+    The dictionary maps (kind, attribute) to values, where kind is the local
+    name of the properties element, e.g. "text-properties".
+
+    """
+    properties = {}
+    for child in node:
+        if not child.tag.startswith(STYLE_NS):
+            continue
+        kind = child.tag[len(STYLE_NS):]
+        if kind.endswith('-properties'):
+            for key, value in child.items():
+                properties[(kind, key)] = value
+    return properties
+
+
+def _add_style(node, styles, nodes):
+    """Add the style:style element node to the dictionaries styles and nodes."""
+    key = (node.get(STYLE_NS + 'family'), node.get(STYLE_NS + 'name'))
+    styles[key] = (node.get(STYLE_NS + 'parent-style-name'), _properties(node))
+    nodes[key] = node
+
+
+def _scale(value, base):
+    """Return the percentage value applied to the length base or None."""
+    match = re.match(r'([\d.]+)([a-z]+)$', base or '')
+    try:
+        factor = float(value[:-1]) / 100
+    except ValueError:
+        return None
+    if match is None:
+        return None
+    return '%g%s' % (float(match.group(1)) * factor, match.group(2))
+
+
+def _css_class(name):
+    """Return the style name as CSS class selector."""
+    escaped = re.sub(r'([^\w-])', r'\\\1', name)
+    if escaped[:1].isdigit():
+        escaped = '\\3%s ' % escaped[0] + escaped[1:]
+    return '.' + escaped
+
+
+class StyleSheet(object):
+    """The styles of styles.xml with their inheritance resolved.
+
+    The properties of a style are those of the default style of its family,
+    overridden by those of its parents and its own, see resolve().
+    Automatic styles, which are defined in content.xml for each document,
+    can be resolved against the styles of a style sheet as well, so one
+    style sheet serves all documents of a template.
+
+    """
+
+    def __init__(self, root=None):
+        self.fonts = {}     # font face name -> CSS font-family
+        self.defaults = {}  # family -> properties
+        self.styles = {}    # (family, name) -> (parent name, properties)
+        self.nodes = {}     # (family, name) -> style element
+        self._resolved = {}
+        self._css = None
+        if root is not None:
+            for node in root.getiterator(_font_face_tag):
+                self._add_font(node)
+            styles = root.find(_styles_tag)
+            if styles is not None:
+                for node in styles:
+                    if node.tag == _default_style_tag:
+                        self.defaults[node.get(STYLE_NS + 'family')] = \
+                                _properties(node)
+                    elif node.tag == _style_tag:
+                        _add_style(node, self.styles, self.nodes)
+
+    def _add_font(self, node):
+        family = node.get(SVG_NS + 'font-family') or node.get(STYLE_NS + 'name')
+        generic = _generic_fonts.get(node.get(STYLE_NS + 'font-family-generic'))
+        if generic:
+            family += ', ' + generic
+        self.fonts[node.get(STYLE_NS + 'name')] = family
+
+    def inherit(self, family, parent, properties):
+        """Return properties applied to the resolved style parent of family.
+
+        Used to resolve automatic styles, which aren't part of the style
+        sheet, see StyleIndex.
+
+        """
+        if parent is not None and (family, parent) in self.styles:
+            resolved = dict(self.resolve(family, parent))
+        else:
+            resolved = dict(self.defaults.get(family, {}))
+        size = properties.get(_font_size)
+        if size is not None and size.endswith('%'):
+            properties = dict(properties)
+            properties[_font_size] = _scale(size, resolved.get(_font_size)) \
+                                     or size
+        resolved.update(properties)
+        return resolved
+
+    def resolve(self, family, name):
+        """Return the effective properties of the style name of family.
+
+        The result is cached, don't modify it.
+
+        """
+        key = (family, name)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+        # Walk up to the first resolved ancestor, then resolve downwards
+        chain = []
+        while key in self.styles and key not in self._resolved \
+                and key not in chain:
+            chain.append(key)
+            key = (family, self.styles[key][0])
+        for key in reversed(chain):
+            parent, properties = self.styles[key]
+            if (family, parent) not in self._resolved:
+                parent = None # unknown parent or inheritance loop
+            self._resolved[key] = self.inherit(family, parent, properties)
+        return self._resolved.get((family, name),
+                                  self.defaults.get(family, {}))
+
+    # CSS
+
+    def _declarations(self, properties):
+        """Return the CSS declarations for the formatting properties."""
+        css = {}
+        decoration = []
+        for kind in _property_kinds:
+            for (k, key), value in properties.items():
+                if k != kind:
+                    continue
+                if key in _css_properties:
+                    if key == FO_NS + 'text-align':
+                        value = _text_align.get(value, value)
+                    css[_css_properties[key]] = value
+                elif key == STYLE_NS + 'font-name' and value in self.fonts:
+                    css['font-family'] = self.fonts[value]
+                elif key == STYLE_NS + 'text-underline-style' \
+                        and value != 'none':
+                    decoration.append('underline')
+                elif key == STYLE_NS + 'text-line-through-style' \
+                        and value != 'none':
+                    decoration.append('line-through')
+        if decoration:
+            css['text-decoration'] = ' '.join(decoration)
+        return ['%s: %s' % item for item in sorted(css.items())]
+
+    def _rules(self, selectors, properties):
+        declarations = self._declarations(properties)
+        if not declarations:
+            return ''
+        return '%s { %s }\n' % (', '.join(selectors), '; '.join(declarations))
+
+    def style_rules(self, styles, resolve):
+        """Return the CSS rules of styles, resolved with resolve(family, name).
+
+        styles maps (family, name) keys like StyleSheet.styles.
+
+        """
+        rules = []
+        for family, name in sorted(styles):
+            elements = _css_selectors.get(family)
+            if elements and name:
+                selector = _css_class(name)
+                rules.append(self._rules([element + selector
+                                          for element in elements],
+                                         resolve(family, name)))
+        return ''.join(rules)
+
+    def tocss(self):
+        """Return the CSS rules of the default and common styles.
+
+        The rules are compiled once and then reused.
+
+        """
+        if self._css is None:
+            rules = [self._rules(_css_selectors[family], properties)
+                     for family, properties in sorted(self.defaults.items())
+                     if family in _css_selectors]
+            rules.append(self.style_rules(self.styles, self.resolve))
+            self._css = ''.join(rules)
+        return self._css
+
+
+class StyleIndex(object):
+    """The styles of a document with their effective properties.
+
+    The automatic styles of content.xml are added to the shared StyleSheet
+    of styles.xml. Automatic styles only inherit from common styles, so
+    each is resolved with a single lookup. All lookups are dictionary
+    accesses and results are cached.
+
+    """
+
+    def __init__(self, stylesheet, automatic=()):
+        self.stylesheet = stylesheet
+        self.styles = {} # automatic styles, like StyleSheet.styles
+        self.nodes = {}
+        self._resolved = {}
+        self._flat = {}
+        for node in automatic:
+            _add_style(node, self.styles, self.nodes)
+
+    def get_style(self, family, name):
+        """Return the style element name of family or None."""
+        key = (family, name)
+        if key in self.nodes:
+            return self.nodes[key]
+        return self.stylesheet.nodes.get(key)
+
+    def resolve(self, family, name):
+        """Return the effective properties of the style, see StyleSheet.resolve()."""
+        key = (family, name)
+        try:
+            return self._resolved[key]
+        except KeyError:
+            pass
+        if key in self.styles:
+            parent, properties = self.styles[key]
+            resolved = self.stylesheet.inherit(family, parent, properties)
+        else:
+            resolved = self.stylesheet.resolve(family, name)
+        self._resolved[key] = resolved
+        return resolved
+
+    def get_properties(self, family, name):
+        """Return the effective properties of the style with prefixed names.
+
+        The properties of all kinds are merged, e.g. "fo:font-size" and
+        "fo:margin-top" of a paragraph style. The result is cached, don't
+        modify it.
+
+        """
+        key = (family, name)
+        try:
+            return self._flat[key]
+        except KeyError:
+            pass
+        flat = {}
+        items = self.resolve(family, name).items()
+        items.sort(key=lambda item: _kind_order.get(item[0][0], -1))
+        for (kind, attribute), value in items:
+            flat[prefixed(attribute)] = value
+        self._flat[key] = flat
+        return flat
+
+    def get_element_properties(self, node):
+        """Return the effective properties of the style of element node.
+
+        node is e.g. a text:p, text:span or table:table-cell element, see
+        get_properties().
+
+        """
+        family = _element_families.get(node.tag)
+        for attribute in _style_name_attributes:
+            name = node.get(attribute)
+            if name is not None:
+                return self.get_properties(family, name)
+        return self.get_properties(family, None)
+
+    def tocss(self):
+        """Return the CSS rules of all styles, see StyleSheet.tocss()."""
+        stylesheet = self.stylesheet
+        return stylesheet.tocss() + stylesheet.style_rules(self.styles,
+                                                           self.resolve)
+
+
+def get_stylesheet(data):
+    """Return the StyleSheet of the styles.xml data.
+
+    Style sheets are cached by the hash of data, so documents based on the
+    same template share one.
+
+    """
+    key = sha1(data).digest()
+    try:
+        return _stylesheets[key]
+    except KeyError:
+        pass
+    if len(_stylesheets) >= MAX_STYLESHEETS:
+        _stylesheets.clear()
+    root = None
+    if data:
+        root = ET.fromstring(data)
+    _stylesheets[key] = StyleSheet(root)
+    return _stylesheets[key]
+
+
+def automatic_styles(events):
+    """Return the automatic style elements in the content.xml events.
+
+    Reading stops at office:body, so only the beginning of a large document
+    is parsed.
+
+    """
+    nodes = []
+    inside = False
+    for event, node in events:
+        if event == 'start':
+            if node.tag == _body_tag:
+                break
+            inside = inside or node.tag == _automatic_styles_tag
+        elif node.tag == _automatic_styles_tag:
+            break
+        elif inside and node.tag == _style_tag:
+            nodes.append(node)
+    return nodes
+
 
+# Main class
 
 class Styles(Component):
     """Style definitions component of the document."""
-    pass
 
+    def get_stylesheet(self):
+        """Return the StyleSheet of the styles, see get_stylesheet().
 
-class _Style(object):
+        Use Document.get_style_index() for the styles of a document
+        including its automatic styles.
 
-    def __init__(style, parent, xml):
-        self.parent = parent
-        node = ET.fromstring(xml) # TODO: take care of namespaces
-        self.node = parent.append(node)
-        # TODO: define the default style, if not already in xml
+        """
+        if self.is_parsed():
+            return get_stylesheet(ET.tostring(self.root))
+        return get_stylesheet(self._get_data() or '')
 
 
+# vim: et sts=4 sw=4
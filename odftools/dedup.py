@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-15 -*-
+
+"""Find duplicate and near-duplicate documents in a collection of ODF files.
+
+Each document gets a fingerprint consisting of
+
+    - a hash of content.xml in canonical form (element names with their
+      namespace URIs, sorted attributes, text without blank text nodes), so
+      XML formatting, attribute order and namespace prefixes don't matter,
+    - the hashes of the embedded images,
+    - a MinHash signature of the word shingles of the text.
+
+meta.xml and settings.xml are ignored, so copies which only differ in
+their statistics, dates or view settings are exact duplicates. Documents
+with similar text are found by locality sensitive hashing of the MinHash
+signatures, without comparing all pairs of documents.
+
+"""
+
+import os, sys
+import zlib
+
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import new as sha1             # Python24
+
+try:
+    import xml.etree.cElementTree as ET
+except ImportError:
+    from elementtree.cElementTree import ElementTree as ET
+
+import odfmeta
+
+
+# Number of words per shingle, number of values per MinHash signature and
+# number of signature values per LSH band
+SHINGLE_SIZE = 5
+SIGNATURE_SIZE = 64
+BAND_SIZE = 4
+
+
+# Fingerprints
+
+def canonical_hash(source):
+    """Return a hash of the XML file object source in canonical form.
+
+    The hash is computed bottom up while source is parsed incrementally, so
+    only the elements on the current path and their direct children are
+    held in memory. source is closed when done.
+
+    """
+    stack = [[]] # hashes of the completed children of the open elements
+    try:
+        for event, node in ET.iterparse(source, ('start', 'end')):
+            if event == 'start':
+                stack.append([])
+                continue
+            digest = sha1(node.tag.encode('utf-8'))
+            for key, value in sorted(node.items()):
+                digest.update('\0%s=%s' % (key.encode('utf-8'),
+                                           value.encode('utf-8')))
+            text = node.text
+            if text and not text.isspace():
+                digest.update('\1' + text.encode('utf-8'))
+            for child, child_hash in zip(node, stack.pop()):
+                digest.update('\2' + child_hash)
+                tail = child.tail
+                if tail and not tail.isspace():
+                    digest.update('\3' + tail.encode('utf-8'))
+            # The tail is still needed by the parent, everything else is done
+            del node[:]
+            node.attrib.clear()
+            stack[-1].append(digest.digest())
+    finally:
+        source.close()
+    return stack[0] and stack[0][0].encode('hex') or ''
+
+
+def _file_hash(source, chunk_size=65536):
+    """Return the hex SHA-1 of the data of the file object source."""
+    digest = sha1()
+    try:
+        data = source.read(chunk_size)
+        while data:
+            digest.update(data)
+            data = source.read(chunk_size)
+    finally:
+        source.close()
+    return digest.hexdigest()
+
+
+def _words(doc):
+    for number, text in doc.iter_paragraphs():
+        for word in text.lower().split():
+            yield word
+
+
+def minhash(words, size=SIGNATURE_SIZE, shingle_size=SHINGLE_SIZE):
+    """Return the MinHash signature of the word shingles of words.
+
+    One hash function is split into size bins (one permutation hashing),
+    empty bins take the value of the next bin. Returns None if there are
+    no words.
+
+    """
+    signature = [None] * size
+    window = []
+    full = False
+    for word in words:
+        window.append(word)
+        if len(window) > shingle_size:
+            del window[0]
+        elif len(window) < shingle_size:
+            continue
+        full = True
+        h = zlib.crc32(u' '.join(window).encode('utf-8')) & 0xffffffff
+        b = h % size
+        if signature[b] is None or h < signature[b]:
+            signature[b] = h
+    if not full:
+        if not window:
+            return None
+        # Shorter texts are a single shingle
+        h = zlib.crc32(u' '.join(window).encode('utf-8')) & 0xffffffff
+        signature[h % size] = h
+
+    # Densify by rotation
+    for b in xrange(size):
+        i = b
+        while signature[i % size] is None:
+            i += 1
+        signature[b] = (signature[i % size], i - b)
+    return tuple(signature)
+
+
+def similarity(signature1, signature2):
+    """Estimate the Jaccard similarity of the shingles of two signatures."""
+    same = [1 for a, b in zip(signature1, signature2) if a == b]
+    return float(len(same)) / len(signature1)
+
+
+def fingerprint(path):
+    """Return (path, key, signature, error) for the ODF file path.
+
+    key identifies exact duplicates, signature is the MinHash signature of
+    the text (None if there is none). Runs in worker processes, so errors are
+    returned as text.
+
+    """
+    try:
+        doc = odfmeta.load(path, lazy=True)
+        try:
+            source = doc.content._open_source()
+            if source is not None:
+                content_hash = canonical_hash(source)
+            else:
+                from cStringIO import StringIO
+                content_hash = canonical_hash(StringIO(doc.tostring('content')))
+            images = [_file_hash(handle.open())
+                      for handle in doc.get_embedded_objects(kind='image')]
+            images.sort()
+            signature = minhash(_words(doc))
+        finally:
+            doc.close()
+    except Exception, e:
+        return path, None, None, unicode(e)
+    return path, ' '.join([content_hash] + images), signature, None
+
+
+# Clusters
+
+def _find(parents, x):
+    while parents[x] != x:
+        parents[x] = parents[parents[x]]
+        x = parents[x]
+    return x
+
+
+def find_duplicates(paths, threshold=0.8, jobs=1, errors=None):
+    """Return the clusters of duplicate documents among the files paths.
+
+    Returns a list of (kind, paths) tuples, where kind is "exact" for
+    documents with equal content and images and "similar" for groups of
+    documents whose text has an estimated similarity of at least threshold
+    (0 disables this). The fingerprints are computed by jobs processes (0:
+    one per CPU). Files which cannot be read are skipped and, if errors is
+    a list, appended to it as (path, message) tuples.
+
+    """
+    pool = None
+    if jobs != 1 and len(paths) > 1:
+        import multiprocessing
+        pool = multiprocessing.Pool(jobs or multiprocessing.cpu_count())
+        results = pool.imap(fingerprint, paths, 4)
+    else:
+        results = (fingerprint(path) for path in paths)
+
+    groups = {}         # exact key -> paths
+    signatures = {}     # exact key -> signature
+    try:
+        for path, key, signature, error in results:
+            if error is not None:
+                if errors is not None:
+                    errors.append((path, error))
+                continue
+            groups.setdefault(key, []).append(path)
+            if signature is not None:
+                signatures[key] = signature
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    # Candidates share all values of at least one band of their signatures
+    parents = dict([(key, key) for key in groups])
+    if threshold > 0:
+        buckets = {}
+        for key, signature in signatures.items():
+            for start in xrange(0, len(signature), BAND_SIZE):
+                band = (start, signature[start:start + BAND_SIZE])
+                buckets.setdefault(band, []).append(key)
+        for keys in buckets.values():
+            for key in keys[1:]:
+                a, b = _find(parents, keys[0]), _find(parents, key)
+                if a != b and similarity(signatures[keys[0]],
+                                         signatures[key]) >= threshold:
+                    parents[b] = a
+
+    clusters = {}
+    for key in groups:
+        clusters.setdefault(_find(parents, key), []).append(key)
+    result = []
+    for keys in clusters.values():
+        if len(keys) > 1:
+            result.append(('similar', sorted(sum([groups[key] for key in keys], []))))
+    for paths in groups.values():
+        if len(paths) > 1:
+            result.append(('exact', sorted(paths)))
+    result.sort(key=lambda cluster: (cluster[0], cluster[1]))
+    return result
+
+
+# vim: et sts=4 sw=4
@@ -1,9 +1,285 @@
 #!/usr/bin/env python
 # -*- coding: iso-8859-15 -*-
 
+"""Compare two ODF documents part by part and paragraph by paragraph.
+
+The Zip file members of both documents are compared by size and CRC first,
+which for lazily loaded documents are taken from the Zip file directory, so
+identical parts are never read. If content.xml differs, the paragraphs of
+both documents are compared with a patience diff: paragraphs occurring once
+in both documents anchor the alignment, and only the short gaps between the
+anchors are compared with difflib. This keeps the comparison of long
+documents close to linear time.
+
+"""
+
+import os, sys
 import difflib
-import odf
+import zlib
+from bisect import bisect_left
+
+import odfmeta
+
+
+# Gaps between anchors up to this size (len(a) * len(b)) are compared with
+# difflib, larger ones without any common paragraphs are replaced as a whole.
+MAX_GAP_PRODUCT = 250000
+
+
+# Zip file members
+
+def _signature(doc, key, filename):
+    """Return (size, CRC) of the data of filename in doc or None."""
+    if odfmeta._is_unchanged(doc, key, filename):
+        info = doc.archive.getinfo(filename)
+        return info.file_size, info.CRC
+    if key == 'additional':
+        data = doc.additional[filename]
+    else:
+        data = doc.tostring(key)
+    if not data:
+        return None
+    return len(data), zlib.crc32(data) & 0xffffffff
+
+
+def _signatures(doc):
+    """Return a dictionary mapping the member names of doc to signatures."""
+    signatures = {}
+    for key, filename in odfmeta.file_map.items():
+        signature = _signature(doc, key, filename)
+        if signature is not None:
+            signatures[filename] = signature
+    for filename in doc.additional.keys():
+        signatures[filename] = _signature(doc, 'additional', filename)
+    return signatures
+
+
+def compare_parts(doc1, doc2):
+    """Return a sorted list of (filename, status) of the differing parts.
+
+    status is "added", "removed" or "changed". Parts are considered equal
+    if size and CRC-32 of their data are equal.
+
+    """
+    signatures1 = _signatures(doc1)
+    signatures2 = _signatures(doc2)
+    parts = []
+    for filename in signatures1:
+        if filename not in signatures2:
+            parts.append((filename, 'removed'))
+        elif signatures1[filename] != signatures2[filename]:
+            parts.append((filename, 'changed'))
+    for filename in signatures2:
+        if filename not in signatures1:
+            parts.append((filename, 'added'))
+    parts.sort()
+    return parts
+
+
+# Paragraph sequences
+
+def _paragraphs(doc):
+    """Return the texts of all paragraphs and headings of doc in order."""
+    paragraphs = list(doc.iter_paragraphs())
+    paragraphs.sort()
+    return [text for number, text in paragraphs]
+
+
+def _anchors(a, alo, ahi, b, blo, bhi):
+    """Return the longest increasing list of (i, j) with unique a[i] == b[j]."""
+    counts = {}
+    for i in xrange(alo, ahi):
+        line = a[i]
+        if line in counts:
+            counts[line][0] = -1
+        else:
+            counts[line] = [i, None]
+    for j in xrange(blo, bhi):
+        entry = counts.get(b[j])
+        if entry is not None and entry[0] >= 0:
+            if entry[1] is None:
+                entry[1] = j
+            else:
+                entry[0] = -1
+    pairs = [tuple(entry) for entry in counts.values()
+             if entry[0] >= 0 and entry[1] is not None]
+    pairs.sort()
+
+    # Patience sorting, tails[k] is the smallest j ending a sequence of k + 1
+    tails = []
+    tail_pairs = []
+    previous = {}
+    for pair in pairs:
+        k = bisect_left(tails, pair[1])
+        if k == len(tails):
+            tails.append(pair[1])
+            tail_pairs.append(pair)
+        else:
+            tails[k] = pair[1]
+            tail_pairs[k] = pair
+        previous[pair] = k and tail_pairs[k - 1] or None
+
+    anchors = []
+    pair = tail_pairs and tail_pairs[-1] or None
+    while pair is not None:
+        anchors.append(pair)
+        pair = previous[pair]
+    anchors.reverse()
+    return anchors
+
+
+def diff_sequences(a, b):
+    """Return difflib-style opcodes turning the sequence a into b.
+
+    The opcodes are (tag, i1, i2, j1, j2) tuples like those returned by
+    difflib.SequenceMatcher.get_opcodes(), see the module docstring for the
+    algorithm. Items must be hashable.
+
+    """
+    ops = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        item = stack.pop()
+        if item[0] == 'equal':
+            ops.append(item)
+            continue
+        alo, ahi, blo, bhi = item
+
+        # Common head and tail
+        start = alo
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            alo += 1
+            blo += 1
+        if alo > start:
+            ops.append(('equal', start, alo, blo - (alo - start), blo))
+        end = ahi
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+        tail = None
+        if ahi < end:
+            tail = ('equal', ahi, end, bhi, bhi + (end - ahi))
+
+        if alo < ahi and blo < bhi:
+            anchors = _anchors(a, alo, ahi, b, blo, bhi)
+            if anchors:
+                # Push the gaps and anchors in reverse order
+                if tail is not None:
+                    stack.append(tail)
+                    tail = None
+                i, j = ahi, bhi
+                for ai, bj in reversed(anchors):
+                    stack.append((ai + 1, i, bj + 1, j))
+                    stack.append(('equal', ai, ai + 1, bj, bj + 1))
+                    i, j = ai, bj
+                stack.append((alo, i, blo, j))
+            elif (ahi - alo) * (bhi - blo) <= MAX_GAP_PRODUCT:
+                matcher = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi],
+                                                  False)
+                for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+                    ops.append((tag, alo + i1, alo + i2, blo + j1, blo + j2))
+            else:
+                ops.append(('replace', alo, ahi, blo, bhi))
+        elif alo < ahi:
+            ops.append(('delete', alo, ahi, blo, blo))
+        elif blo < bhi:
+            ops.append(('insert', alo, alo, blo, bhi))
+        if tail is not None:
+            ops.append(tail)
+
+    # Join neighbouring operations, like difflib does
+    opcodes = []
+    for tag, i1, i2, j1, j2 in ops:
+        if i1 == i2 and j1 == j2:
+            continue
+        if opcodes and (opcodes[-1][0] == 'equal') == (tag == 'equal'):
+            tag1, i1, _, j1, _ = opcodes.pop()
+            if tag != 'equal':
+                tag = (i1 == i2 and 'insert') or (j1 == j2 and 'delete') \
+                      or 'replace'
+        opcodes.append((tag, i1, i2, j1, j2))
+    return opcodes
+
+
+# Main class
+
+class DocumentDiff(object):
+    """Differences between the documents doc1 and doc2.
+
+    parts lists the differing Zip file members (see compare_parts()). If
+    content.xml differs, a and b hold the paragraphs of both documents and
+    opcodes the operations turning a into b (see diff_sequences()).
+
+    """
+
+    def __init__(self, doc1, doc2):
+        self.parts = compare_parts(doc1, doc2)
+        self.a = self.b = []
+        self.opcodes = []
+        if ('content.xml', 'changed') in self.parts:
+            self.a = _paragraphs(doc1)
+            self.b = _paragraphs(doc2)
+            self.opcodes = diff_sequences(self.a, self.b)
+
+    def is_equal(self):
+        """Return True if both documents have the same data."""
+        return not self.parts
+
+    def unified(self, fromfile='', tofile='', n=3):
+        """Iterate over the lines of a unified diff of the paragraphs."""
+        matcher = difflib.SequenceMatcher(None, [], [])
+        matcher.opcodes = list(self.opcodes) # use the opcodes computed above
+        started = False
+        for group in matcher.get_grouped_opcodes(n):
+            if not [op for op in group if op[0] != 'equal']:
+                continue
+            if not started:
+                yield u'--- %s' % fromfile
+                yield u'+++ %s' % tofile
+                started = True
+            first, last = group[0], group[-1]
+            yield u'@@ -%d,%d +%d,%d @@' % (first[1] + 1, last[2] - first[1],
+                                           first[3] + 1, last[4] - first[3])
+            for tag, i1, i2, j1, j2 in group:
+                if tag == 'equal':
+                    for line in self.a[i1:i2]:
+                        yield u' ' + line
+                    continue
+                for line in self.a[i1:i2]:
+                    yield u'-' + line
+                for line in self.b[j1:j2]:
+                    yield u'+' + line
+
+
+def diff(doc1, doc2):
+    """Return a DocumentDiff of the documents doc1 and doc2."""
+    return DocumentDiff(doc1, doc2)
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    usage = "%prog [-n LINES] file1 file2\n\n" + __doc__
+    parser = OptionParser(usage)
+    parser.add_option("-n", "--context", dest="context", type="int", default=3,
+            metavar="LINES", help="Show LINES paragraphs of context.")
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error("Two files are needed.")
+
+    encoding = sys.stdout.encoding or sys.getfilesystemencoding()
+    doc1 = odfmeta.load(args[0], lazy=True)
+    doc2 = odfmeta.load(args[1], lazy=True)
+    try:
+        result = diff(doc1, doc2)
+        for filename, status in result.parts:
+            print '%s %s' % (status, filename)
+        for line in result.unified(args[0], args[1], options.context):
+            print line.encode(encoding, 'replace')
+    finally:
+        doc1.close()
+        doc2.close()
+    sys.exit(not result.is_equal())
 
 
 # vim: et sts=4 sw=4
-#EOF
@@ -1,12 +1,17 @@
 # -*- coding: iso-8859-15 -*-
 
 import os, sys
+import mimetypes
+import shutil
+from cStringIO import StringIO
+from xml.sax.saxutils import escape, quoteattr
 
 try:
     import xml.etree.cElementTree as ET
 except ImportError:
     from elementtree.cElementTree import ElementTree as ET
 
+from components.component import Replacer, ReCompileError
 from components.content import Content
 from components.manifest import Manifest
 from components.meta import Meta
@@ -39,6 +44,40 @@ def get_extension(mimetype):
 
 # Search / navigation
 
+def compile_filter(filter, ignore_case=False, limit_glob=True):
+    """Return the compiled regular expression for the given filter.
+
+    Returns None if filter is empty. See get_search_for_filter().
+
+    """
+    if not filter:
+        return None
+
+    import re, sre_constants
+    try:
+        # filter = re.escape(filter)
+        if os.sep == '\\':
+            filter = filter.replace('/', '\\\\')
+
+        if filter[-1] == '\\' and (len(filter) == 1 or filter[-2] != '\\'):
+            filter += '\\'
+
+        if is_glob(filter):
+            s = filter.replace('.', r'\.').replace('*', '.*').replace('?', '.')
+            if limit_glob and filter[0] != '*':
+                s = '^' + s
+            if limit_glob and filter[-1] != '*':
+                s += '$'
+
+            filter = s
+        if ignore_case:
+            return re.compile(filter, re.IGNORECASE)
+        return re.compile(filter)
+    except (sre_constants.error, TypeError), v:
+        # print >>sys.stderr, 'Warning: could not compile regular expression:', v
+        raise ReCompileError(v)
+
+
 def get_search_for_filter(filter, ignore_case=False, limit_glob=True, none_value=True):
     """Return a search function for the given filter.
 
@@ -56,32 +95,7 @@ def get_search_for_filter(filter, ignore_case=False, limit_glob=True, none_value
 
     """
     if filter:
-        import re, sre_constants
-        try:
-            # filter = re.escape(filter)
-            if os.sep == '\\':
-                filter = filter.replace('/', '\\\\')
-
-            if filter[-1] == '\\' and (len(filter) == 1 or filter[-2] != '\\'):
-                filter += '\\'
-
-            if is_glob(filter):
-                s = filter.replace('.', r'\.').replace('*', '.*').replace('?', '.')
-                if limit_glob and filter[0] != '*':
-                    s = '^' + s
-                if limit_glob and filter[-1] != '*':
-                    s += '$'
-
-                filter = s
-            if ignore_case:
-                find = re.compile(filter, re.IGNORECASE).search
-            else:
-                find = re.compile(filter).search
-            search = lambda x: find(x)
-        except (sre_constants.error, TypeError), v:
-            # print >>sys.stderr, 'Warning: could not compile regular expression:', v
-            # search = lambda x: False
-            raise ReCompileError(v)
+        search = compile_filter(filter, ignore_case, limit_glob).search
     else:
         search = lambda x: none_value
 
@@ -93,6 +107,44 @@ def is_glob(filter):
     return not r'\.' in filter and [c for c in '*[]?.' if c in filter]
 
 
+# HTML output
+
+HTML_BUFFER_SIZE = 16 * 1024
+
+_html_head = (u'<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN"'
+              u' "http://www.w3.org/TR/html4/strict.dtd">\n'
+              u'<html>\n<head>\n'
+              u'<meta http-equiv="Content-Type" content=%s>\n'
+              u'<title>%s</title>\n'
+              u'<style type="text/css">\n%s</style>\n</head>\n<body>')
+
+
+# Embedded objects
+
+# Kind of the files below each directory of the package
+embedded_directories = {'Pictures/': 'image', 'Media/': 'media',
+                        'ObjectReplacements/': 'replacement'}
+
+EMBEDDED_CHUNK_SIZE = 64 * 1024
+
+
+def get_embedded_kind(filename):
+    """Return the kind of embedded object filename in the package is part of.
+
+    Returns "image", "media", "replacement" (the image shown for an
+    embedded object), "object" for the files of embedded documents (e.g.
+    "Object 1/content.xml") or None.
+
+    """
+    slash = filename.find('/')
+    if slash < 0 or slash == len(filename) - 1:
+        return None
+    kind = embedded_directories.get(filename[:slash + 1])
+    if kind is None and filename.startswith('Object '):
+        return 'object'
+    return kind
+
+
 # Data structure navigation
 
 # http://www-128.ibm.com/developerworks/library/x-tipgenr.html
@@ -107,59 +159,84 @@ def doc_order_iter(node):
     return
 
 
-def translate_nodes(innode, tag_map, attr_map):
-    """Converts an ElementTree with one set of tags into another.
-
-    Starting with the root of each tree, recurses through each child
-    of innode, converts tags and attributes according to the given
-    mappings, and returns a tree of the resulting new nodes.
-
-    Returns a node (tree) called outnode.
-
-    """
- 
-    # Validate innode lil bit
-    try:
-        if innode.tag is ET.Comment:
-            return innode
-        elif innode.tag is ET.ProcessingInstruction:
-            # Not sure how to the handle this, so skip it
-            pass
-    except AttributeError:
-        # Assume innode was garbage. Return it as a comment and keep going.
-        return ET.Comment(str(innode))
-
-    # Rename tags according to tag_map
-    try:
-        tag = tag_map[innode.tag]
-    except KeyError:
-        tag = "p" # By default, handle unexpected nodes as text -- is this crazy?
-
-    outnode = ET.Element(tag)
-
-    # Rename attributes according to attr_map
-    for attr in innode.attrib:
-        outnode.set(attr_map[attr], innode.get(attr))
-
-    # Translate any children the same way
-    if len(innode):
-        for cnode in list(innode):
-            newnode = translate_nodes(cnode, tag_map, attr_map)
-            outnode.append(newnode)
+# Exceptions for this module (see also components.component.ReCompileError)
 
+class PathNotFoundError(Exception):
+    """Thrown if a file reference contains a nonexistant path."""
+    pass
 
-    return outnode
 
+class EmbeddedObject(object):
+    """Handle of a file embedded in a document, which is read on demand.
 
-# Exceptions for this module
+    name is the path in the package (e.g. "Pictures/1000.png"), key the path
+    below the directory of the kind (e.g. "1000.png"; embedded documents
+    keep their directory). Neither size nor media_type read the data, and
+    open() streams it from the Zip file of a lazily loaded document as long
+    as the file has not been replaced.
 
-class ReCompileError(Exception):
-    """Thrown if regular expression cannot be compiled."""
-    pass
+    """
 
-class PathNotFoundError(Exception):
-    """Thrown if a file reference contains a nonexistant path."""
-    pass
+    def __init__(self, doc, name, kind):
+        self.doc = doc
+        self.name = name
+        self.kind = kind
+        if kind == 'object':
+            self.key = name
+        else:
+            self.key = name[name.find('/') + 1:]
+
+    def __repr__(self):
+        return '<%s %r>' % (self.__class__.__name__, self.name)
+
+    def _get_zipinfo(self):
+        """Return the ZipInfo if the data is still the one in the archive."""
+        archive = self.doc.archive
+        additional = self.doc.additional
+        if archive is None or getattr(additional, 'zf', None) is not archive \
+           or additional.is_modified(self.name):
+            return None
+        return archive.getinfo(self.name)
+
+    def _get_size(self):
+        zipinfo = self._get_zipinfo()
+        if zipinfo is not None:
+            return zipinfo.file_size
+        return len(self.doc.additional[self.name])
+
+    size = property(_get_size, doc="Size of the data in bytes.")
+
+    def _get_media_type(self):
+        media_type = self.doc.manifest.get_media_type(self.name)
+        if media_type is None:
+            media_type = mimetypes.guess_type(self.name)[0] \
+                         or 'application/octet-stream'
+        return media_type
+
+    media_type = property(_get_media_type,
+                          doc="Media type from the manifest or the file name.")
+
+    def read(self):
+        """Return the data."""
+        return self.doc.additional[self.name]
+
+    def open(self):
+        """Return a file object for reading the data incrementally."""
+        if self._get_zipinfo() is not None:
+            return self.doc.archive.open(self.name)
+        return StringIO(self.read())
+
+    def extract(self, path):
+        """Write the data to the file path, copying it in chunks."""
+        source = self.open()
+        try:
+            f = open(path, 'wb')
+            try:
+                shutil.copyfileobj(source, f, EMBEDDED_CHUNK_SIZE)
+            finally:
+                f.close()
+        finally:
+            source.close()
 
 
 # Document base classes
@@ -185,13 +262,16 @@ class Document(object):
             styles='',     # Formatting data
             settings='',   # Application-specific data
             additional={}, # Additional bundled files (e.g. images)
-            file_dates={}  # File dates for all files and directories
+            file_dates={}, # File dates for all files and directories
+            archive=None   # Open Zip file backing lazily loaded components
             ):
 
         # Get all method parameters
         args = locals()
 
-        # Pass XML components to corresponding constructors
+        # Pass XML components to corresponding constructors.
+        # Each component may be a string or a callable returning the string,
+        # the latter is only called when the component is accessed.
         self.content = Content(content)
         self.manifest = Manifest(manifest)
         self.meta = Meta(meta)
@@ -203,31 +283,88 @@ class Document(object):
         self.mimetype = mimetype
         self.additional = additional
         self.file_dates = file_dates
+        self.archive = archive
+        self._style_index = None
+        self._embedded = None # EmbeddedObject handles, see get_embedded_objects()
+        self._embedded_names = None # names of self.additional of the handles
+        self._embedded_filters = {}
+
+    def close(self):
+        """Close the Zip file backing a lazily loaded document.
+
+        Components and additional files which have not been accessed before
+        are not available anymore afterwards.
+
+        """
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
 
     # Get non-XML components from the document
 
-    def get_embedded(self, filter=None, ignore_case=False):
+    def get_embedded_objects(self, filter=None, ignore_case=False, kind=None):
+        """Return a list of EmbeddedObject handles without reading any data.
+
+        kind limits the list to "image", "media", "object" or "replacement"
+        files, filter (see get_search_for_filter()) to the handles whose key
+        matches. The handles and the filtered lists are built once, and again
+        after files have been added to or removed from self.additional.
+
+        """
+        names = frozenset(self.additional.keys())
+        if self._embedded is None or self._embedded_names != names:
+            self.reset_embedded()
+            self._embedded_names = names
+            self._embedded = []
+            for filename in sorted(names):
+                embedded_kind = get_embedded_kind(filename)
+                if embedded_kind is not None:
+                    self._embedded.append(
+                            EmbeddedObject(self, filename, embedded_kind))
+
+        key = (filter, ignore_case, kind)
+        if key not in self._embedded_filters:
+            search = get_search_for_filter(filter, ignore_case)
+            self._embedded_filters[key] = [
+                    handle for handle in self._embedded
+                    if (kind is None or handle.kind == kind)
+                    and search(handle.key)]
+        return self._embedded_filters[key]
+
+    def reset_embedded(self):
+        """Rebuild the EmbeddedObject handles on the next access."""
+        self._embedded = None
+        self._embedded_filters = {}
+
+    def get_embedded(self, filter=None, ignore_case=False, kind='image'):
         """Return a dictionary of the objects embedded in the document.
 
-        By default, this should return all embedded objects; the
-        list/dictionary can also be filtered for a certain type, e.g. image
-        files.
+        By default, this returns the data of all images by file name; kind
+        selects other embedded objects (see get_embedded_objects()). If kind
+        is None, all of them are returned by their path in the package.
 
         The filter currently supports UNIX glob patterns like "*a[bc]?.png"
         and/or correct regular expressions like ".*a[bc].\.png$".
 
         """
-        # TODO: support other embedded objects
-        search = get_search_for_filter(filter, ignore_case)
-        return dict([(filename[9:], data)
-                    for filename, data in self.additional.items()
-                    if 'Pictures/' == filename[:9]
-                    and search(filename[9:])])
+        # Filter the names first, so lazily loaded files are only read if needed
+        handles = self.get_embedded_objects(filter, ignore_case, kind)
+        if kind is None:
+            return dict([(handle.name, handle.read()) for handle in handles])
+        return dict([(handle.key, handle.read()) for handle in handles])
 
     def get_extension(self):
         """Return ODF extension for given mimetype."""
         return get_extension(self.mimetype)
 
+    def get_author(self):
+        """Return the author of this document if available."""
+        return self.meta.get_author()
+
+    def get_metadata(self):
+        """Return the metadata of this document, see Meta.get_metadata()."""
+        return self.meta.get_metadata()
+
     # Convert the document to other formats
 
     def tostring(self, key="content", encoding="utf-8"):
@@ -244,61 +381,101 @@ class Document(object):
         Included here as well as in self.content to resemble to_html's usage.
 
         """
-        return self.content.totext()
+        return self.content.to_text(skip_blank_lines)
 
-    def tohtml(self, title="", encoding="utf-8"):
-        """Return an UTF-8 encoded HTML representation of the document."""
-        # TODO: 
-        # First, convert to ET operations
-        # Then,
-        # - Scrape up meta tags and add to headnode
-        #     '<meta http-equiv="content-type" content="text/html; charset=UTF-8">'
-        #     '<meta type="Generator" content="python-odftools" />'
-        # - Title for the page, if applicable
-        # - Convert self.styles to CSS and add to headnode as a <style type="text/css"> element
-        #     - see cssutils at the Python cheeseshop
-        # - Fix the unit test
-        #
-        # ENH: 
-        # - Support encodings other than UTF-8, and maybe Unicode
-        # - Allow named elements
-        # - A more natural way of doing the doctype declaration, if possible
-
-        attrs_odf2html = {"style-name": "class"}
-        tags_odf2html = { 
-                "a": "a",
-                "body": "body",
-                "p": "p",
-                "span": "span",
-                "table": "table",
-                "h": "h1",
-                "table-row": "tr",
-                "table-cell": "td",
-                "image": "img",
-                "list": "ol",
-                "list-item": "li" }
-
-        htmldoc = ET.Element("html")
-        headnode = ET.SubElement(htmldoc, "head")
-        titlenode = ET.SubElement(headnode, "title")
-        titlenode.text = title
-        # ENH: add meta etc. nodes to the head as needed
-
-        docbody = self.content.root.find("office:body")
-        if docbody:
-            bodynode = translate_nodes(docbody, tags_odf2html, attrs_odf2html)
-        else:
-            bodynode = ET.SubElement(htmldoc, "body")
+    def iter_text(self, skip_blank_lines=True):
+        """Iterate over the text chunks of the document content.
+
+        Unless the content has been parsed before, it is parsed incrementally
+        and never held in memory as a whole.
+
+        """
+        return self.content.iter_text(skip_blank_lines)
 
-        doctypestr = '<!DOCTYPE HTML PUBLIC "-//W3C//DTD HTML 4.01//EN" "http://www.w3.org/TR/html4/strict.dtd">\n'
-        htmlstr = ET.tostring(htmldoc, encoding=encoding)
-        return "\n".join((doctypestr, htmlstr))
+    def iter_paragraphs(self):
+        """Iterate over (number, text) of all paragraphs and headings.
+
+        See Content.iter_paragraphs().
+
+        """
+        return self.content.iter_paragraphs()
+
+    def get_style_index(self):
+        """Return the StyleIndex of the common and automatic styles.
+
+        The index is built once, unparsed content is only parsed up to
+        office:body for it. Call reset_style_index() after changing styles.
+
+        """
+        if self._style_index is None:
+            from components.styles import StyleIndex
+            self._style_index = StyleIndex(self.styles.get_stylesheet(),
+                                           self.content.get_automatic_styles())
+        return self._style_index
+
+    def reset_style_index(self):
+        """Rebuild the StyleIndex on the next call of get_style_index()."""
+        self._style_index = None
+
+    def tocss(self):
+        """Return the CSS rules for the styles used by the document.
+
+        The rules for the styles of styles.xml are compiled once per
+        template, see Styles.get_stylesheet(), only the automatic styles of
+        the document are added.
+
+        """
+        return self.get_style_index().tocss()
+
+    def iter_html(self, title="", encoding="utf-8"):
+        """Iterate over the HTML representation of the document.
+
+        The HTML is yielded as Unicode strings, encoding is the character
+        encoding announced in the head. Unless the content has been
+        parsed before, content.xml is converted while it is parsed, so the
+        first strings are available at once, see Content.iter_html().
+
+        """
+        css = self.tocss().replace('<', '\\3c ') # no end tag in the CSS
+        yield _html_head % (quoteattr('text/html; charset=' + encoding),
+                            escape(title), css)
+        for chunk in self.content.iter_html():
+            yield chunk
+        yield u'</body>\n</html>\n'
+
+    def write_html(self, stream, title="", encoding="utf-8"):
+        """Write the HTML representation of the document to stream."""
+        # TODO: Add the metadata as <meta> elements
+        buffer = []
+        size = 0
+        for chunk in self.iter_html(title, encoding):
+            buffer.append(chunk.encode(encoding, 'xmlcharrefreplace'))
+            size += len(chunk)
+            if size >= HTML_BUFFER_SIZE:
+                stream.write(''.join(buffer))
+                del buffer[:]
+                size = 0
+        stream.write(''.join(buffer))
+
+    def tohtml(self, title="", encoding="utf-8"):
+        """Return an encoded HTML representation of the document."""
+        stream = StringIO()
+        self.write_html(stream, title, encoding)
+        return stream.getvalue()
 
     # Operations
 
     def replace(self, search, replace, key="content"):
         return getattr(self, key).replace(search, replace)
 
+    def replace_all(self, replacer, key="content"):
+        """Apply all replacements of the Replacer replacer in one pass.
+
+        Returns the number of changed text nodes, see Component.replace_all().
+
+        """
+        return getattr(self, key).replace_all(replacer)
+
 
 class TextDoc(Document):
     """Textual document."""
@@ -306,7 +483,27 @@ class TextDoc(Document):
 
 class SpreadsheetDoc(Document):
     """Spreadsheet document comprising a series of tables."""
-    pass
+
+    def iter_tables(self):
+        """Iterate over the sheets of the spreadsheet.
+
+        Each sheet is a table with columnar access to the cell values, see
+        components.content._Table. Unless the content has been parsed
+        before, it is parsed incrementally and only the values are kept.
+
+        """
+        return self.content.iter_tables()
+
+    def get_tables(self):
+        """Return a list of all sheets of the spreadsheet."""
+        return self.content.get_tables()
+
+    def get_table(self, name):
+        """Return the sheet called name or None if there is no such sheet."""
+        for table in self.content.iter_tables():
+            if table.name == name:
+                return table
+        return None
 
 class PresentationDoc(Document):
     """A presentation document, comprising a series of drawings."""
@@ -326,4 +523,21 @@ class ImageDoc(Document):
     pass
 
 
+# Document classes for the mimetypes without odf_prefix
+document_classes = {'text': TextDoc, 'text-template': TextDoc,
+                    'text-master': TextDoc,
+                    'spreadsheet': SpreadsheetDoc,
+                    'spreadsheet-template': SpreadsheetDoc,
+                    'presentation': PresentationDoc,
+                    'presentation-template': PresentationDoc,
+                    'graphics': GraphicsDoc, 'graphics-template': GraphicsDoc,
+                    'chart': ChartDoc, 'formula': FormulaDoc, 'image': ImageDoc}
+
+def get_document_class(mimetype):
+    """Return the Document subclass for given mimetype."""
+    if mimetype.startswith(odf_prefix):
+        return document_classes.get(mimetype[len(odf_prefix):], Document)
+    return Document
+
+
 # vim: et sts=4 sw=4
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-15 -*-
+
+"""Extract the embedded images and objects of many ODF files in parallel.
+
+Each document is handled by a worker process, which copies the embedded
+files straight from the Zip file to disk in chunks, so neither a whole
+document nor a whole image is held in memory. The files of a document are
+written to a directory named after the document and a hash of its path:
+
+    DIRECTORY/slides-1a2b3c4d/Pictures/10000201000001D40000003C3C4CDAE5.png
+
+Optionally, thumbnails of the images are written to a "thumbnails"
+directory next to them, e.g. "thumbnails/x.gif.png" for "Pictures/x.gif".
+This needs the Python Imaging Library (PIL) and decodes only the images
+that are actually extracted.
+
+"""
+
+import os, sys
+import posixpath
+import zlib
+from cStringIO import StringIO
+
+try:
+    from PIL import Image
+except ImportError:
+    try:
+        import Image                        # PIL < 1.1.7
+    except ImportError:
+        Image = None
+
+import odfmeta
+
+
+# Exceptions for this module
+
+class ExtractError(Exception):
+    """Thrown if embedded files cannot be extracted."""
+    pass
+
+
+def get_target_directory(path, directory):
+    """Return the directory the files embedded in path are extracted to."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    digest = zlib.crc32(os.path.abspath(path)) & 0xffffffff
+    return os.path.join(directory, '%s-%08x' % (name, digest))
+
+
+def get_output_path(target, name):
+    """Return the path the package file name is extracted to below target.
+
+    Raises ExtractError if name is empty, absolute, has ".." components or
+    would otherwise end up outside of target.
+
+    """
+    if not name or posixpath.isabs(name) or '..' in name.split('/') \
+            or posixpath.normpath(name) in ('.', '..'):
+        raise ExtractError('Unsafe file name in package: %r' % name)
+    outpath = os.path.join(target, *posixpath.normpath(name).split('/'))
+    root = os.path.realpath(target)
+    if not os.path.realpath(outpath).startswith(root + os.sep):
+        raise ExtractError('Unsafe file name in package: %r' % name)
+    return outpath
+
+
+def make_thumbnail(handle, path, size):
+    """Write a PNG thumbnail of at most size x size pixels of handle to path.
+
+    Returns False if the image cannot be decoded (e.g. vector graphics).
+
+    """
+    if Image is None:
+        raise ExtractError('Thumbnails need the Python Imaging Library')
+    source = handle.open()
+    try:
+        # PIL needs a seekable file, Zip file members are not
+        data = StringIO(source.read())
+    finally:
+        source.close()
+    try:
+        image = Image.open(data)
+        image.thumbnail((size, size), Image.ANTIALIAS)
+        if image.mode not in ('1', 'L', 'LA', 'P', 'RGB', 'RGBA'):
+            image = image.convert('RGBA')
+        image.save(path, 'PNG')
+    except (IOError, ValueError):
+        return False
+    return True
+
+
+def extract_document(path, directory, filter=None, ignore_case=False,
+                     kind='image', thumbnail_size=None):
+    """Extract the embedded files of the ODF file path below directory.
+
+    Returns (path, extracted paths, error). Runs in worker processes, so
+    errors are returned as text. A file whose name would be extracted
+    outside of the target directory is an error, nothing is written for it.
+    See Document.get_embedded_objects() for filter, ignore_case and kind.
+
+    """
+    extracted = []
+    try:
+        doc = odfmeta.load(path, lazy=True)
+        try:
+            target = get_target_directory(path, directory)
+            for handle in doc.get_embedded_objects(filter, ignore_case, kind):
+                outpath = get_output_path(target, handle.name)
+                if not os.path.isdir(os.path.dirname(outpath)):
+                    os.makedirs(os.path.dirname(outpath))
+                handle.extract(outpath)
+                extracted.append(outpath)
+
+                if thumbnail_size and handle.kind == 'image':
+                    thumbnails = os.path.join(target, 'thumbnails')
+                    if not os.path.isdir(thumbnails):
+                        os.mkdir(thumbnails)
+                    # Keep the extension, x.gif and x.png are different files
+                    thumbnail = os.path.join(
+                            thumbnails, os.path.basename(outpath) + '.png')
+                    if make_thumbnail(handle, thumbnail, thumbnail_size):
+                        extracted.append(thumbnail)
+        finally:
+            doc.close()
+    except Exception, e:
+        return path, extracted, unicode(e) or e.__class__.__name__
+    return path, extracted, None
+
+
+def _extract_job(args):
+    return extract_document(*args)
+
+
+def extract_embedded(paths, directory, filter=None, ignore_case=False,
+                     kind='image', thumbnail_size=None, jobs=1, errors=None):
+    """Extract the embedded files of the ODF files paths below directory.
+
+    The documents are processed by jobs processes (0: one per CPU). Returns
+    the number of files written. Files which cannot be read are skipped
+    and, if errors is a list, appended to it as (path, message) tuples.
+
+    """
+    if thumbnail_size and Image is None:
+        raise ExtractError('Thumbnails need the Python Imaging Library')
+    args = [(path, directory, filter, ignore_case, kind, thumbnail_size)
+            for path in paths]
+    pool = None
+    if jobs != 1 and len(paths) > 1:
+        import multiprocessing
+        processes = jobs or multiprocessing.cpu_count()
+        pool = multiprocessing.Pool(processes)
+        chunksize = max(1, min(16, len(args) // (4 * processes)))
+        results = pool.imap_unordered(_extract_job, args, chunksize)
+    else:
+        results = (extract_document(*arg) for arg in args)
+
+    count = 0
+    try:
+        for path, extracted, error in results:
+            count += len(extracted)
+            if error is not None and errors is not None:
+                errors.append((path, error))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return count
+
+
+# vim: et sts=4 sw=4
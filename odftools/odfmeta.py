@@ -9,11 +9,25 @@ For more information on using odf.py from the command line, see readme.txt.
 
 import os, sys
 import codecs
+import mimetypes
 import re
+import struct
+import time
 import zipfile
+import zlib
 from cStringIO import StringIO
+from UserDict import DictMixin
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir     # Python < 3.5 with scandir module
+    except ImportError:
+        scandir = None
 
 from document import *
+from components.meta import read_metadata
 
 
 # Exceptions
@@ -37,59 +51,330 @@ file_map = {'mimetype': 'mimetype',
             'meta': 'meta.xml',
             'settings': 'settings.xml'}
 
+# Map file names to attribute names
+_file_keys = dict([(v, k) for k, v in file_map.items()])
+
+
+class ZipMember(object):
+    """Deferred access to the data of a Zip file member.
+
+    Calling the object returns the data, open() returns a file-like object
+    for reading it incrementally.
+
+    """
+
+    def __init__(self, zf, filename):
+        self.zf = zf
+        self.filename = filename
+
+    def __call__(self):
+        return self.zf.read(self.filename)
+
+    def open(self):
+        return self.zf.open(self.filename)
+
+
+class ZipMembers(DictMixin):
+    """Dictionary of Zip file members which are read on first access.
+
+    Assigned values take precedence over the Zip file data.
+
+    """
+
+    def __init__(self, zf, names):
+        self.zf = zf
+        self._unread = dict.fromkeys(names)
+        self._data = {}
+        self._modified = {}
+
+    def __getitem__(self, filename):
+        if filename in self._unread:
+            self._data[filename] = self.zf.read(filename)
+            del self._unread[filename]
+        return self._data[filename]
+
+    def __setitem__(self, filename, data):
+        self._data[filename] = data
+        self._unread.pop(filename, None)
+        self._modified[filename] = True
+
+    def __delitem__(self, filename):
+        if filename in self._unread:
+            del self._unread[filename]
+        else:
+            del self._data[filename]
+        self._modified.pop(filename, None)
+
+    def __contains__(self, filename):
+        return filename in self._unread or filename in self._data
+
+    def __iter__(self):
+        for filename in self._unread.keys():
+            yield filename
+        for filename in self._data.keys():
+            yield filename
+
+    def __len__(self):
+        return len(self._unread) + len(self._data)
+
+    def keys(self):
+        return self._unread.keys() + self._data.keys()
+
+    def is_read(self, filename):
+        """Return True if the data of filename has already been read."""
+        return filename in self._data
+
+    def is_modified(self, filename):
+        """Return True if filename has been assigned new data."""
+        return filename in self._modified
+
+
+class ZipMemberWriter(object):
+    """File-like object writing a member of the Zip file zf incrementally.
+
+    The data written is compressed and written to zf right away, so the
+    member may be larger than the available memory. The header is updated
+    by close(), so zf must be seekable and nothing else may be written to it
+    until then. Large members need a Zip file opened with allowZip64=True.
+
+    """
+
+    def __init__(self, zf, filename, date_time=None,
+                 compress_type=zipfile.ZIP_DEFLATED):
+        if date_time is None:
+            date_time = time.localtime(time.time())[:6]
+        zipinfo = zipfile.ZipInfo(filename, date_time)
+        zipinfo.compress_type = compress_type
+        zipinfo.external_attr = 0600 << 16
+        zipinfo.file_size = zipinfo.compress_size = zipinfo.CRC = 0
+        zipinfo.header_offset = zf.fp.tell()
+        zf._writecheck(zipinfo)
+        zf._didModify = True
+
+        # Reserve room for the 64 bit sizes if they may be needed
+        self._zip64 = zf._allowZip64
+        zf.fp.write(zipinfo.FileHeader(self._zip64))
+        if compress_type == zipfile.ZIP_DEFLATED:
+            self._compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION,
+                                                zlib.DEFLATED, -15)
+        else:
+            self._compressor = None
+        self.zf = zf
+        self.zipinfo = zipinfo
+
+    def write(self, data):
+        zipinfo = self.zipinfo
+        zipinfo.file_size += len(data)
+        zipinfo.CRC = zlib.crc32(data, zipinfo.CRC) & 0xffffffff
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        zipinfo.compress_size += len(data)
+        self.zf.fp.write(data)
+
+    def close(self):
+        """Finish the member and add it to the directory of the Zip file."""
+        if self.zf is None:
+            return
+        zf, zipinfo = self.zf, self.zipinfo
+        if self._compressor is not None:
+            data = self._compressor.flush()
+            zipinfo.compress_size += len(data)
+            zf.fp.write(data)
+
+        position = zf.fp.tell()
+        zf.fp.seek(zipinfo.header_offset)
+        zf.fp.write(zipinfo.FileHeader(self._zip64))
+        zf.fp.seek(position)
+        zf.filelist.append(zipinfo)
+        zf.NameToInfo[zipinfo.filename] = zipinfo
+        self.zf = None
+
+
+def load(src, lazy=False):
+    """Return a Document representing the contents of the ODF file src.
+
+    If lazy is True, the Zip file stays open and each component or
+    additional file is only read (and parsed) when it is accessed for the
+    first time. Call close() on the Document when done with it.
 
-def load(src):
-    """Return a Document representing the contents of the ODF file src."""
+    """
     try:
         zf = zipfile.ZipFile(src, 'r')
     except IOError, e:
         raise ReadError(e)
 
-    names = zf.namelist()
     obj_dict = {}
     obj_dict["additional"] = {}
     obj_dict["file_dates"] = {}
     if isinstance(src, basestring) and len(src) < 1000 and os.path.isfile(src):
         obj_dict["file"] = src
-    inverted = dict([(v,k) for k,v in file_map.items()])
-    file_dates = {}
 
-    for filename in names:
+    additional = []
+    for info in zf.infolist():
+        filename = info.filename
         # If the Zip entry is a special ODF file, store it's own attribute name
-        if filename in inverted:
-            obj_dict[inverted[filename]] = zf.read(filename)
+        if filename in _file_keys:
+            if lazy and filename != 'mimetype':
+                obj_dict[_file_keys[filename]] = ZipMember(zf, filename)
+            else:
+                obj_dict[_file_keys[filename]] = zf.read(filename)
+        elif lazy:
+            additional.append(filename)
         else:
             obj_dict["additional"][filename] = zf.read(filename)
-        obj_dict["file_dates"][filename] = zf.getinfo(filename).date_time
-    zf.close()
+        obj_dict["file_dates"][filename] = info.date_time
+
+    if lazy:
+        obj_dict["additional"] = ZipMembers(zf, additional)
+        obj_dict["archive"] = zf
+    else:
+        zf.close()
 
-    obj = Document(**obj_dict)
+    obj = get_document_class(obj_dict.get("mimetype", ''))(**obj_dict)
     return obj
 
 
+def _is_unchanged(doc, key, filename):
+    """Return True if the data of filename in doc.archive is still valid."""
+    src = doc.archive
+    if src is None:
+        return False
+    if key == 'additional':
+        additional = doc.additional
+        return isinstance(additional, ZipMembers) and additional.zf is src \
+               and not additional.is_modified(filename)
+    if key == 'mimetype':
+        return filename in src.NameToInfo and src.read(filename) == doc.mimetype
+    comp = getattr(doc, key)
+    source = getattr(comp, 'source', None)
+    return isinstance(source, ZipMember) and source.zf is src \
+           and source.filename == filename and not comp.is_parsed()
+
+
+def _update_manifest(doc):
+    """Add the files of doc to its manifest and remove the missing ones.
+
+    The manifest stays unparsed (and is copied as is) if nothing changed.
+    Documents without manifest are left alone.
+
+    """
+    if not doc.manifest.source:
+        return False
+    names = doc.additional.keys()
+    for key in ('content', 'styles', 'meta', 'settings'):
+        if getattr(doc, key).source:
+            names.append(file_map[key])
+    return doc.manifest.update(names, lambda name: name[-1:] != '/' and
+                               mimetypes.guess_type(name)[0] or '')
+
+
+def _get_date_time(doc, filename):
+    """Return the date of filename in doc, the current time for new files."""
+    try:
+        return doc.file_dates[filename]
+    except KeyError:
+        return time.localtime(time.time())[:6]
+
+
+def iter_raw_member(src, filename, chunk_size=65536):
+    """Iterate over the compressed data of filename in the Zip file src."""
+    info = src.getinfo(filename)
+    src.fp.seek(info.header_offset)
+    fheader = struct.unpack(zipfile.structFileHeader,
+                            src.fp.read(zipfile.sizeFileHeader))
+    src.fp.seek(fheader[zipfile._FH_FILENAME_LENGTH] +
+                fheader[zipfile._FH_EXTRA_FIELD_LENGTH], 1)
+    size = info.compress_size
+    while size > 0:
+        # Seek again, the caller may use src.fp in between
+        offset = src.fp.tell()
+        data = src.fp.read(min(size, chunk_size))
+        if not data:
+            raise ReadError('Truncated Zip file member: %s' % filename)
+        size -= len(data)
+        yield data
+        src.fp.seek(offset + len(data))
+
+
+def write_raw_member(zf, zipinfo, chunks):
+    """Add a member to the Zip file zf from its compressed data.
+
+    zipinfo must hold the compression type, CRC and sizes of the member,
+    chunks is an iterable of strings with the compressed data.
+
+    """
+    zipinfo.header_offset = zf.fp.tell()
+    zip64 = zipinfo.file_size > zipfile.ZIP64_LIMIT or \
+            zipinfo.compress_size > zipfile.ZIP64_LIMIT
+    zf.fp.write(zipinfo.FileHeader(zip64))
+    for data in chunks:
+        zf.fp.write(data)
+    zf.filelist.append(zipinfo)
+    zf.NameToInfo[zipinfo.filename] = zipinfo
+    zf._didModify = True
+
+
+def _copy_member(src, zf, filename, date_time):
+    """Copy the compressed data of filename from Zip file src to zf as is."""
+    info = src.getinfo(filename)
+    zipinfo = zipfile.ZipInfo(filename, date_time)
+    zipinfo.compress_type = info.compress_type
+    zipinfo.CRC = info.CRC
+    zipinfo.compress_size = info.compress_size
+    zipinfo.file_size = info.file_size
+    write_raw_member(zf, zipinfo, iter_raw_member(src, filename))
+
+
 def dump(doc, dst):
     """Write the ODF content of doc to a Zip file named dst.
 
     The output file is a full ODF file and readable by load() and OOo.
 
+    Files of a lazily loaded document which have not been modified (or
+    components which have not been parsed) are copied from the source
+    archive without decompressing and compressing them again.
+
     """
+    if doc.archive is not None and isinstance(dst, basestring) and doc.file \
+            and os.path.abspath(dst) == os.path.abspath(doc.file):
+        # Don't truncate the source archive before everything is copied
+        data = dumps(doc)
+        try:
+            f = open(dst, 'wb')
+        except IOError, e:
+            raise WriteError(e)
+        try:
+            f.write(data)
+        finally:
+            f.close()
+        return
+
     try:
       zf = zipfile.ZipFile(dst, 'w')
     except IOError, e:
       raise WriteError(e)
 
+    _update_manifest(doc)
+
     # Zip document attributes
     for key, filename in file_map.items():
         if filename:
-            zipinfo = zipfile.ZipInfo(filename, doc.file_dates[filename])
+            if _is_unchanged(doc, key, filename):
+                _copy_member(doc.archive, zf, filename, doc.file_dates[filename])
+                continue
+            zipinfo = zipfile.ZipInfo(filename, _get_date_time(doc, filename))
             data = doc.tostring(key, encoding='utf-8')
             if len(data) != 0:
                 zipinfo.compress_type = zipfile.ZIP_DEFLATED
             zf.writestr(zipinfo, data)
 
     # Zip additional files
-    for filename, data in doc.additional.items():
-        zipinfo = zipfile.ZipInfo(filename, doc.file_dates[filename])
+    for filename in doc.additional.keys():
+        if _is_unchanged(doc, 'additional', filename):
+            _copy_member(doc.archive, zf, filename, doc.file_dates[filename])
+            continue
+        data = doc.additional[filename]
+        zipinfo = zipfile.ZipInfo(filename, _get_date_time(doc, filename))
         if len(data) != 0:
             zipinfo.compress_type = zipfile.ZIP_DEFLATED
         zf.writestr(zipinfo, data)
@@ -97,14 +382,39 @@ def dump(doc, dst):
     zf.close()
 
 
-def loads(str):
-    """Return a Document representing the ODF file contents in binary str."""
+def loads(str, lazy=False):
+    """Return a Document representing the ODF file contents in binary str.
+
+    See load() for the lazy option.
+
+    """
     src = StringIO(str)
-    obj = load(src)
-    src.close()
+    obj = load(src, lazy)
+    if not lazy:
+        src.close()
     return obj
 
 
+def get_metadata(src):
+    """Return the metadata of the ODF file src (a file name or file object).
+
+    Only the Zip file directory and meta.xml are read, which is much faster
+    than load() for large documents. See Meta.get_metadata() for the
+    dictionary returned.
+
+    """
+    try:
+        zf = zipfile.ZipFile(src, 'r')
+    except (IOError, zipfile.BadZipfile), e:
+        raise ReadError(e)
+    try:
+        if file_map['meta'] not in zf.NameToInfo:
+            return {}
+        return read_metadata(zf.open(file_map['meta']))
+    finally:
+        zf.close()
+
+
 def dumps(doc):
     """Return a binary string containing the ODF content of doc (Zip file)."""
     dst = StringIO()
@@ -117,21 +427,218 @@ def dumps(doc):
 # File format conversions
 
 def OdfToText(filename, skip_blank_lines=True):
-    obj = load(filename)
-    return obj.totext(skip_blank_lines)
+    """Return the text of the ODF file filename.
+
+    content.xml is parsed incrementally while it is decompressed.
+
+    """
+    obj = load(filename, lazy=True)
+    try:
+        return obj.totext(skip_blank_lines)
+    finally:
+        obj.close()
 
 
 def OdfToHtml(filename, title=''):
-    obj = load(filename)
-    return obj.tohtml(title)
+    obj = load(filename, lazy=True)
+    try:
+        return obj.tohtml(title)
+    finally:
+        obj.close()
+
+
 
+# Search and replace
+
+def read_replacements(filename, encoding='utf-8'):
+    """Return a Replacer for the search strings in the text file filename.
+
+    Each line contains a literal search string and its replacement, separated
+    by a tab. Empty lines and lines starting with # are ignored.
+
+    """
+    try:
+        f = codecs.open(filename, 'r', encoding)
+    except IOError, e:
+        raise ReadError(e)
+
+    pairs = []
+    try:
+        for line in f:
+            line = line.rstrip(u'\r\n')
+            if not line or line[0] == u'#':
+                continue
+            search, tab, replace = line.partition(u'\t')
+            pairs.append((search, replace))
+    finally:
+        f.close()
+
+    return Replacer(pairs)
 
 
 # Path navigation
 # (These are useful on Windows where the command shell is weak.)
 
+class DirectoryIndex(object):
+    """Index of the size and modification time of previously found files.
+
+    check() tells if a file is new or has changed since the index has been
+    saved and remembers its current state, save() writes the remembered
+    state of all checked files. Entries of files not checked again are kept.
+
+    The index file contains one tab-separated line with size, modification
+    time and UTF-8 encoded file name per file.
+
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        self.found = {}
+        if os.path.isfile(filename):
+            try:
+                f = open(filename, 'rb')
+            except IOError, e:
+                raise ReadError(e)
+            try:
+                for line in f:
+                    size, mtime, path = line.rstrip('\n').split('\t', 2)
+                    self.entries[path.decode('utf-8')] = (int(size), float(mtime))
+            finally:
+                f.close()
+
+    def check(self, path, stat=None):
+        """Return True if path is new or changed, stat defaults to os.stat()."""
+        if stat is None:
+            stat = os.stat(path)
+        state = (stat.st_size, stat.st_mtime)
+        self.found[path] = state
+        return self.entries.get(path) != state
+
+    def discard(self, path):
+        """Forget the state of path, so it will be checked as new next time."""
+        self.found.pop(path, None)
+        self.entries.pop(path, None)
+
+    def save(self):
+        """Write the index including the state of all checked files."""
+        self.entries.update(self.found)
+        self.found = {}
+        try:
+            f = open(self.filename, 'wb')
+        except IOError, e:
+            raise WriteError(e)
+        try:
+            for path, (size, mtime) in self.entries.iteritems():
+                if not isinstance(path, unicode):
+                    path = path.decode(sys.getfilesystemencoding())
+                f.write('%d\t%r\t%s\n' % (size, mtime, path.encode('utf-8')))
+        finally:
+            f.close()
+
+
+class FileFilter(object):
+    """Precompiled file filter for list_directory().
+
+    File names are checked for an ODF extension by a set lookup before the
+    filter expression is searched, the resulting paths must match include
+    and must not match exclude. See list_directory() for the filter syntax.
+
+    """
+
+    def __init__(self, filter=None, ignore_case=False, include=None,
+                 exclude=None, extensions=None):
+        if extensions is None:
+            extensions = odf_formats.keys()
+        if ignore_case:
+            extensions = [extension.lower() for extension in extensions]
+        self.extensions = frozenset(extensions)
+        self.ignore_case = ignore_case
+        self.search = self._get_search(filter, ignore_case)
+        self.search_include = self._get_search(include, ignore_case, False)
+        self.search_exclude = self._get_search(exclude, ignore_case, False)
+
+    def _get_search(self, filter, ignore_case, limit_glob=True):
+        regex = compile_filter(filter, ignore_case, limit_glob)
+        return regex is not None and regex.search or None
+
+    def match(self, path, name=None):
+        """Return True if the file path (with file name name) matches."""
+        if name is None:
+            name = os.path.basename(path)
+        return bool(self.filter(path[:len(path) - len(name)], [name]))
+
+    def filter(self, prefix, names):
+        """Return prefix + name for all matching file names in names."""
+        extensions = self.extensions
+        search = self.search
+        search_include = self.search_include
+        search_exclude = self.search_exclude
+
+        # Comprehensions and filter() keep the loops in C as far as possible
+        if self.ignore_case:
+            names = [name for name in names if '.' in name and
+                     name[name.rfind('.') + 1:].lower() in extensions]
+        else:
+            names = [name for name in names if '.' in name and
+                     name[name.rfind('.') + 1:] in extensions]
+        if search is not None and names:
+            names = filter(search, names)
+        if not names:
+            return []
+
+        paths = [prefix + name for name in names]
+        if search_include is not None:
+            paths = filter(search_include, paths)
+        if search_exclude is not None:
+            paths = [path for path in paths if not search_exclude(path)]
+        return paths
+
+
+def _walk(top):
+    """Walk the directory tree like os.walk().
+
+    Yields (root, dirs, files, stat), stat(name) returns the status of a
+    file in root. Uses scandir if available, which knows the entry types
+    without calling stat and caches the status on Windows.
+
+    """
+    if scandir is None:
+        for root, dirs, files in os.walk(top):
+            yield (root, dirs, files,
+                   lambda name, root=root: os.stat(os.path.join(root, name)))
+        return
+
+    try:
+        entries = list(scandir(top))
+    except OSError:
+        return
+    dirs = []
+    files = []
+    stats = {}
+    links = {} # symbolic links to directories aren't followed, like os.walk()
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                dirs.append(entry.name)
+                if not entry.is_dir(follow_symlinks=False):
+                    links[entry.name] = True
+            else:
+                files.append(entry.name)
+                stats[entry.name] = entry
+        except OSError:
+            pass
+    yield top, dirs, files, lambda name: stats[name].stat()
+    for name in dirs:
+        if name in links:
+            continue
+        for result in _walk(os.path.join(top, name)):
+            yield result
+
+
 def list_directory(directory, filter=None, ignore_case=False, recursive=False,
-                   must_be_directory=False, include=None, exclude=None):
+                   must_be_directory=False, include=None, exclude=None,
+                   index=None):
     """Scan a directory for ODF files.
 
     filter may be a relative or absolute directory or filename, a glob and/or
@@ -146,6 +653,11 @@ def list_directory(directory, filter=None, ignore_case=False, recursive=False,
     Every file that was found by the filter, must match include and must not
     match exclude (in this order).
 
+    filter may also be a FileFilter, which replaces ignore_case, include and
+    exclude and can be reused for many directories.
+
+    If index is a DirectoryIndex, only new or changed files are returned.
+
     """
     directory = get_win_root_directory(directory)
     if must_be_directory and not os.path.isdir(directory):
@@ -160,32 +672,37 @@ def list_directory(directory, filter=None, ignore_case=False, recursive=False,
         if prefix[-1] not in "/\\":
             prefix += _pathsep
 
-    if os.path.isfile(prefix + filter):
+    if not isinstance(filter, FileFilter) and filter and \
+            os.path.isfile(prefix + filter):
+        if index is not None and not index.check(prefix + filter):
+            return []
         return [prefix + filter]
 
     if not os.path.isdir(directory):
         return []
 
-    search_user = get_search_for_filter(filter, ignore_case)
-    odf_extensions = r".*\.(?:" + "|".join(odf_formats.keys()) + ")$"
-    search_odf = get_search_for_filter(odf_extensions, ignore_case)
-
-    search_include = get_search_for_filter(include, ignore_case, False)
-    search_exclude = get_search_for_filter(exclude, ignore_case, False, False)
+    if isinstance(filter, FileFilter):
+        file_filter = filter
+    else:
+        file_filter = FileFilter(filter, ignore_case, include, exclude)
 
     found_files = []
     root = os.path.abspath(unicode(directory))
     root_level = root.count(_pathsep)
     if _pathsep == root[-1]:
         root_level -= 1
-    for root, dirs, files in os.walk(unicode(directory)):
-        files = [directory == '.' and os.path.join(root, f)[2:] or
-                 os.path.join(root, f) for f in files if search_user(f) and
-                 search_odf(f)]
-        if files:
-            files = [f for f in files if search_include(f) and
-                     not search_exclude(f)]
-            found_files.extend(files)
+    for root, dirs, files, stat in _walk(unicode(directory)):
+        if _pathsep == root[-1]:
+            prefix = root
+        else:
+            prefix = root + _pathsep
+        if directory == '.':
+            prefix = prefix[2:]
+        files = file_filter.filter(prefix, files)
+        if files and index is not None:
+            files = [path for path in files
+                     if index.check(path, stat(path[len(prefix):]))]
+        found_files.extend(files)
 
         level = root.count(_pathsep) - root_level
         if _pathsep == root[-1]:
@@ -298,6 +815,332 @@ def echo(msg, stream=sys.stderr, encoding=sys.stderr.encoding):
 # -----------------------------------------------------------------------------
 # Commmand line processing
 
+def process_file(infile, options, fs_encoding, verbosity=1, stdin=''):
+    """Apply the actions given by the command line options to infile.
+
+    stdin contains the file data if infile has been read from standard input.
+
+    Return the author of the document if options.list_author is set, an empty
+    string otherwise.
+
+    """
+    from optparse_optional import OptionalOptionParser
+    is_true = OptionalOptionParser.is_true
+
+    if verbosity == 2:
+        echo('Processing %s' % infile)
+
+    # Listing authors only needs meta.xml
+    if is_true(options.list_author) and not (options.replace
+            or options.replacer or is_true(options.totxt)
+            or is_true(options.tohtml) or is_true(options.toxml)
+            or is_true(options.toodf)):
+        try:
+            if stdin:
+                return get_metadata(StringIO(stdin)).get('dc:creator', u'')
+            return get_metadata(infile).get('dc:creator', u'')
+        except ReadError, e:
+            echo('Warning: Skipping input file "%s": %s' % (infile, e))
+            return ''
+
+    # Conversions are cached unless the document gets modified
+    cache = None
+    if options.cache and not stdin and not options.replace \
+            and not options.replacer and not is_true(options.toodf):
+        from cache import CacheError, open_cache
+        # The HTML has the file name as title, a hash key doesn't
+        name = os.path.basename(infile)
+        if not isinstance(name, unicode):
+            name = name.decode(fs_encoding, 'replace')
+        cache_kinds = {'html': u'html:' + name}
+        kinds = [kind for kind, option in (('txt', options.totxt),
+                 ('html', options.tohtml), ('xml', options.toxml),
+                 ('author', options.list_author)) if is_true(option)]
+        content = {}
+        try:
+            cache = open_cache(options.cache, options.cache_size)
+            key = cache.key(infile, options.cache_hash)
+            for kind in kinds:
+                data = cache.get(key, cache_kinds.get(kind, kind))
+                if data is None:
+                    break
+                content[kind] = data
+        except CacheError, e:
+            echo('Warning: could not use cache: %s' % e)
+            cache = None
+        if cache is not None and len(content) == len(kinds):
+            if verbosity == 2:
+                echo('Using cached data for %s' % infile)
+            author = content.pop('author', u'')
+            _write_content(content, infile, options, fs_encoding, verbosity)
+            return author
+
+    try:
+        if stdin:
+            doc = loads(stdin, lazy=True)
+        else:
+            doc = load(infile, lazy=True)
+    except zipfile.BadZipfile, e:
+        echo('Warning: Skipping input file "%s": %s' % (infile, e))
+        return ''
+
+    try:
+        content, author, changed = _convert_document(doc, infile, options,
+                                                     verbosity)
+        if cache is not None:
+            try:
+                for kind, data in content.items():
+                    cache.set(key, cache_kinds.get(kind, kind), data)
+                if is_true(options.list_author):
+                    cache.set(key, 'author', author)
+            except CacheError, e:
+                echo('Warning: could not use cache: %s' % e)
+        _write_content(content, infile, options, fs_encoding, verbosity,
+                       changed, stdin, doc.get_extension())
+    finally:
+        doc.close()
+
+    return author
+
+
+def _convert_document(doc, infile, options, verbosity):
+    """Return the (content, author, changed) of doc for process_file().
+
+    content maps output extensions to the converted documents.
+
+    """
+    from optparse_optional import OptionalOptionParser
+    is_true = OptionalOptionParser.is_true
+
+    author = ''
+    content = {}
+    changed = False
+
+    if options.replace:
+        changed = doc.replace(options.replace[0], options.replace[1])
+    if options.replacer:
+        options.replacer.reset()
+        changed = doc.replace_all(options.replacer) or changed
+        if verbosity == 2:
+            for search, count in sorted(options.replacer.counts.items()):
+                if count:
+                    echo('Replaced "%s" %d times in %s' % (search, count, infile))
+
+    if is_true(options.totxt):
+        content['txt'] = doc.totext()
+    if is_true(options.tohtml):
+        content['html'] = doc.tohtml(os.path.basename(infile))
+    if is_true(options.toxml):
+        content['xml'] = doc.content.tostring(encoding='utf-8')
+    if is_true(options.toodf) or (changed and not content):
+        content['odf'] = dumps(doc)
+    if is_true(options.list_author):
+        author = doc.get_author()
+
+    return content, author, changed
+
+
+def _write_content(content, infile, options, fs_encoding, verbosity,
+                   changed=False, stdin='', odf_extension=''):
+    """Write the converted documents in content for process_file().
+
+    odf_extension is the ODF extension of the document read from stdin.
+
+    """
+    if content:
+        for extension, output in content.items():
+            filename = infile
+            output_encoding = ''
+
+            if options.filename:
+                filename = options.filename
+
+            optional = getattr(options, 'to' + extension)
+            if isinstance(optional, tuple):
+                filename = optional[1]
+            elif stdin and isinstance(options.stdin, tuple):
+                filename = options.stdin[1]
+            elif options.extension_append or options.extension_replace:
+                if 'odf' == extension:
+                    if stdin and 'stdin' == infile:
+                        extension_new = unicode(odf_extension)
+                        if not extension_new:
+                            extension_new = u'odf'
+                    else:
+                        extension_new = infile.split('.')[-1]
+                else:
+                    extension_new = unicode(extension)
+                if options.extension_append:
+                    filename += u'.' + extension_new
+                else:
+                    splitted = filename.split('.')
+                    if len(splitted) == 1:
+                        filename += u'.' + extension_new
+                    else:
+                        filename = u'.'.join(splitted[:-1]) + u'.' + extension_new
+
+            if options.directory:
+                filename = os.path.join(options.directory,
+                                        os.path.basename(filename))
+
+            if filename == infile and (extension != 'odf' or not options.force):
+                if extension != 'odf':
+                    if not options.stdout or options.filename:
+                        echo('Warning: Cannot overwrite input file with '\
+                             'text content (pass --file, --extension-'\
+                             'append or --extension-replace)')
+                elif changed:
+                    echo('Warning: Not allowed to overwrite input '\
+                         'file (pass --force to allow)')
+
+            elif filename != infile and not options.force \
+                    and os.path.isfile(filename):
+                echo('Warning: Skipping already existing output file "%s"'\
+                     % filename)
+
+            else:
+                if options.force and verbosity == 2 and os.path.isfile(filename):
+                    echo('Warning: Overwriting existing output file "%s"'\
+                         % filename)
+
+                if extension in ['xml','html']:
+                    try:
+                        outfile = file(filename, 'w')
+                    except IOError, e:
+                        raise WriteError(e)
+                    output_encoding = 'utf-8'
+                elif extension == 'odf':
+                    try:
+                        outfile = file(filename, 'wb')
+                    except IOError, e:
+                        raise WriteError(e)
+                else:
+                    try:
+                        outfile = codecs.open(filename, 'w', fs_encoding, 'replace')
+                    except IOError, e:
+                        raise WriteError(e)
+
+                if verbosity == 2:
+                    echo('Writing %s to %s' % (extension, filename))
+
+                try:
+                    print >>outfile, output, # important: do not print linebreak!
+                finally:
+                    outfile.close()
+
+            if options.stdout and extension != 'odf':
+                print_unicode(sys.stdout, output, fs_encoding, output_encoding)
+
+
+def _process_job(args):
+    """Call process_file(), returning failures as text.
+
+    Runs in worker processes, and in the main process for a single job.
+
+    """
+    infile, options, fs_encoding, verbosity = args
+    try:
+        return infile, process_file(infile, options, fs_encoding, verbosity), None
+    except Exception, e:
+        return infile, '', unicode(e)
+
+
+def _update_search_index(options, files, verbosity):
+    """Index files in options.search_index and print options.search results.
+
+    Returns False if the index could not be used.
+
+    """
+    from search import SearchError, SearchIndex
+    try:
+        index = SearchIndex(options.search_index)
+    except SearchError, e:
+        echo('Warning: could not open search index: %s' % e)
+        return False
+
+    try:
+        if files:
+            errors = []
+            count = index.update(files, options.jobs, errors)
+            for infile, error in errors:
+                echo('Warning: Could not process input file "%s": %s'
+                     % (infile, error))
+            if verbosity == 2:
+                echo('Indexed %d new or changed of %d input files'
+                     % (count, len(files)))
+
+        if options.search:
+            try:
+                results = index.search(options.search)
+            except SearchError, e:
+                echo('Warning: invalid search query: %s' % e)
+                return False
+            fs_encoding = sys.stdout.encoding or sys.getfilesystemencoding()
+            for path, number, text in results:
+                print_unicode(sys.stdout, u'%s:%d: %s' % (path, number + 1, text),
+                              fs_encoding)
+            if verbosity == 2:
+                echo('%d matching paragraphs' % len(results))
+    finally:
+        index.close()
+    return True
+
+
+def _print_duplicates(options, files, fs_encoding, verbosity):
+    """Print the clusters of duplicate files to options.duplicates or stdout."""
+    from dedup import find_duplicates
+    errors = []
+    clusters = find_duplicates(sorted(files), options.similarity, options.jobs,
+                               errors)
+    for infile, error in errors:
+        echo('Warning: Could not process input file "%s": %s' % (infile, error))
+
+    content = []
+    for kind, paths in clusters:
+        label = {'exact': u'Duplicates', 'similar': u'Similar'}[kind]
+        content.append(u'%s (%d files):' % (label, len(paths)))
+        content.extend(paths)
+    output = unicode(os.linesep).join(content)
+    if verbosity == 2:
+        echo('%d groups of duplicate or similar files found' % len(clusters))
+    if not output:
+        return
+
+    if isinstance(options.duplicates, tuple):
+        filename = options.duplicates[1] # first optional argument
+        if not options.force and os.path.isfile(filename):
+            echo('Warning: Skipping already existing output file "%s"' % filename)
+            return
+        try:
+            outfile = codecs.open(filename, 'w', fs_encoding, errors='replace')
+        except IOError, e:
+            raise WriteError(e)
+        outfile.write(output)
+        outfile.close()
+    else:
+        print_unicode(sys.stdout, output, fs_encoding)
+
+
+def _extract_embedded(options, files, verbosity):
+    """Extract the embedded images of files to options.extract."""
+    from extract import ExtractError, extract_embedded
+    if not os.path.isdir(options.extract):
+        echo('Warning: output directory does not exist: %s' % options.extract)
+        return
+    errors = []
+    try:
+        count = extract_embedded(sorted(files), options.extract,
+                                 thumbnail_size=options.thumbnail_size,
+                                 jobs=options.jobs, errors=errors)
+    except ExtractError, e:
+        echo('Warning: %s' % e)
+        return
+    for infile, error in errors:
+        echo('Warning: Could not process input file "%s": %s' % (infile, error))
+    if verbosity == 2:
+        echo('%d files extracted' % count)
+
+
 def main():
     """Handle command-line arguments and options."""
 
@@ -312,10 +1155,26 @@ def main():
     parser.add_option("--case-insensitive", dest="ignorecase",
                         action="store_true",
                         help="Ignore case for every file name matching.")
+    parser.add_option("--cache", dest="cache", metavar="DIR",
+                        help="Cache conversions and authors in DIR and reuse\
+                        them for unchanged input files.")
+    parser.add_option("--cache-hash", dest="cache_hash", action="store_true",
+                        help="Identify cached input files by a hash of their\
+                        data instead of name, time and size.")
+    parser.add_option("--cache-size", dest="cache_size", type="int",
+                        default=256, metavar="MB",
+                        help="Limit the cache size to MB megabytes.")
     parser.add_option("-d", "--directory", dest="directory",
                         help="Write all output files to DIRECTORY.")
+    parser.add_option("--duplicates", dest="duplicates", action="store_true",
+                        oargs=1, metavar="[FILE]", help="Print the groups of\
+                        duplicate and similar input files\
+                        [optional argument: output FILE].")
     parser.add_option("--exclude", dest="exclude", metavar="FILE", nargs=1,
                         help="Found files must not match the exclude FILE pattern.")
+    parser.add_option("--extract", dest="extract", metavar="DIR", nargs=1,
+                        help="Extract the embedded images of all input files\
+                        to DIR.")
     parser.add_option("--extension-append", dest="extension_append",
                         action="store_true",
                         help="Append an extension to each output FILE.")
@@ -330,6 +1189,12 @@ def main():
                         oargs=1, metavar="[FILE]",
                         help="Read one file from stdin before other input files\
                         [optional argument: output FILE].")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=1,
+                        metavar="N", help="Process N input files in parallel\
+                        [0: one process per CPU].")
+    parser.add_option("--index", dest="index", metavar="FILE", nargs=1,
+                        help="Only process input files which are new or changed\
+                        since the last run with the same index FILE.")
     parser.add_option("--include", dest="include", metavar="FILE", nargs=1,
                         help="Found files must match the include FILE pattern.")
     parser.add_option("--list-authors", dest="list_author", action="store_true",
@@ -342,12 +1207,30 @@ def main():
     parser.add_option("-r", "--replace", dest="replace", nargs=2,
                         metavar="SEARCH REPLACE",
                         help="Replace search string by replacement string.")
+    parser.add_option("--replace-file", dest="replace_file", metavar="FILE",
+                        nargs=1, help="Replace all search strings by their\
+                        replacement strings listed in FILE (one tab-separated\
+                        pair per line).")
     parser.add_option("--recursive", dest="recursive", action="store_true",
                         oargs=1, metavar="[LEVEL]",
                         help="Search directories recursively\
                         [optional argument: maximum recursion LEVEL].")
+    parser.add_option("--search", dest="search", metavar="QUERY", nargs=1,
+                        help="Print the paragraphs matching QUERY in the\
+                        search index (see --search-index), e.g. '\"a phrase\"\
+                        AND word'.")
+    parser.add_option("--search-index", dest="search_index", metavar="FILE",
+                        nargs=1, help="Add all new or changed input files to the\
+                        full-text search index FILE.")
     parser.add_option("--selftest", dest="selftest", action="store_true",
                         help="Run the test suite.")
+    parser.add_option("--similarity", dest="similarity", type="float",
+                        default=0.8, metavar="RATIO", help="Minimum similarity\
+                        of the text of similar files for --duplicates\
+                        [0: only exact duplicates].")
+    parser.add_option("--thumbnail-size", dest="thumbnail_size", type="int",
+                        metavar="PIXELS", help="Also write thumbnails of the\
+                        images extracted by --extract (needs PIL).")
     parser.add_option("--tohtml", dest="tohtml", action="store_true", oargs=1,
                         metavar="[FILE]", help="Convert the document to HTML\
                         [optional argument: output FILE].")
@@ -420,9 +1303,18 @@ def main():
         else:
             options.recursive = int(options.recursive[1])
 
+    index = None
+    if options.index:
+        try:
+            index = DirectoryIndex(options.index)
+        except (ReadError, ValueError), e:
+            echo('Warning: could not read index file: %s' % e)
+            return
+
     for arg in args:
         if os.path.isfile(arg):
-            files.append(arg)
+            if index is None or index.check(arg):
+                files.append(arg)
         else:
             try:
                 path, filter = get_path_and_filter(arg)
@@ -432,146 +1324,107 @@ def main():
             else:
                 files.extend(list_directory(path, filter, options.ignorecase,
                                             options.recursive, False, 
-                                            options.include, options.exclude))
+                                            options.include, options.exclude,
+                                            index))
 
     files = list(set(files))
 
+    if options.search_index:
+        if not _update_search_index(options, files, verbosity):
+            return
+        actions = (options.totxt, options.tohtml, options.toxml, options.toodf,
+                   options.list_author, options.replace, options.replace_file,
+                   options.duplicates, options.extract)
+        if not [action for action in actions if parser.is_true(action)]:
+            return
+    elif options.search:
+        echo('Warning: --search needs a search index (--search-index FILE).')
+        return
+
     if len(files) == 0 and not stdin:
-        echo('Warning: No input files given or found.')
+        if index is not None:
+            if verbosity == 2:
+                echo('No new or changed input files found.')
+        else:
+            echo('Warning: No input files given or found.')
         return
 
     if options.directory and not os.path.isdir(options.directory):
         echo('Warning: output directory does not exist: %s' % options.directory)
         return
 
+    if options.jobs < 0:
+        echo('Warning: invalid number of jobs: %d' % options.jobs)
+        return
 
-    try:
-        authors = {}
-        files = sorted(files)
-        if stdin:
-            files.insert(0, 'stdin')
-
-        for infile in files:
-            if verbosity == 2:
-                echo('Processing %s' % infile)
-
-            try:
-                if stdin and 'stdin' == infile:
-                    doc = loads(stdin)
-                else:
-                    doc = load(infile)
-            except zipfile.BadZipfile, e:
-                echo('Warning: Skipping input file "%s": %s' % (infile, e))
-                stdin = ''
-                continue
+    if parser.is_true(options.duplicates):
+        _print_duplicates(options, files, fs_encoding, verbosity)
+    if options.extract:
+        _extract_embedded(options, files, verbosity)
+    if parser.is_true(options.duplicates) or options.extract:
+        actions = (options.totxt, options.tohtml, options.toxml, options.toodf,
+                   options.list_author, options.replace, options.replace_file)
+        if not stdin and not [action for action in actions
+                              if parser.is_true(action)]:
+            return
+
+    if options.cache:
+        from cache import CacheError, DocumentCache
+        options.cache_size *= 1024 * 1024
+        try:
+            DocumentCache(options.cache, options.cache_size).close()
+        except CacheError, e:
+            echo('Warning: could not open cache: %s' % e)
+            return
 
-            content = {}
-            changed = False
-
-            if options.replace:
-                changed = doc.replace(options.replace[0], options.replace[1])
-
-            if parser.is_true(options.totxt):
-                content['txt'] = doc.totext()
-            if parser.is_true(options.tohtml):
-                content['html'] = doc.tohtml(os.path.basename(infile))
-            if parser.is_true(options.toxml):
-                content['xml'] = doc.content.tostring(encoding='utf-8')
-            if parser.is_true(options.toodf) or (changed and not content):
-                content['odf'] = dumps(doc)
-            if parser.is_true(options.list_author):
-                author = doc.getAuthor()
-                if author:
-                    if not author in authors:
-                        authors[author] = []
-                    authors[author].append(infile)
-
-            if content:
-                for extension, output in content.items():
-                    filename = infile
-                    output_encoding = ''
-
-                    if options.filename:
-                        filename = options.filename
-
-                    optional = getattr(options, 'to' + extension)
-                    if isinstance(optional, tuple):
-                        filename = optional[1]
-                    elif stdin and isinstance(options.stdin, tuple):
-                        filename = options.stdin[1]
-                    elif options.extension_append or options.extension_replace:
-                        if 'odf' == extension:
-                            if stdin and 'stdin' == infile:
-                                extension_new = unicode(doc.getExtension())
-                                if not extension_new:
-                                    extension_new = u'odf'
-                            else:
-                                extension_new = infile.split('.')[-1]
-                        else:
-                            extension_new = unicode(extension)
-                        if options.extension_append:
-                            filename += u'.' + extension_new
-                        else:
-                            splitted = filename.split('.')
-                            if len(splitted) == 1:
-                                filename += u'.' + extension_new
-                            else:
-                                filename = u'.'.join(splitted[:-1]) + u'.' + extension_new
-
-                    if options.directory:
-                        filename = os.path.join(options.directory,
-                                                os.path.basename(filename))
-
-                    if filename == infile and (extension != 'odf' or not options.force):
-                        if extension != 'odf':
-                            if not options.stdout or options.filename:
-                                echo('Warning: Cannot overwrite input file with '\
-                                     'text content (pass --file, --extension-'\
-                                     'append or --extension-replace)')
-                        elif changed:
-                            echo('Warning: Not allowed to overwrite input '\
-                                 'file (pass --force to allow)')
-
-                    elif filename != infile and not options.force \
-                            and os.path.isfile(filename):
-                        echo('Warning: Skipping already existing output file "%s"'\
-                             % filename)
+    options.replacer = None
+    if options.replace_file:
+        try:
+            options.replacer = read_replacements(options.replace_file)
+        except (ReadError, ReCompileError, UnicodeError), e:
+            echo('Warning: could not read replacements: %s' % e)
+            return
 
-                    else:
-                        if options.force and verbosity == 2 and os.path.isfile(filename):
-                            echo('Warning: Overwriting existing output file "%s"'\
-                                 % filename)
 
-                        if extension in ['xml','html']:
-                            try:
-                                outfile = file(filename, 'w')
-                            except IOError, e:
-                                raise WriteError(e)
-                            output_encoding = 'utf-8'
-                        elif extension == 'odf':
-                            try:
-                                outfile = file(filename, 'wb')
-                            except IOError, e:
-                                raise WriteError(e)
-                        else:
-                            try:
-                                outfile = codecs.open(filename, 'w', fs_encoding, 'replace')
-                            except IOError, e:
-                                raise WriteError(e)
-
-                        if verbosity == 2:
-                            echo('Writing %s to %s' % (extension, filename))
-
-                        try:
-                            print >>outfile, output, # important: do not print linebreak!
-                        finally:
-                            outfile.close()
-
-                    if options.stdout and extension != 'odf':
-                        print_unicode(sys.stdout, output, fs_encoding, output_encoding)
-
-            stdin = ''
+    try:
+        authors = {}
+        def collect(infile, author):
+            if author:
+                if not author in authors:
+                    authors[author] = []
+                authors[author].append(infile)
 
+        files = sorted(files)
+        if stdin:
+            collect('stdin', process_file('stdin', options, fs_encoding,
+                                          verbosity, stdin))
+
+        jobs = [(infile, options, fs_encoding, verbosity) for infile in files]
+        pool = None
+        if options.jobs != 1 and len(files) > 1:
+            import multiprocessing
+            processes = options.jobs or multiprocessing.cpu_count()
+            pool = multiprocessing.Pool(processes)
+            # Small chunks keep the workers busy until the end of the batch
+            chunksize = max(1, min(16, len(jobs) // (4 * processes)))
+            results = pool.imap(_process_job, jobs, chunksize)
+        else:
+            results = (_process_job(job) for job in jobs)
+        try:
+            for infile, author, error in results:
+                if error is not None:
+                    echo('Warning: Could not process input file "%s": %s'
+                         % (infile, error))
+                    if index is not None:
+                        index.discard(infile)
+                collect(infile, author)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        if index is not None:
+            index.save()
 
         content = []
         for author in sorted(authors.keys()):
@@ -609,7 +1462,7 @@ def main():
                                  % filename)
                         echo('Writing author list to %s' % filename)
                     try:
-                        outfile = codecs.open(filename, 'w', encoding, errors='replace')
+                        outfile = codecs.open(filename, 'w', fs_encoding, errors='replace')
                     except IOError, e:
                         raise WriteError(e)
                     outfile.write(output)
@@ -620,7 +1473,7 @@ def main():
                     echo('No way to output list of authors (pass --file or --stdout)')
 
             else:
-                print_unicode(sys.stdout, output, encoding)
+                print_unicode(sys.stdout, output, fs_encoding)
 
     except UnicodeError, e:
         if isinstance(e.object, unicode):
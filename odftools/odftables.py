@@ -9,15 +9,24 @@ Features:
         - a SQLite database containing the tables and data
         - a set of tables in CSV format
         - a spreadsheet with each table as a separate page
-    - Dump the entire OpenDocument file to a database as binary data
+    - Dump the entire OpenDocument file to a database as binary data, or
+      member by member to an archive storing shared members only once
     - Generate a spreadsheet from the data in the tables of:
         - a SQLite database
         - a CSV file
 
 """
 
-import sys
-# import odf
+import os, sys
+import csv
+import math
+import time
+import re
+import zipfile
+from itertools import groupby, repeat
+from xml.sax.saxutils import escape, quoteattr
+
+from odfmeta import load, loads, ReadError, WriteError, ZipMemberWriter
 
 
 def OdfToSqlite(filename):
@@ -37,6 +46,209 @@ def OdfToSqlite(filename):
     return sqlite.Binary(doc)
 
 
+def OdfToArchive(filename, database):
+    """Store the OpenDocument file in the document archive database.
+
+    Zip file members already stored for other documents are not stored
+    again, see archive.DocumentArchive. Returns the id of the document.
+
+    """
+    from archive import DocumentArchive
+    archive = DocumentArchive(database)
+    try:
+        return archive.add(filename)
+    finally:
+        archive.close()
+
+
+def ArchiveToOdf(database, id, filename=None):
+    """Rebuild the document id of the document archive database in filename.
+
+    Return a corresponding Document if filename is None.
+
+    """
+    from archive import DocumentArchive
+    archive = DocumentArchive(database)
+    try:
+        if filename is None:
+            return archive.load(id)
+        archive.write(id, filename)
+    finally:
+        archive.close()
+
+
+def _sql_name(name):
+    """Return name quoted as SQL identifier."""
+    return '"%s"' % name.replace('"', '""')
+
+
+def _sql_type(values):
+    """Return the SQLite column type for the values values (see _sql_value())."""
+    types = dict.fromkeys([type(value) for value in values if value is not None])
+    if not types:
+        return ''
+    if unicode in types:
+        if len(types) > 1:
+            return ''       # mixed, no type affinity
+        return 'TEXT'
+    if float in types:
+        return 'REAL'
+    return 'INTEGER'
+
+
+def _sql_value(value):
+    """Return the cell value value as stored in SQLite.
+
+    Floats without fractional part are stored as integers.
+
+    """
+    if isinstance(value, float) and not (math.isinf(value) or math.isnan(value)) \
+            and value == int(value) and abs(value) < 1e15:
+        return int(value)
+    return value
+
+
+class _SqliteTable(object):
+    """A table in a SQLite database, filled in batches of rows."""
+
+    def __init__(self, db, name, batch_size):
+        self.db = db
+        self.name = name
+        self.batch_size = batch_size
+        self.header = None
+        self.columns = []   # column names, once the table has been created
+        self.batch = []
+        self.count = 0
+
+    def add(self, row, count=1):
+        """Add count copies of the tuple of cell values row."""
+        if self.header is None:
+            # A first row of texts holds the column names
+            self.header = [value for value in row if isinstance(value, unicode)
+                           and value.strip()]
+            if len(self.header) == len(row):
+                return
+            self.header = []
+        row = tuple([_sql_value(value) for value in row])
+        batch = self.batch
+        if len(row) > len(self.columns) and self.columns:
+            self.flush()
+            self._add_columns(len(row))
+        while count:
+            n = min(count, self.batch_size - len(batch))
+            batch.extend([row] * n)
+            count -= n
+            if len(batch) >= self.batch_size:
+                self.flush()
+
+    def _column_names(self, start, stop):
+        names = []
+        for i in xrange(start, stop):
+            name = i < len(self.header) and self.header[i].strip() or ''
+            if not name or name.lower() in self._used:
+                name = u'c%d' % (i + 1)
+            self._used[name.lower()] = True
+            names.append(name)
+        return names
+
+    def _create(self):
+        width = max([len(row) for row in self.batch] + [len(self.header)])
+        self._used = {}
+        self.columns = self._column_names(0, width)
+        columns = [(name, _sql_type([row[i] for row in self.batch
+                                     if i < len(row)]))
+                   for i, name in enumerate(self.columns)]
+        self.db.execute('DROP TABLE IF EXISTS %s' % _sql_name(self.name))
+        self.db.execute('CREATE TABLE %s (%s)' % (_sql_name(self.name),
+                ', '.join([('%s %s' % (_sql_name(name), sql_type)).strip()
+                           for name, sql_type in columns])))
+
+    def _add_columns(self, width):
+        for name in self._column_names(len(self.columns), width):
+            self.db.execute('ALTER TABLE %s ADD COLUMN %s'
+                            % (_sql_name(self.name), _sql_name(name)))
+            self.columns.append(name)
+
+    def flush(self):
+        """Insert the rows added since the last flush."""
+        if not self.columns:
+            if not self.batch and not self.header:
+                return
+            self._create()
+        if not self.batch:
+            return
+        width = len(self.columns)
+        padding = (None,) * width
+        insert = 'INSERT INTO %s VALUES (%s)' % (_sql_name(self.name),
+                                                 ', '.join(['?'] * width))
+        self.db.executemany(insert, [len(row) < width and row + padding[len(row):]
+                                     or row for row in self.batch])
+        self.count += len(self.batch)
+        del self.batch[:]
+
+
+def OdfTablesToSqlite(filename, database, batch_size=50000,
+                      journal_mode=None, synchronous=None):
+    """Copy each table of the ODF file filename to a table in SQLite.
+
+    database is the file name of the SQLite database. Existing tables with
+    the same names are replaced. A first row of texts is used for the column
+    names, otherwise columns are named c1, c2, ... The column types are
+    inferred from the first batch of rows. Empty rows are left out.
+
+    The tables are read row by row (see components.content.iter_table_rows())
+    and inserted with executemany() in batches of batch_size rows, all in
+    one transaction. journal_mode and synchronous are set as PRAGMAs if
+    given, e.g. "WAL" and "OFF" for fastest loading.
+
+    Returns a list of (table name, number of rows) tuples.
+
+    """
+    try:
+        from sqlite3 import dbapi2 as sqlite    # Python25
+    except ImportError:
+        from pysqlite2 import dbapi2 as sqlite  # Python24 and pysqlite
+
+    doc = load(filename, lazy=True)
+    try:
+        db = sqlite.connect(database, isolation_level=None)
+    except sqlite.Error, e:
+        doc.close()
+        raise WriteError(e)
+
+    tables = []
+    try:
+        try:
+            if journal_mode:
+                db.execute('PRAGMA journal_mode=%s' % journal_mode)
+            if synchronous:
+                db.execute('PRAGMA synchronous=%s' % synchronous)
+            db.execute('BEGIN')
+            table = None
+            for name, row, count in doc.content.iter_table_rows():
+                if row is None:
+                    if table is not None:
+                        table.flush()
+                    table = _SqliteTable(db, name or u'table%d' % (len(tables) + 1),
+                                         batch_size)
+                    tables.append(table)
+                elif row:
+                    table.add(row, count)
+            if table is not None:
+                table.flush()
+            db.execute('COMMIT')
+        except sqlite.Error, e:
+            try:
+                db.execute('ROLLBACK')
+            except sqlite.Error:
+                pass
+            raise WriteError(e)
+    finally:
+        db.close()
+        doc.close()
+    return [(table.name, table.count) for table in tables if table.columns]
+
+
 def SqlToOdf(blob, filename=None):
     """Save binary string blob containing a zipped OpenDocument into filename.
 
@@ -56,6 +268,369 @@ def SqlToOdf(blob, filename=None):
 
 
 
+def _csv_value(value, encoding):
+    """Return the CSV representation of a cell value as a byte string."""
+    if value is None:
+        return ''
+    if value is True:
+        return 'TRUE'
+    if value is False:
+        return 'FALSE'
+    if isinstance(value, float):
+        if not (math.isinf(value) or math.isnan(value)) \
+                and value == int(value) and abs(value) < 1e15:
+            return str(int(value))
+        return repr(value)
+    return value.encode(encoding)
+
+
+def OdfToCsv(filename, directory=None, encoding='utf-8'):
+    """Write each table of the ODF file filename to a CSV file.
+
+    The files are named after the document and the table, e.g. a-Sheet1.csv
+    for the table "Sheet1" of a.ods, and saved in directory (by default the
+    directory of filename). Tables whose names only differ in characters
+    not allowed in file names are numbered, e.g. a-A_B.csv and a-A_B-2.csv.
+    Returns the list of file names written.
+
+    The tables are read row by row from the Zip file and each row is written
+    right away, so only a single row is held in memory. Repeated rows are
+    written as often as they are repeated, except for the empty rows at the
+    end of a table. Rows are not padded to the width of the table.
+
+    """
+    doc = load(filename, lazy=True)
+    if directory is None:
+        directory = os.path.dirname(filename)
+    prefix = os.path.join(directory,
+                          os.path.splitext(os.path.basename(filename))[0])
+
+    written = []
+    used = {} # lower case names of the written files
+    f = writer = None
+    empty = 0 # empty rows not written yet
+    try:
+        for name, row, count in doc.content.iter_table_rows():
+            if row is None:
+                if f is not None:
+                    f.close()
+                name = re.sub(r'[^\w.-]+', '_', name or str(len(written) + 1))
+                outname = '%s-%s.csv' % (prefix, name)
+                # Tables like "A/B" and "A B" get the same name, which may
+                # also differ in case only
+                number = 1
+                while outname.lower() in used:
+                    number += 1
+                    outname = '%s-%s-%d.csv' % (prefix, name, number)
+                used[outname.lower()] = True
+                try:
+                    f = open(outname, 'wb')
+                except IOError, e:
+                    raise WriteError(e)
+                writer = csv.writer(f)
+                written.append(outname)
+                empty = 0
+            elif not row:
+                empty += count
+            else:
+                if empty:
+                    writer.writerows(repeat((), empty))
+                    empty = 0
+                writer.writerows(repeat([_csv_value(value, encoding)
+                                         for value in row], count))
+    finally:
+        if f is not None:
+            f.close()
+        doc.close()
+    return written
+
+
+# Spreadsheet output
+
+_ods_mimetype = 'application/vnd.oasis.opendocument.spreadsheet'
+
+_ods_namespaces = ('xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+                   'xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0" '
+                   'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+                   'office:version="1.1"')
+
+_ods_manifest = """<?xml version="1.0" encoding="UTF-8"?>
+<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0">
+ <manifest:file-entry manifest:media-type="%s" manifest:full-path="/"/>
+ <manifest:file-entry manifest:media-type="text/xml" manifest:full-path="content.xml"/>
+ <manifest:file-entry manifest:media-type="text/xml" manifest:full-path="styles.xml"/>
+</manifest:manifest>
+""" % _ods_mimetype
+
+_ods_styles = """<?xml version="1.0" encoding="UTF-8"?>
+<office:document-styles %s/>
+""" % _ods_namespaces
+
+_spaces = re.compile('^ +| +$|  +')
+_empty_cell = '<table:table-cell/>'
+
+def _space_xml(count):
+    if count == 1:
+        return '<text:s/>'
+    return '<text:s text:c="%d"/>' % count
+
+
+def _paragraph_xml(text):
+    """Return text as content of a <text:p> element, keeping white space."""
+    def spaces(match):
+        count = len(match.group(0))
+        if match.start() == 0 or match.end() == len(text):
+            return _space_xml(count)
+        return ' ' + _space_xml(count - 1)
+    text = escape(text)
+    return _spaces.sub(spaces, text).replace('\t', '<text:tab/>')
+
+
+def _cell_xml(value):
+    """Return the <table:table-cell> element for value as UTF-8 string.
+
+    None is an empty cell, bools, numbers and Unicode strings get the
+    corresponding value type. Infinite and NaN floats are no valid
+    xsd:double values and written as strings.
+
+    """
+    if value is None:
+        return _empty_cell
+    if isinstance(value, float) and (math.isinf(value) or math.isnan(value)):
+        value = unicode(repr(value))
+    if value is True or value is False:
+        text = value and 'true' or 'false'
+        return ('<table:table-cell office:value-type="boolean" '
+                'office:boolean-value="%s"><text:p>%s</text:p></table:table-cell>'
+                % (text, text.upper()))
+    if isinstance(value, (int, long, float)):
+        text = isinstance(value, float) and repr(value) or str(value)
+        return ('<table:table-cell office:value-type="float" '
+                'office:value="%s"><text:p>%s</text:p></table:table-cell>'
+                % (text, text))
+    if not isinstance(value, unicode):
+        value = str(value).decode('utf-8', 'replace')
+    paragraphs = u''.join([u'<text:p>%s</text:p>' % _paragraph_xml(line)
+                           for line in value.split(u'\n')])
+    return ('<table:table-cell office:value-type="string">%s'
+            '</table:table-cell>' % paragraphs.encode('utf-8'))
+
+
+class OdsWriter(object):
+    """Writes a spreadsheet file table by table and row by row.
+
+    The XML of the rows is compressed and written to the Zip file right away
+    (see odfmeta.ZipMemberWriter), without building an element tree, so the
+    memory usage doesn't depend on the number of rows. Consecutive equal
+    cells and rows are written once with table:number-columns-repeated and
+    table:number-rows-repeated. Call close() to finish the file, or abort()
+    to remove it if writing fails.
+
+    """
+
+    buffer_size = 1 << 16
+
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            self.zf = zipfile.ZipFile(filename, 'w', allowZip64=True)
+        except IOError, e:
+            raise WriteError(e)
+        # The mimetype has to be the first file and uncompressed
+        self.zf.writestr(zipfile.ZipInfo('mimetype'), _ods_mimetype)
+        self.content = ZipMemberWriter(self.zf, 'content.xml')
+        self._buffer = []
+        self._size = 0
+        self._write('<?xml version="1.0" encoding="UTF-8"?>\n'
+                    '<office:document-content %s><office:body>'
+                    '<office:spreadsheet>' % _ods_namespaces)
+
+    def _write(self, data):
+        self._buffer.append(data)
+        self._size += len(data)
+        if self._size >= self.buffer_size:
+            self._flush()
+
+    def _flush(self):
+        self.content.write(''.join(self._buffer))
+        self._buffer = []
+        self._size = 0
+
+    def _row_xml(self, row):
+        cells = [_cell_xml(value) for value in row]
+        while cells and cells[-1] == _empty_cell:
+            cells.pop()
+        xml = []
+        for cell, group in groupby(cells):
+            count = len(list(group))
+            if count > 1:
+                # Insert the attribute after the tag name
+                cell = '%s table:number-columns-repeated="%d"%s' % (
+                        cell[:17], count, cell[17:])
+            xml.append(cell)
+        return ''.join(xml)
+
+    def add_table(self, name, rows):
+        """Add a table called name with the cell values of rows.
+
+        rows is an iterable of sequences of cell values, see _cell_xml().
+
+        """
+        write = self._write
+        write('<table:table table:name=%s>'
+              % quoteattr(name).encode('utf-8'))
+        previous = None
+        count = 0
+        for row in rows:
+            xml = self._row_xml(row)
+            if xml == previous:
+                count += 1
+                continue
+            if count:
+                self._write_row(previous, count)
+            previous = xml
+            count = 1
+        if count:
+            self._write_row(previous, count)
+        write('</table:table>')
+
+    def _write_row(self, xml, count):
+        if count > 1:
+            start = '<table:table-row table:number-rows-repeated="%d">' % count
+        else:
+            start = '<table:table-row>'
+        self._write('%s%s</table:table-row>' % (start, xml or _empty_cell))
+
+    def close(self):
+        """Finish the spreadsheet file."""
+        if self.zf is None:
+            return
+        self._write('</office:spreadsheet></office:body>'
+                    '</office:document-content>')
+        self._flush()
+        self.content.close()
+        for filename, data in (('META-INF/manifest.xml', _ods_manifest),
+                               ('styles.xml', _ods_styles)):
+            zipinfo = zipfile.ZipInfo(filename, time.localtime(time.time())[:6])
+            zipinfo.compress_type = zipfile.ZIP_DEFLATED
+            self.zf.writestr(zipinfo, data)
+        self.zf.close()
+        self.zf = None
+
+    def abort(self):
+        """Discard the spreadsheet file, e.g. after an error while writing."""
+        if self.zf is None:
+            return
+        # Detach the file, or ZipFile.__del__ writes the central directory
+        self.zf.fp.close()
+        self.zf.fp = None
+        self.zf = None
+        self.content = None
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+
+_integer = re.compile(r'^[-+]?[1-9]\d{0,14}$|^0$')
+_number = re.compile(r'^[-+]?(?:(?:[1-9]\d*|0)(?:\.\d*)?|\.\d+)(?:[eE][-+]?\d+)?$')
+
+def _csv_cell(text, encoding):
+    """Return the cell value of the CSV field text, see _csv_value().
+
+    Numbers with leading zeros (like zip codes) are kept as text.
+
+    """
+    if not text:
+        return None
+    if _integer.match(text):
+        return int(text)
+    if _number.match(text):
+        return float(text)
+    if text in ('TRUE', 'FALSE'):
+        return text == 'TRUE'
+    return text.decode(encoding)
+
+
+def CsvToOds(csvfiles, filename, encoding='utf-8'):
+    """Write a spreadsheet filename with one sheet for each CSV file.
+
+    The sheets are named after the CSV files. Fields looking like numbers
+    or TRUE/FALSE are stored as numbers and booleans. The CSV files are read
+    row by row, see OdsWriter.
+
+    """
+    writer = OdsWriter(filename)
+    try:
+        for csvfile in csvfiles:
+            try:
+                f = open(csvfile, 'rb')
+            except IOError, e:
+                raise ReadError(e)
+            try:
+                name = os.path.splitext(os.path.basename(csvfile))[0]
+                if not isinstance(name, unicode):
+                    name = name.decode(sys.getfilesystemencoding(), 'replace')
+                writer.add_table(name, ([_csv_cell(text, encoding) for text in row]
+                                        for row in csv.reader(f)))
+            finally:
+                f.close()
+    except:
+        writer.abort()
+        raise
+    writer.close()
+
+
+def SqliteToOds(database, filename, query=None):
+    """Write a spreadsheet filename with the tables of a SQLite database.
+
+    Each table is written to a sheet of the same name, with the column
+    names in the first row. If query is given, only the result of this SQL
+    query is written to a sheet called "Query". The rows are fetched and
+    written one at a time, see OdsWriter. BLOBs are left out.
+
+    """
+    try:
+        from sqlite3 import dbapi2 as sqlite    # Python25
+    except ImportError:
+        from pysqlite2 import dbapi2 as sqlite  # Python24 and pysqlite
+
+    def values(cursor):
+        yield [column[0] for column in cursor.description]
+        for row in cursor:
+            row = list(row)
+            for i, value in enumerate(row):
+                if isinstance(value, buffer):
+                    row[i] = None
+            yield row
+
+    try:
+        db = sqlite.connect(database)
+    except sqlite.Error, e:
+        raise ReadError(e)
+    try:
+        writer = OdsWriter(filename)
+        try:
+            try:
+                if query:
+                    writer.add_table(u'Query', values(db.execute(query)))
+                else:
+                    tables = [row[0] for row in db.execute(
+                            "SELECT name FROM sqlite_master WHERE type = 'table' "
+                            "AND name NOT LIKE 'sqlite%' ORDER BY rowid")]
+                    for name in tables:
+                        writer.add_table(name, values(db.execute(
+                                'SELECT * FROM %s' % _sql_name(name))))
+            except sqlite.Error, e:
+                raise ReadError(e)
+        except:
+            writer.abort()
+            raise
+        writer.close()
+    finally:
+        db.close()
+
+
 def echo(msg):
     print >>sys.stderr, msg
 
@@ -75,6 +650,18 @@ if __name__ == '__main__':
     parser.add_option("-o", "--out-format", 
             dest="out_format", metavar="FORMAT",
             help="Output file FORMAT: csv, ods, sql or sqldef.")
+    parser.add_option("--batch-size", 
+            dest="batch_size", type="int", default=50000, metavar="N",
+            help="Insert N rows at once into SQLite (default: 50000).")
+    parser.add_option("--journal-mode", 
+            dest="journal_mode", metavar="MODE",
+            help="SQLite journal mode, e.g. WAL or OFF.")
+    parser.add_option("--synchronous", 
+            dest="synchronous", metavar="MODE",
+            help="SQLite synchronous setting, e.g. NORMAL or OFF.")
+    parser.add_option("--query", 
+            dest="query", metavar="SQL",
+            help="Write the result of the SQL query instead of all tables.")
     parser.add_option("-q", "--quiet", 
             dest="quiet", action="store_true",
             help="Do not print status messages.")
@@ -105,9 +692,28 @@ if __name__ == '__main__':
 
     if args:
         encoding = sys.stdout.encoding or sys.getfilesystemencoding()
-        sys.argv = [a.decode(encoding) for a in sys.argv]
+        args = [a.decode(encoding) for a in args]
     else:
-        args = sys.stdin
+        args = [line.rstrip('\r\n') for line in sys.stdin]
 
-    echo(args)
+    for filename in args:
+        if options.in_format in ('ods', 'odt') and options.out_format == 'csv':
+            for outname in OdfToCsv(filename):
+                echo(outname)
+        elif options.in_format in ('ods', 'odt') and options.out_format == 'sql':
+            database = os.path.splitext(filename)[0] + '.sqlite'
+            for name, count in OdfTablesToSqlite(filename, database,
+                    options.batch_size, options.journal_mode, options.synchronous):
+                echo("%s: %s (%d rows)" % (database, name, count))
+        elif options.in_format in ('csv', 'sql') and options.out_format == 'ods':
+            outname = os.path.splitext(filename)[0] + '.ods'
+            if options.in_format == 'csv':
+                CsvToOds([filename], outname)
+            else:
+                SqliteToOds(filename, outname, options.query)
+            echo(outname)
+        else:
+            echo("Conversion from %s to %s is not implemented yet."
+                 % (options.in_format, options.out_format))
+            sys.exit(1)
 
@@ -189,7 +189,8 @@ class OptionalOptionParser(OptionParser):
                 break
 
 
-    def is_true(self, opt_value):
+    @staticmethod
+    def is_true(opt_value):
         """Return True if the (optional) boolean option value is True."""
         return isinstance(opt_value, tuple) and opt_value[0] or opt_value
 
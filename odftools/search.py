@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-15 -*-
+
+"""Full-text search index over a collection of ODF files.
+
+The text of every paragraph and heading is stored in a SQLite full-text
+table (FTS5, or FTS4 with older SQLite libraries), together with the file
+and the number of the paragraph. Files are only read again when their
+modification time or size has changed, so updating the index of a large,
+mostly unchanged collection is fast.
+
+Queries use the syntax of SQLite's full-text search: words, "phrases",
+prefix* searches and the operators AND, OR and NOT.
+
+"""
+
+import os, sys
+
+try:
+    from sqlite3 import dbapi2 as sqlite    # Python25
+except ImportError:
+    from pysqlite2 import dbapi2 as sqlite  # Python24 and pysqlite
+
+import odfmeta
+
+
+# Exceptions for this module
+
+class SearchError(Exception):
+    """Thrown if the index cannot be opened or the query is invalid."""
+    pass
+
+
+def _extract_paragraphs(path):
+    """Return (path, stat, paragraphs, error) for the ODF file path.
+
+    paragraphs is a list of (number, text) tuples of the non-blank
+    paragraphs. Runs in worker processes, so errors are returned as text.
+
+    """
+    try:
+        stat = os.stat(path)
+        doc = odfmeta.load(path, lazy=True)
+        try:
+            paragraphs = [(number, text) for number, text
+                          in doc.iter_paragraphs() if text.strip()]
+        finally:
+            doc.close()
+    except Exception, e:
+        return path, None, None, unicode(e)
+    return path, (stat.st_mtime, stat.st_size), paragraphs, None
+
+
+# Main class
+
+class SearchIndex(object):
+    """Full-text index of the paragraphs of ODF files."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            self.db = sqlite.connect(filename, timeout=60, isolation_level=None)
+            self.db.execute("CREATE TABLE IF NOT EXISTS file ("
+                            "id INTEGER PRIMARY KEY, path TEXT UNIQUE,"
+                            " mtime REAL, size INTEGER)")
+            self.db.execute("CREATE TABLE IF NOT EXISTS paragraph ("
+                            "id INTEGER PRIMARY KEY, file INTEGER, number INTEGER)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS paragraph_file "
+                            "ON paragraph (file)")
+            for module in ('fts5', 'fts4'):
+                try:
+                    self.db.execute("CREATE VIRTUAL TABLE IF NOT EXISTS "
+                                    "paragraph_text USING %s (text)" % module)
+                    break
+                except sqlite.OperationalError:
+                    if module == 'fts4':
+                        raise
+        except sqlite.Error, e:
+            raise SearchError(e)
+
+    def is_current(self, path, stat=None):
+        """Return True if path is indexed and unchanged since then."""
+        if stat is None:
+            stat = os.stat(path)
+        row = self.db.execute("SELECT mtime, size FROM file WHERE path = ?",
+                              (os.path.abspath(path),)).fetchone()
+        return row is not None and tuple(row) == (stat.st_mtime, stat.st_size)
+
+    def _remove(self, path):
+        db = self.db
+        row = db.execute("SELECT id FROM file WHERE path = ?", (path,)).fetchone()
+        if row is not None:
+            db.execute("DELETE FROM paragraph_text WHERE rowid IN "
+                       "(SELECT id FROM paragraph WHERE file = ?)", row)
+            db.execute("DELETE FROM paragraph WHERE file = ?", row)
+            db.execute("DELETE FROM file WHERE id = ?", row)
+
+    def _add(self, path, stat, paragraphs):
+        db = self.db
+        self._remove(path)
+        id = db.execute("INSERT INTO file (path, mtime, size) VALUES (?, ?, ?)",
+                        (path,) + stat).lastrowid
+        for number, text in paragraphs:
+            rowid = db.execute("INSERT INTO paragraph (file, number) "
+                               "VALUES (?, ?)", (id, number)).lastrowid
+            db.execute("INSERT INTO paragraph_text (rowid, text) VALUES (?, ?)",
+                       (rowid, text))
+
+    def update(self, paths, jobs=1, errors=None):
+        """Index the files paths which are new or changed.
+
+        The text is extracted by jobs processes (0: one per CPU). Files
+        which cannot be read are skipped and, if errors is a list, appended
+        to it as (path, message) tuples. Files which don't exist (anymore)
+        are removed from the index. Returns the number of files indexed.
+
+        """
+        changed = []
+        missing = []
+        for path in paths:
+            path = os.path.abspath(path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                missing.append(path)
+                continue
+            if not self.is_current(path, stat):
+                changed.append(path)
+        paths = changed
+        if not paths and not missing:
+            return 0
+
+        pool = None
+        if jobs != 1 and len(paths) > 1:
+            import multiprocessing
+            pool = multiprocessing.Pool(jobs or multiprocessing.cpu_count())
+            results = pool.imap(_extract_paragraphs, paths, 4)
+        else:
+            results = (_extract_paragraphs(path) for path in paths)
+
+        count = 0
+        db = self.db
+        try:
+            try:
+                db.execute("BEGIN")
+                for path in missing:
+                    self._remove(path)
+                for path, stat, paragraphs, error in results:
+                    if error is not None:
+                        if not os.path.isfile(path):
+                            self._remove(path) # deleted in the meantime
+                        if errors is not None:
+                            errors.append((path, error))
+                        continue
+                    self._add(path, stat, paragraphs)
+                    count += 1
+                db.execute("COMMIT")
+            except sqlite.Error, e:
+                try:
+                    db.execute("ROLLBACK")
+                except sqlite.Error:
+                    pass # BEGIN failed
+                raise SearchError(e)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+        return count
+
+    def purge(self):
+        """Remove all files from the index which don't exist anymore."""
+        db = self.db
+        paths = [row[0] for row in db.execute("SELECT path FROM file")
+                 if not os.path.isfile(row[0])]
+        db.execute("BEGIN")
+        for path in paths:
+            self._remove(path)
+        db.execute("COMMIT")
+        return len(paths)
+
+    def search(self, query, limit=None):
+        """Return the paragraphs matching query.
+
+        Returns a list of (path, number, text) tuples, ordered by path and
+        paragraph number.
+
+        """
+        sql = ("SELECT path, number, text FROM paragraph_text"
+               " JOIN paragraph ON paragraph.id = paragraph_text.rowid"
+               " JOIN file ON file.id = paragraph.file"
+               " WHERE paragraph_text MATCH ? ORDER BY path, number")
+        if limit is not None:
+            sql += " LIMIT %d" % limit
+        try:
+            return self.db.execute(sql, (query,)).fetchall()
+        except sqlite.Error, e:
+            raise SearchError(e)
+
+    def close(self):
+        self.db.close()
+
+
+# vim: et sts=4 sw=4
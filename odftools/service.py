@@ -0,0 +1,383 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-15 -*-
+
+"""HTTP service converting ODF documents in a pool of worker processes.
+
+POST the document to one of
+
+    /text       plain text (UTF-8)
+    /html       HTML
+    /xml        content.xml
+    /metadata   metadata of meta.xml as JSON
+
+The request threads only move data: uploads are spooled to temporary files,
+parsing and conversion run in worker processes, and the results are
+written to temporary files, which are sent back in chunks once the
+conversion is complete, so the server never holds a whole document or
+result in memory. Documents larger than large_size are converted by a
+separate worker, so huge uploads cannot starve small requests.
+
+The number of requests being converted or waiting for a worker is limited;
+further requests are answered with 503 (Service Unavailable) at once.
+Requests larger than max_size are refused with 413, conversions exceeding
+the timeout are answered with 504. The workers of a pool with a timed out
+conversion are replaced, and the other conversions in that pool restarted,
+so a document hanging a worker doesn't block later requests.
+
+"""
+
+import os, sys
+import shutil
+import tempfile
+import threading
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+try:
+    import json
+except ImportError:
+    import simplejson as json               # Python25
+
+import odfmeta
+
+
+# Size of the chunks uploads and results are copied in
+CHUNK_SIZE = 64 * 1024
+
+# Output media types
+content_types = {'text': 'text/plain; charset=utf-8',
+                 'html': 'text/html; charset=utf-8',
+                 'xml': 'application/xml',
+                 'metadata': 'application/json'}
+
+
+# Exceptions for this module
+
+class ServiceError(Exception):
+    """Thrown if a document cannot be converted."""
+    pass
+
+class ServiceBusy(ServiceError):
+    """Thrown if too many requests are pending."""
+    pass
+
+class ServiceTimeout(ServiceError):
+    """Thrown if a conversion takes longer than the timeout."""
+    pass
+
+
+def _write_text(doc, outfile):
+    first = True
+    for text in doc.iter_text():
+        if not first:
+            outfile.write(os.linesep)
+        outfile.write(text.encode('utf-8'))
+        first = False
+
+
+def _convert(kind, path, directory):
+    """Convert the ODF file path to kind and return (output path, error).
+
+    Runs in worker processes, so errors are returned as text. The output is
+    written to a temporary file in directory.
+
+    """
+    outpath = None
+    try:
+        fd, outpath = tempfile.mkstemp('.' + kind, 'odf-', directory)
+        outfile = os.fdopen(fd, 'wb')
+        try:
+            if kind == 'metadata':
+                json.dump(odfmeta.get_metadata(path), outfile)
+            else:
+                doc = odfmeta.load(path, lazy=True)
+                try:
+                    if kind == 'text':
+                        _write_text(doc, outfile)
+                    elif kind == 'html':
+                        doc.write_html(outfile)
+                    else:
+                        outfile.write(doc.content.tostring(encoding='utf-8'))
+                finally:
+                    doc.close()
+        finally:
+            outfile.close()
+    except Exception, e:
+        if outpath is not None:
+            os.remove(outpath)
+        return None, unicode(e) or e.__class__.__name__
+    return outpath, None
+
+
+# Main classes
+
+class _Task(object):
+    """A conversion waiting for its result, see _WorkerPool."""
+
+    def __init__(self, args):
+        self.args = args
+        self.result = None
+        self.finished = threading.Event()
+
+
+class _WorkerPool(object):
+    """A multiprocessing.Pool whose workers can be replaced.
+
+    The tasks submitted and not finished yet are tracked, so that the pool
+    can be terminated when one of them hangs, see restart().
+
+    """
+
+    def __init__(self, processes):
+        import multiprocessing
+        self.processes = processes
+        self.pool = multiprocessing.Pool(processes)
+        self.tasks = set()
+        self.lock = threading.Lock()
+
+    def _submit(self, task):
+        def done(result):
+            self.lock.acquire()
+            try:
+                current = task in self.tasks and task.result is None
+                if current:
+                    self.tasks.discard(task)
+                    task.result = result
+            finally:
+                self.lock.release()
+            if current:
+                task.finished.set()
+            elif result[0] is not None:
+                os.remove(result[0]) # abandoned or converted twice
+        self.pool.apply_async(_convert, task.args, callback=done)
+
+    def submit(self, args):
+        """Start the conversion _convert(*args) and return its _Task."""
+        task = _Task(args)
+        self.lock.acquire()
+        try:
+            self._submit(task)
+            self.tasks.add(task)
+        finally:
+            self.lock.release()
+        return task
+
+    def restart(self, task):
+        """Abandon the hanging task and replace the workers.
+
+        The other unfinished tasks are submitted to the new workers. Returns
+        False if task finished in the meantime.
+
+        """
+        import multiprocessing
+        self.lock.acquire()
+        try:
+            if task not in self.tasks:
+                return False
+            self.tasks.discard(task)
+            old = self.pool
+            self.pool = multiprocessing.Pool(self.processes)
+            for other in self.tasks:
+                self._submit(other)
+        finally:
+            self.lock.release()
+        old.terminate()
+        return True
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+
+class DocumentService(object):
+    """Converts ODF files in pools of worker processes.
+
+    processes workers (0: one per CPU) convert documents up to large_size
+    bytes, one more worker converts the larger ones. At most queue_size
+    conversions (default: 4 per worker) may be pending at once. Temporary
+    files are created in directory (default: the system's temp directory).
+
+    """
+
+    def __init__(self, processes=0, queue_size=None, timeout=60,
+                 max_size=64 << 20, large_size=8 << 20, directory=None):
+        import multiprocessing
+        processes = processes or multiprocessing.cpu_count()
+        self.timeout = timeout
+        self.max_size = max_size
+        self.large_size = large_size
+        self.directory = directory
+        self.pool = _WorkerPool(processes)
+        self.large_pool = _WorkerPool(1)
+        self.slots = threading.Semaphore(queue_size or 4 * (processes + 1))
+
+    def convert(self, kind, path):
+        """Return the path of a temporary file with the conversion of path.
+
+        kind is a key of content_types. The caller removes the file. If the
+        conversion exceeds the timeout, the workers of its pool are replaced
+        and ServiceTimeout is raised.
+
+        """
+        if kind not in content_types:
+            raise ServiceError('Unknown output format: %s' % kind)
+        if not self.slots.acquire(False):
+            raise ServiceBusy('Too many pending requests')
+        try:
+            pool = self.pool
+            if os.path.getsize(path) > self.large_size:
+                pool = self.large_pool
+            task = pool.submit((kind, path, self.directory))
+            task.finished.wait(self.timeout)
+            if not task.finished.isSet() and pool.restart(task):
+                raise ServiceTimeout('Conversion took longer than %s seconds'
+                                     % self.timeout)
+        finally:
+            self.slots.release()
+        outpath, error = task.result
+        if error is not None:
+            raise ServiceError(error)
+        return outpath
+
+    def close(self):
+        """Stop the workers after the pending conversions."""
+        for pool in (self.pool, self.large_pool):
+            pool.close()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    """Handles POST requests with ODF documents, see the module docstring."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _error(self, code, message):
+        body = message.encode('utf-8') + '\n'
+        self.send_response(code)
+        self.send_header('Content-Type', 'text/plain; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
+        self.close_connection = 1
+
+    def _spool(self, length):
+        """Copy length bytes of the request body to a temporary file."""
+        fd, path = tempfile.mkstemp('.odf', 'odf-', self.server.service.directory)
+        f = os.fdopen(fd, 'wb')
+        try:
+            while length > 0:
+                data = self.rfile.read(min(length, CHUNK_SIZE))
+                if not data:
+                    raise IOError('Incomplete request body')
+                f.write(data)
+                length -= len(data)
+        except:
+            f.close()
+            os.remove(path)
+            raise
+        f.close()
+        return path
+
+    def do_POST(self):
+        service = self.server.service
+        kind = self.path.strip('/').split('?')[0]
+        if kind not in content_types:
+            return self._error(404, u'Unknown output format: %s' % kind)
+        try:
+            length = int(self.headers.get('Content-Length', ''))
+        except ValueError:
+            return self._error(411, u'Content-Length required')
+        if length > service.max_size:
+            return self._error(413, u'Documents are limited to %d bytes'
+                                    % service.max_size)
+
+        try:
+            path = self._spool(length)
+        except IOError, e:
+            return self._error(400, unicode(e))
+        try:
+            try:
+                outpath = service.convert(kind, path)
+            except ServiceBusy, e:
+                return self._error(503, unicode(e))
+            except ServiceTimeout, e:
+                return self._error(504, unicode(e))
+            except ServiceError, e:
+                return self._error(422, unicode(e))
+        finally:
+            os.remove(path)
+
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', content_types[kind])
+            self.send_header('Content-Length', str(os.path.getsize(outpath)))
+            self.end_headers()
+            f = open(outpath, 'rb')
+            try:
+                shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+            finally:
+                f.close()
+        finally:
+            os.remove(outpath)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class DocumentServer(ThreadingMixIn, HTTPServer):
+    """HTTP server handing the documents posted to a DocumentService.
+
+    Each request is handled in its own thread. The keyword arguments are
+    passed to DocumentService.
+
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, verbose=False, **options):
+        self.service = DocumentService(**options)
+        self.verbose = verbose
+        HTTPServer.__init__(self, address, _RequestHandler)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+        self.service.close()
+
+
+if __name__ == '__main__':
+    from optparse import OptionParser
+
+    usage = "%prog [options]\n\n" + __doc__
+    parser = OptionParser(usage)
+    parser.add_option("--host", dest="host", default="localhost",
+            help="Listen on HOST [default: %default].")
+    parser.add_option("-p", "--port", dest="port", type="int", default=8000,
+            help="Listen on PORT [default: %default].")
+    parser.add_option("-j", "--jobs", dest="jobs", type="int", default=0,
+            metavar="N", help="Convert documents in N processes\
+            [default: one per CPU].")
+    parser.add_option("--queue-size", dest="queue_size", type="int",
+            metavar="N", help="Refuse requests while N are pending.")
+    parser.add_option("--timeout", dest="timeout", type="int", default=60,
+            metavar="SECONDS", help="Time limit per conversion\
+            [default: %default].")
+    parser.add_option("--max-size", dest="max_size", type="int", default=64,
+            metavar="MB", help="Refuse larger documents [default: %default].")
+    parser.add_option("-v", "--verbose", dest="verbose", action="store_true",
+            help="Log every request.")
+    options, args = parser.parse_args()
+
+    server = DocumentServer((options.host, options.port), options.verbose,
+                            processes=options.jobs,
+                            queue_size=options.queue_size,
+                            timeout=options.timeout,
+                            max_size=options.max_size << 20)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+# vim: et sts=4 sw=4
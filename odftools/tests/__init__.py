@@ -7,7 +7,7 @@ Filenames, test classes and other constants are defined here.
 
 """
 
-import unittest, os, sys, shutil, tempfile
+import unittest, os, sys, shutil, tempfile, zipfile
 
 # wd = os.getcwd()
 # if os.path.dirname(__file__) != wd:
@@ -56,6 +56,28 @@ class TestCaseOdfTempdir(TestCaseOdftools):
     def tearDown(self):
         shutil.rmtree(self.tempdir)
 
+    def _copy(self, source, name, members=(), skip=None):
+        """Copy the test document source to name in the temporary directory.
+
+        members are (name, data) tuples added to the members of source, except
+        those starting with skip. Returns the path of the copy.
+
+        """
+        path = os.path.join(self.tempdir, name)
+        if not members and skip is None:
+            shutil.copy(os.path.join(td, source), path)
+            return path
+        src = zipfile.ZipFile(os.path.join(td, source))
+        dst = zipfile.ZipFile(path, 'w')
+        for info in src.infolist():
+            if skip is None or not info.filename.startswith(skip):
+                dst.writestr(info, src.read(info.filename))
+        for member, data in members:
+            dst.writestr(member, data)
+        dst.close()
+        src.close()
+        return path
+
 
 class TestCaseOdfText(TestCaseOdftools):
     """A test case for odftools including a text document."""
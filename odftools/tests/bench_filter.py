@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: iso-8859-15 -*-
+
+"""Benchmark for the file filter stage of list_directory().
+
+Builds a synthetic directory tree of a million entries (100 files in each
+directory, a quarter of them ODF files) and prints the number of files per
+second checked by FileFilter and by the former chain of search functions.
+
+With --disk the tree is created in a temporary directory instead and
+list_directory() is timed as a whole (use -n to limit the number of files).
+
+"""
+
+import os, sys, shutil, tempfile, time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import odfmeta
+from document import get_search_for_filter, odf_formats
+
+
+extensions = ['odt', 'txt', 'ods', 'png', 'xml', 'ODP', 'doc', 'html']
+
+
+def synthetic_tree(entries, per_directory=100):
+    """Return a list of (root, names) tuples with entries names in total."""
+    tree = []
+    for d in range(entries // per_directory):
+        root = os.path.join('.', 'dir%03d' % (d % 1000), 'sub%05d' % d)
+        names = [u'file_%d_%d.%s' % (d, i, extensions[i % len(extensions)])
+                 for i in range(per_directory)]
+        tree.append((root, names))
+    return tree
+
+
+def filter_closures(tree, filter, ignore_case, include, exclude):
+    """The filter stage of list_directory() before FileFilter."""
+    search_user = get_search_for_filter(filter, ignore_case)
+    odf_extensions = r".*\.(?:" + "|".join(odf_formats.keys()) + ")$"
+    search_odf = get_search_for_filter(odf_extensions, ignore_case)
+    search_include = get_search_for_filter(include, ignore_case, False)
+    search_exclude = get_search_for_filter(exclude, ignore_case, False, False)
+
+    found = []
+    for root, files in tree:
+        files = [os.path.join(root, f)[2:] for f in files
+                 if search_user(f) and search_odf(f)]
+        if files:
+            files = [f for f in files if search_include(f)
+                     and not search_exclude(f)]
+            found.extend(files)
+    return found
+
+
+def filter_compiled(tree, filter, ignore_case, include, exclude):
+    """The filter stage of list_directory() using FileFilter."""
+    file_filter = odfmeta.FileFilter(filter, ignore_case, include, exclude)
+    found = []
+    for root, files in tree:
+        found.extend(file_filter.filter((root + os.sep)[2:], files))
+    return found
+
+
+def bench(name, function, count, *args):
+    start = time.time()
+    result = function(*args)
+    seconds = time.time() - start
+    print '%-10s %8d found %10.0f files/s' % (name, len(result), count / seconds)
+    return result
+
+
+def main():
+    from optparse import OptionParser
+
+    parser = OptionParser("%prog [-n ENTRIES] [--disk]\n\n" + __doc__)
+    parser.add_option("-n", dest="entries", type="int", default=1000000,
+                      help="Number of files in the tree.")
+    parser.add_option("--disk", dest="disk", action="store_true",
+                      help="Create the tree on disk and time list_directory().")
+    options, args = parser.parse_args()
+
+    tree = synthetic_tree(options.entries)
+    count = sum([len(names) for root, names in tree])
+    cases = [('*', False, None, None), ('file_1*', True, 'dir00', 'sub0001')]
+
+    if not options.disk:
+        for case in cases:
+            print 'filter=%r ignore_case=%r include=%r exclude=%r' % case
+            a = bench('closures', filter_closures, count, tree, *case)
+            b = bench('compiled', filter_compiled, count, tree, *case)
+            assert a == b
+        return
+
+    directory = tempfile.mkdtemp()
+    try:
+        for root, names in tree:
+            root = os.path.join(directory, root)
+            os.makedirs(root)
+            for name in names:
+                open(os.path.join(root, name), 'w').close()
+        for filter, ignore_case, include, exclude in cases:
+            print 'filter=%r ignore_case=%r include=%r exclude=%r' % \
+                  (filter, ignore_case, include, exclude)
+            bench('list_directory', odfmeta.list_directory, count, directory,
+                  filter, ignore_case, True, False, include, exclude)
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main()
+
+
+# vim: et sts=4 sw=4
@@ -12,9 +12,9 @@ This file uses classes and filenames defined in __init__.py.
 # before printing or writing to a file, unicode characters should be encoded properly
 # f.write(doc.toText().encode('latin_1', 'xmlcharrefreplace'))
 
-import os, tempfile
+import os, sys, tempfile
 
-from tests import TestCaseOdfText, TestCaseOdfImages
+from tests import TestCaseOdfText, TestCaseOdfImages, TestCaseOdfTempdir
 import odf, document, diff
 
 
@@ -27,6 +27,18 @@ class TestCaseText(TestCaseOdfText):
     def test_loads(self):
         self.assertTrue(isinstance(odf.loads(self._load(self.file)), document.Document))
 
+    def test_load_lazy(self):
+        doc = odf.load(self.file, lazy=True)
+        self.assertFalse(doc.content.is_parsed())
+        self.assertFalse(doc.styles.is_parsed())
+        self.assertTrue(simple_text in doc.totext())
+        self.assertTrue(doc.content.root is not None)
+        self.assertTrue(doc.content.is_parsed())
+        self.assertFalse(doc.styles.is_parsed())
+        s = odf.dumps(doc)
+        doc.close()
+        self.assertTrue(simple_text in odf.loads(s).totext())
+
     def test_dump(self):
         doc = odf.load(self.file)
         s1 = odf.dumps(doc)
@@ -48,6 +60,54 @@ class TestCaseText(TestCaseOdfText):
         text = doc.totext()
         self.assertTrue(simple_text in text)
 
+    def test_text_streaming(self):
+        doc = odf.load(self.file, lazy=True)
+        chunks = list(doc.iter_text())
+        self.assertFalse(doc.content.is_parsed())
+        doc.close()
+        doc = odf.load(self.file)
+        self.assertEqual(chunks, [node.text for node in
+                                  doc.content.root.getiterator() if node.text])
+        self.assertEqual(odf.OdfToText(self.file), doc.totext())
+
+    def test_author(self):
+        doc = odf.load(self.file)
+        self.assertEqual(doc.get_author(), u'Ren\xe9 Leonhardt')
+
+    def test_queries(self):
+        from components import namespaces
+        doc = odf.load(self.file)
+        content = doc.content
+        paragraphs = content.findall('.//text:p')
+        self.assertEqual(len(paragraphs), 1)
+        self.assertTrue(content.find('office:body/office:text/text:p')
+                        is paragraphs[0])
+        self.assertEqual(content.findtext(".//text:p[@text:style-name='Standard']"),
+                         simple_text)
+        self.assertEqual(list(content.iter('text:p')), paragraphs)
+        content.index_tags()
+        self.assertEqual(list(content.iter('text:p')), paragraphs)
+        self.assertEqual(list(content.iter('text:unknown')), [])
+        self.assertEqual(namespaces.compile_path("text:p[@text:style-name='a:b']"),
+                         "{%(ns)s}p[@{%(ns)s}style-name='a:b']"
+                         % {'ns': namespaces.namespaces['text']})
+        self.assertRaises(namespaces.NamespaceError, content.find, 'nix:p')
+        self.assertEqual(namespaces.prefixed(paragraphs[0].tag), 'text:p')
+        self.assertTrue(simple_text in doc.tohtml())
+
+    def test_metadata(self):
+        metadata = odf.get_metadata(self.file)
+        self.assertEqual(metadata['dc:creator'], u'Ren\xe9 Leonhardt')
+        doc = odf.load(self.file, lazy=True)
+        self.assertEqual(doc.get_metadata(), metadata)
+        self.assertFalse(doc.meta.is_parsed())
+        doc.close()
+        doc = odf.load(self.file)
+        doc.meta.root
+        self.assertEqual(doc.get_metadata(), metadata)
+        self.assertEqual(odf.loads(odf.dumps(doc)).get_metadata(), metadata)
+        self.assertTrue(metadata['meta:document-statistic']['word-count'] > 0)
+
     def test_html(self):
         doc = odf.load(self.file)
         html = doc.tohtml()
@@ -61,6 +121,38 @@ class TestCaseText(TestCaseOdfText):
         self.assertFalse(simple_text in text)
         self.assertTrue(s in text)
 
+    def test_replace_all(self):
+        doc = odf.load(self.file)
+        replacer = document.Replacer([('sentence', 'phrase'), ('sent', 'x'),
+                                      ('test', 'trial'), ('missing', 'y')])
+        self.assertEqual(doc.replace_all(replacer), 1)
+        self.assertTrue('This phrase serves for trial purposes.' in doc.totext())
+        self.assertEqual(replacer.counts,
+                         {'sentence': 1, 'sent': 0, 'test': 1, 'missing': 0})
+
+    def test_replace_long(self):
+        # Search strings longer than the recursion limit
+        depth = sys.getrecursionlimit() + 100
+        replacer = document.Replacer([('a' * depth, 'x'), ('ab', 'y')])
+        self.assertEqual(replacer.sub('a' * (depth + 1) + 'b'), 'xy')
+        # Shared prefixes which nest the expression too deeply
+        replacer = document.Replacer([('a' * n, str(n)) for n in range(1, 800)])
+        self.assertEqual(replacer.sub('a' * 801), '7992')
+
+    def test_replace_spans(self):
+        from components.content import Content
+        content = Content('<office:document-content xmlns:office='
+            '"urn:oasis:names:tc:opendocument:xmlns:office:1.0" xmlns:text='
+            '"urn:oasis:names:tc:opendocument:xmlns:text:1.0"><office:body>'
+            '<text:p>Hello <text:span>Wor</text:span>ld, foo<text:s/>bar</text:p>'
+            '</office:body></office:document-content>')
+        replacer = document.Replacer([('World', 'Earth'), ('foo bar', 'x')])
+        self.assertEqual(content.replace_all(replacer), 2)
+        self.assertEqual(replacer.counts, {'World': 1, 'foo bar': 0})
+        self.assertEqual(content.to_text(), os.linesep.join(['Hello ', 'Earth']))
+        self.assertEqual(content.replace('h,', 'h;'), 2)
+        self.assertTrue('Earth;' in content.to_text())
+
     def test_odf_to_sqlite(self):
         sqlite = None
         try:
@@ -124,10 +216,782 @@ class TestCaseImages(TestCaseOdfImages):
         self.assertRaises(document.ReCompileError, doc.get_embedded, r'*\.png')
         self.assertEqual(len(doc.get_embedded(r'10.*D.*\.png')), 1)
 
+    def test_dump_passthrough(self):
+        doc = odf.load(self.file, lazy=True)
+        doc.replace('.', 'x')
+        s = odf.dumps(doc)
+        self.assertFalse(doc.additional.is_read('Pictures/10000000000000780000003CAF26905F.gif'))
+        doc.close()
+
+        import zipfile
+        from cStringIO import StringIO
+        src = zipfile.ZipFile(self.file)
+        dst = zipfile.ZipFile(StringIO(s))
+        self.assertEqual(dst.testzip(), None)
+        for filename in ('styles.xml', 'Pictures/10000000000000780000003CAF26905F.gif'):
+            self.assertEqual(src.getinfo(filename).compress_size,
+                             dst.getinfo(filename).compress_size)
+            self.assertEqual(src.read(filename), dst.read(filename))
+        self.assertNotEqual(src.read('content.xml'), dst.read('content.xml'))
+
+    def test_images_lazy(self):
+        doc = odf.loads(self._load(self.file), lazy=True)
+        self.assertFalse(doc.additional.is_read('Pictures/10000000000000780000003CAF26905F.gif'))
+        self.assertEqual(len(doc.get_embedded('*?.gif')), 1)
+        self.assertTrue(doc.additional.is_read('Pictures/10000000000000780000003CAF26905F.gif'))
+        self.assertFalse(doc.additional.is_read('Pictures/10000201000001D40000003C3C4CDAE5.png'))
+        doc.close()
+
+    def test_embedded_objects(self):
+        doc = odf.load(self.file, lazy=True)
+        handles = doc.get_embedded_objects()
+        self.assertTrue(doc.get_embedded_objects() is handles)
+        self.assertEqual([handle.name for handle in handles],
+                         ['Pictures/10000000000000780000003CAF26905F.gif',
+                          'Pictures/10000201000001D40000003C3C4CDAE5.png'])
+        gif, png = handles
+        self.assertEqual((gif.kind, gif.key, gif.size, gif.media_type),
+                         ('image', '10000000000000780000003CAF26905F.gif',
+                          5900, 'image/gif'))
+        self.assertEqual(png.media_type, 'image/png')
+        self.assertFalse(doc.additional.is_read(gif.name))
+        source = gif.open()
+        data = source.read()
+        source.close()
+        self.assertEqual(len(data), 5900)
+        self.assertFalse(doc.additional.is_read(gif.name))
+        self.assertEqual(doc.get_embedded_objects('*.png'), [png])
+        self.assertEqual(doc.get_embedded_objects(kind='object'), [])
+
+        # Replaced data is returned instead of the archive member
+        doc.additional[gif.name] = 'GIF89a'
+        self.assertEqual((gif.size, gif.open().read()), (6, 'GIF89a'))
+        doc.additional['Object 1/content.xml'] = '<x/>'
+        self.assertEqual(doc.get_embedded(kind='object'),
+                         {'Object 1/content.xml': '<x/>'})
+        self.assertEqual(len(doc.get_embedded(kind=None)), 3)
+        # Replacing a file keeps the number of files
+        del doc.additional[png.name]
+        doc.additional['Pictures/new.png'] = 'PNG'
+        self.assertEqual([handle.name for handle in
+                          doc.get_embedded_objects('*.png')], ['Pictures/new.png'])
+        doc.close()
+
+    def test_manifest(self):
+        gif = 'Pictures/10000000000000780000003CAF26905F.gif'
+        doc = odf.load(self.file, lazy=True)
+        manifest = doc.manifest
+        self.assertEqual(manifest.get_entry(gif), ('image/gif', None, None))
+        self.assertTrue(manifest.has_entry('Pictures/'))
+        self.assertFalse(manifest.has_entry('Object 1/'))
+        self.assertEqual(manifest.get_media_type('Thumbnails/thumbnail.png'), None)
+        self.assertFalse(manifest.is_encrypted(gif))
+
+        # An unchanged manifest is copied without parsing it
+        s = odf.dumps(doc)
+        self.assertFalse(manifest.is_parsed())
+        import zipfile
+        from cStringIO import StringIO
+        self.assertEqual(zipfile.ZipFile(StringIO(s)).read('META-INF/manifest.xml'),
+                         zipfile.ZipFile(self.file).read('META-INF/manifest.xml'))
+
+        del doc.additional[gif]
+        doc.additional['Pictures/new.png'] = 'PNG'
+        doc2 = odf.loads(odf.dumps(doc))
+        doc.close()
+        self.assertFalse(doc2.manifest.has_entry(gif))
+        self.assertEqual(doc2.manifest.get_media_type('Pictures/new.png'), 'image/png')
+        self.assertTrue(doc2.manifest.has_entry('Pictures/'))
+        self.assertTrue(doc2.manifest.has_entry('content.xml'))
+        self.assertEqual(sorted(doc2.get_embedded().keys()),
+                         ['10000201000001D40000003C3C4CDAE5.png', 'new.png'])
+
+        from components.manifest import Manifest, MANIFEST_NS
+        manifest = Manifest('<manifest:manifest xmlns:manifest="%s">'
+                '<manifest:file-entry manifest:full-path="content.xml"'
+                ' manifest:media-type="text/xml" manifest:size="3730">'
+                '<manifest:encryption-data manifest:checksum="abc=">'
+                '<manifest:algorithm manifest:algorithm-name="Blowfish CFB"/>'
+                '</manifest:encryption-data></manifest:file-entry>'
+                '</manifest:manifest>' % MANIFEST_NS[1:-1])
+        self.assertTrue(manifest.is_encrypted('content.xml'))
+        self.assertEqual(manifest.get_entry('content.xml'), ('text/xml', 3730,
+                         {'encryption-data': {'checksum': 'abc='},
+                          'algorithm': {'algorithm-name': 'Blowfish CFB'}}))
+
+
+class TestCaseExtract(TestCaseOdfTempdir):
+    """A test case for extracting embedded files."""
+
+    def setUp(self):
+        super(TestCaseExtract, self).setUp()
+        self.file = self._copy('simple_graphics.odt', 'a.odt')
+
+    def test_extract(self):
+        from extract import extract_embedded, get_target_directory
+        directory = os.path.join(self.tempdir, 'out')
+        errors = []
+        count = extract_embedded([self.file, self.file + '.missing'],
+                                 directory, errors=errors)
+        self.assertEqual(count, 2)
+        self.assertEqual([path for path, error in errors],
+                         [self.file + '.missing'])
+        target = get_target_directory(self.file, directory)
+        doc = odf.load(self.file)
+        for name, data in doc.get_embedded().items():
+            f = open(os.path.join(target, 'Pictures', name), 'rb')
+            self.assertEqual(f.read(), data)
+            f.close()
+
+    def test_extract_unsafe_name(self):
+        from extract import extract_document, ExtractError, get_output_path
+        path = self._copy('simple_graphics.odt', 'unsafe.odt',
+                          [('Pictures/../../../escaped.png', 'PNG')])
+        directory = os.path.join(self.tempdir, 'out')
+        result, extracted, error = extract_document(path, directory)
+        self.assertEqual(extracted, [])
+        self.assertTrue('escaped.png' in error)
+        self.assertFalse(os.path.exists(os.path.join(self.tempdir, 'escaped.png')))
+        self.assertFalse(os.path.exists(directory))
+
+        target = os.path.join(self.tempdir, 'target')
+        for name in ('', '/etc/passwd', 'Pictures/..', 'Pictures/../x.png'):
+            self.assertRaises(ExtractError, get_output_path, target, name)
+        self.assertEqual(get_output_path(target, 'Pictures/./a.png'),
+                         os.path.join(target, 'Pictures', 'a.png'))
+
+    def test_extract_thumbnail_names(self):
+        import extract
+        path = self._copy('simple_graphics.odt', 'x.odt',
+                          [('Pictures/x.gif', 'GIF'), ('Pictures/x.png', 'PNG')],
+                          skip='Pictures/')
+        make_thumbnail, image = extract.make_thumbnail, extract.Image
+        def fake_thumbnail(handle, path, size):
+            f = open(path, 'wb')
+            f.write(handle.name)
+            f.close()
+            return True
+        extract.make_thumbnail, extract.Image = fake_thumbnail, object()
+        try:
+            directory = os.path.join(self.tempdir, 'out')
+            result, extracted, error = extract.extract_document(
+                    path, directory, thumbnail_size=32)
+        finally:
+            extract.make_thumbnail, extract.Image = make_thumbnail, image
+        self.assertEqual(error, None)
+        thumbnails = os.path.join(
+                extract.get_target_directory(path, directory), 'thumbnails')
+        for name in ('x.gif', 'x.png'):
+            thumbnail = os.path.join(thumbnails, name + '.png')
+            self.assertTrue(thumbnail in extracted)
+            self.assertEqual(self._load(thumbnail), 'Pictures/' + name)
+
+
+class TestCaseCache(TestCaseOdfTempdir):
+    """A test case for the document cache."""
+
+    def test_cache(self):
+        from cache import DocumentCache
+        cache = DocumentCache(self.tempdir, max_size=100)
+        name = os.path.join(self.tempdir, 'a.odt')
+        f = open(name, 'wb')
+        f.write('data')
+        f.close()
+        key = cache.key(name)
+        self.assertEqual(cache.get(key, 'txt'), None)
+        cache.set(key, 'txt', u'Ren\xe9')
+        cache.set(key, 'html', '<html/>')
+        self.assertEqual(cache.get(key, 'txt'), u'Ren\xe9')
+        self.assertEqual(cache.get(key, 'html'), '<html/>')
+        self.assertEqual(cache.key(name, True), cache.key(name, True))
+
+        os.utime(name, (0, 0))
+        self.assertNotEqual(cache.key(name), key)
+
+        cache.set('other', 'txt', 'x' * 90)
+        self.assertEqual(cache.get(key, 'txt'), None)
+        self.assertEqual(cache.get('other', 'txt'), 'x' * 90)
+        cache.close()
+
+    def test_process_file(self):
+        from optparse import Values
+        outdir = os.path.join(self.tempdir, 'out')
+        os.mkdir(outdir)
+        options = Values(dict(list_author=None, totxt=None, tohtml=True,
+                toxml=None, toodf=None, replace=None, replacer=None,
+                cache=os.path.join(self.tempdir, 'cache'), cache_hash=True,
+                cache_size=1 << 20, directory=outdir, filename=None,
+                force=False, stdin=None, stdout=False, extension_append=False,
+                extension_replace=True))
+        warnings = []
+        echo, odf.echo = odf.echo, warnings.append
+        try:
+            # Copies share the cache entry, but not the title
+            for name in ('a.odt', 'b.odt'):
+                path = self._copy('simple_text.odt', name)
+                odf.process_file(path, options, 'utf-8')
+                html = self._load(os.path.join(outdir, name[0] + '.html'))
+                self.assertTrue('<title>%s</title>' % name in html)
+
+            # A broken cache is not used
+            options.cache = os.path.join(self.tempdir, 'broken')
+            os.mkdir(options.cache)
+            f = open(os.path.join(options.cache, 'odftools-cache.sqlite'), 'wb')
+            f.write('no database' * 100)
+            f.close()
+            os.remove(os.path.join(outdir, 'a.html'))
+            odf.process_file(os.path.join(self.tempdir, 'a.odt'), options,
+                             'utf-8')
+        finally:
+            odf.echo = echo
+        self.assertTrue(os.path.isfile(os.path.join(outdir, 'a.html')))
+        self.assertEqual(len(warnings), 1)
+        self.assertTrue(warnings[0].startswith('Warning: could not use cache'))
+
+
+class TestCaseBatch(TestCaseOdfTempdir):
+    """A test case for processing input files in parallel."""
+
+    def setUp(self):
+        super(TestCaseBatch, self).setUp()
+        self.files = [self._copy('simple_text.odt', 'a.odt'),
+                      self._copy('simple_graphics.odt', 'b.odt')]
+        self.corrupt = os.path.join(self.tempdir, 'corrupt.odt')
+        f = open(self.corrupt, 'wb')
+        f.write('PK\x03\x04 truncated')
+        f.close()
+
+        # Warnings of the worker processes are collected in a file
+        self.log = os.path.join(self.tempdir, 'warnings.log')
+        self._echo, odf.echo = odf.echo, self._log_warning
+        self._argv = sys.argv
+
+    def tearDown(self):
+        odf.echo = self._echo
+        sys.argv = self._argv
+        super(TestCaseBatch, self).tearDown()
+
+    def _log_warning(self, msg, *args):
+        f = open(self.log, 'ab')
+        f.write(msg.encode('utf-8') + '\n')
+        f.close()
+
+    def _warnings(self):
+        if not os.path.isfile(self.log):
+            return ''
+        return self._load(self.log).decode('utf-8')
+
+    def _main(self, *args):
+        sys.argv = ['odf.py'] + list(args)
+        odf.main()
+
+    def test_process_file(self):
+        import multiprocessing
+        from optparse import Values
+        outdir = os.path.join(self.tempdir, 'out')
+        os.mkdir(outdir)
+        options = Values(dict(list_author=True, totxt=True, tohtml=None,
+                toxml=None, toodf=None, replace=None, replacer=None,
+                cache=None, directory=outdir, filename=None, force=False,
+                stdin=None, stdout=False, extension_append=False,
+                extension_replace=True))
+        jobs = [(infile, options, 'utf-8', 1)
+                for infile in self.files + [self.corrupt]]
+        pool = multiprocessing.Pool(2)
+        try:
+            results = pool.map(odf._process_job, jobs)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual([(infile, error) for infile, author, error in results],
+                         [(infile, None) for infile, options, encoding, verbosity
+                          in jobs])
+        self.assertEqual([author for infile, author, error in results],
+                         [u'Ren\xe9 Leonhardt'] * 2 + [''])
+        self.assertEqual(sorted(os.listdir(outdir)), ['a.txt', 'b.txt'])
+        self.assertTrue(u'Skipping input file "%s"' % self.corrupt
+                        in self._warnings())
+
+    def test_main_jobs(self):
+        authors = os.path.join(self.tempdir, 'authors.txt')
+        self._main(self.corrupt, *self.files + ['--list-authors', authors,
+                                                '-j', '2'])
+        # The list is written in the encoding main() uses for file names
+        encoding = sys.stdout.encoding or sys.getfilesystemencoding()
+        author = u'Author Ren\xe9 Leonhardt (2 files):'
+        self.assertEqual(self._load(authors).splitlines(),
+                         [author.encode(encoding, 'replace')] + self.files)
+        self.assertTrue(u'Skipping input file "%s"' % self.corrupt
+                        in self._warnings())
+
+        os.remove(authors)
+        self._main(self.files[0], '--list-authors', authors, '-j', '-1')
+        self.assertFalse(os.path.isfile(authors))
+        self.assertTrue(u'invalid number of jobs: -1' in self._warnings())
+
+    def test_main_serial_error(self):
+        # An error in one file doesn't stop a run without worker processes
+        process_file = odf.process_file
+        def failing(infile, *args):
+            if infile == self.files[0]:
+                raise odf.WriteError('disk full')
+            return process_file(infile, *args)
+        odf.process_file = failing
+        try:
+            authors = os.path.join(self.tempdir, 'authors.txt')
+            self._main(*self.files + ['--list-authors', authors, '-j', '1'])
+        finally:
+            odf.process_file = process_file
+        self.assertEqual(self._load(authors).splitlines()[1:], self.files[1:])
+        self.assertTrue(u'Could not process input file "%s": disk full'
+                        % self.files[0] in self._warnings())
+
+
+class TestCaseDirectory(TestCaseOdfTempdir):
+    """A test case for directory scanning."""
+
+    def test_index(self):
+        name = self._copy('simple_text.odt', 'a.odt')
+        index_name = os.path.join(self.tempdir, 'index')
+
+        index = odf.DirectoryIndex(index_name)
+        self.assertEqual(odf.list_directory(self.tempdir, '', index=index), [name])
+        index.save()
+        index = odf.DirectoryIndex(index_name)
+        self.assertEqual(odf.list_directory(self.tempdir, '', index=index), [])
+        os.utime(name, (0, 0))
+        self.assertEqual(odf.list_directory(self.tempdir, '', index=index), [name])
+
+    def test_symlink_loop(self):
+        # Symbolic links to directories are not followed, like os.walk()
+        if not hasattr(os, 'symlink'):
+            return
+        sub = os.path.join(self.tempdir, 'sub')
+        os.mkdir(sub)
+        name = self._copy('simple_text.odt', os.path.join('sub', 'a.odt'))
+        os.symlink(self.tempdir, os.path.join(sub, 'up'))
+        self.assertEqual(odf.list_directory(self.tempdir, '', recursive=True),
+                         [name])
+
+    def test_file_filter(self):
+        file_filter = odf.FileFilter('a*', True, 'docs', 'old')
+        self.assertTrue(file_filter.match(os.path.join('docs', 'A.ODT')))
+        self.assertFalse(file_filter.match(os.path.join('docs', 'b.odt')))
+        self.assertFalse(file_filter.match(os.path.join('docs', 'a.txt')))
+        self.assertFalse(file_filter.match(os.path.join('docs', 'old', 'a.odt')))
+        self.assertEqual(file_filter.filter('docs/', ['a.odt', 'odt', 'a.doc']),
+                         ['docs/a.odt'])
+
+
+class TestCaseSpreadsheet(TestCaseOdfTempdir):
+    """A test case for the tables of spreadsheets."""
+
+    def _check_table(self, table):
+        self.assertEqual(table.name, u'Sheet1')
+        self.assertEqual((table.nrows, table.ncols), (1002, 4))
+        self.assertEqual(len(table.row_starts), 4)
+        self.assertEqual(table.cell(0, 0), u'Name')
+        self.assertEqual(table.cell(1, 1), 2.5)
+        self.assertEqual(table.cell(1, 2), None)
+        self.assertEqual(table.cell(1, 3), u'a  b')
+        self.assertEqual(table.cell(1000, 2), True)
+        self.assertEqual(table.cell(1001, 0), u'2008-01-31')
+        self.assertEqual(table.cell(1002, 0), None)
+        column = table.column(1)
+        self.assertEqual(len(column), 1002)
+        self.assertEqual(column[:3], [u'Value', 2.5, 2.5])
+        self.assertEqual(list(table.iter_rows())[-1],
+                         (u'2008-01-31', None, None, None))
+
+    def test_tables(self):
+        doc = document.SpreadsheetDoc(content=spreadsheet_xml)
+        self._check_table(doc.get_table(u'Sheet1'))
+        self.assertFalse(doc.content.is_parsed())
+        self.assertEqual([t.name for t in doc.get_tables()], [u'Sheet1', u'Empty'])
+        self.assertEqual(doc.get_tables()[1].nrows, 0)
+        doc.content.root
+        self._check_table(doc.get_tables()[0])
+        self.assertTrue(doc.content.root.find('.//' + TABLE_NS + 'table-row')
+                        is not None)
+
+    def test_repeated_columns(self):
+        cell = ('<table:table-cell office:value-type="float" office:value="%s"'
+                ' table:number-columns-repeated="%d"/>')
+        xml = spreadsheet_xml.replace('<table:table table:name="Empty"/>',
+            '<table:table table:name="Wide"><table:table-row>' +
+            cell % (1, 1) + cell % (2, 10000) + cell % (3, 1) +
+            '</table:table-row><table:table-row>' + cell % (4, 5001) +
+            '</table:table-row></table:table><table:table table:name="Empty"/>')
+        table = document.SpreadsheetDoc(content=xml).get_table(u'Wide')
+        # The interior run is only split where the second row ends
+        self.assertEqual(list(table.col_starts), [0, 1, 5001, 10001])
+        self.assertEqual((table.nrows, table.ncols), (2, 10002))
+        self.assertEqual([table.cell(0, col) for col in (0, 1, 5000, 5001, 10001)],
+                         [1.0, 2.0, 2.0, 2.0, 3.0])
+        self.assertEqual([table.cell(1, col) for col in (0, 5000, 5001, 10001)],
+                         [4.0, 4.0, None, None])
+        self.assertEqual(table.column(5001), [2.0, None])
+        rows = list(table.iter_rows())
+        self.assertEqual(rows[0], (1.0,) + (2.0,) * 10000 + (3.0,))
+        self.assertEqual(rows[1], (4.0,) * 5001 + (None,) * 5001)
+
+    def _write_ods(self):
+        import zipfile
+        name = os.path.join(self.tempdir, 'a.ods')
+        zf = zipfile.ZipFile(name, 'w')
+        zf.writestr('mimetype', 'application/vnd.oasis.opendocument.spreadsheet')
+        zf.writestr('content.xml', spreadsheet_xml)
+        zf.close()
+        return name
+
+    def test_load(self):
+        doc = odf.load(self._write_ods(), lazy=True)
+        self.assertTrue(isinstance(doc, document.SpreadsheetDoc))
+        self._check_table(doc.get_tables()[0])
+        doc.close()
+
+    def test_csv(self):
+        import csv, odftables
+        names = odftables.OdfToCsv(self._write_ods())
+        self.assertEqual(names, [os.path.join(self.tempdir, 'a-Sheet1.csv'),
+                                 os.path.join(self.tempdir, 'a-Empty.csv')])
+        rows = list(csv.reader(open(names[0], 'rb')))
+        self.assertEqual(len(rows), 1002)
+        self.assertEqual(rows[:2], [['Name', 'Value'], ['', '2.5', '', 'a  b']])
+        self.assertEqual(rows[-2:], [['', '', 'TRUE'], ['2008-01-31']])
+        self.assertEqual(open(names[1], 'rb').read(), '')
+        self.assertEqual([odftables._csv_value(value, 'utf-8') for value in
+                          (2.0, 2.5, float('inf'), float('nan'))],
+                         ['2', '2.5', 'inf', 'nan'])
+
+        # Tables with the same file name don't overwrite each other
+        import zipfile
+        name = os.path.join(self.tempdir, 'b.ods')
+        zf = zipfile.ZipFile(name, 'w')
+        zf.writestr('mimetype', 'application/vnd.oasis.opendocument.spreadsheet')
+        zf.writestr('content.xml', spreadsheet_xml.replace(
+                '<table:table table:name="Empty"/>',
+                '<table:table table:name="A/B"/><table:table table:name="A B"/>'
+                '<table:table table:name="a b"/>'))
+        zf.close()
+        names = odftables.OdfToCsv(name)
+        self.assertEqual([os.path.basename(name) for name in names],
+                         ['b-Sheet1.csv', 'b-A_B.csv', 'b-A_B-2.csv',
+                          'b-a_b-3.csv'])
+        self.assertEqual(len(os.listdir(self.tempdir)), 8)
+
+    def test_sqlite(self):
+        import odftables
+        try:
+            from sqlite3 import dbapi2 as sqlite    # Python25
+        except ImportError:
+            from pysqlite2 import dbapi2 as sqlite  # Python24 and pysqlite
+        database = os.path.join(self.tempdir, 'a.sqlite')
+        name = self._write_ods()
+        tables = odftables.OdfTablesToSqlite(name, database, batch_size=100)
+        self.assertEqual(tables, [(u'Sheet1', 1001)])
+        tables = odftables.OdfTablesToSqlite(name, database, synchronous='OFF')
+        self.assertEqual(tables, [(u'Sheet1', 1001)])
+        db = sqlite.connect(database)
+        sql = db.execute("SELECT sql FROM sqlite_master").fetchone()[0]
+        self.assertEqual(sql, 'CREATE TABLE "Sheet1" ("Name" TEXT, "Value" REAL, '
+                              '"c3" INTEGER, "c4" TEXT)')
+        self.assertEqual(db.execute('SELECT COUNT(*), SUM("Value") FROM "Sheet1"')
+                         .fetchone(), (1001, 2497.5))
+        self.assertEqual(db.execute('SELECT * FROM "Sheet1" WHERE c3').fetchall(),
+                         [(None, None, 1, None)])
+        db.close()
+
+        name = os.path.join(self.tempdir, 'b.ods')
+        odftables.SqliteToOds(database, name)
+        table = odf.load(name).get_tables()[0]
+        self.assertEqual((table.name, table.nrows, table.ncols), (u'Sheet1', 1002, 4))
+        self.assertEqual(table.column(1)[:3], [u'Value', 2.5, 2.5])
+
+        inf = float('inf')
+        self.assertEqual([odftables._sql_value(value) for value in (2.0, 2.5, inf)],
+                         [2, 2.5, inf])
+        nan = odftables._sql_value(float('nan'))
+        self.assertTrue(isinstance(nan, float) and nan != nan)
+
+    def test_ods_writer(self):
+        import odftables
+        name = os.path.join(self.tempdir, 'a.csv')
+        f = open(name, 'wb')
+        f.write('Name,Count\r\n' + 'a  b,007\r\n' * 3 + ' x ,1.5e3\r\n,,TRUE\r\n')
+        f.close()
+        odsname = os.path.join(self.tempdir, 'a.ods')
+        odftables.CsvToOds([name], odsname)
+
+        doc = odf.load(odsname, lazy=True)
+        self.assertTrue(isinstance(doc, document.SpreadsheetDoc))
+        self.assertTrue('table:number-rows-repeated="3"' in doc.content.tostring())
+        rows = list(doc.get_table(u'a').iter_rows())
+        self.assertEqual(rows, [(u'Name', u'Count', None), (u'a  b', u'007', None),
+                                (u'a  b', u'007', None), (u'a  b', u'007', None),
+                                (u' x ', 1500.0, None), (None, None, True)])
+        doc.close()
+
+        # Infinity is no valid office:value, a failed conversion leaves no file
+        self.assertTrue('office:value-type="string"><text:p>inf<' in
+                        odftables._cell_xml(float('inf')))
+        os.remove(odsname)
+        self.assertRaises(odftables.ReadError, odftables.CsvToOds,
+                          [name, name + '.missing'], odsname)
+        self.assertFalse(os.path.exists(odsname))
+
+
+class TestCaseArchive(TestCaseOdfTempdir):
+    """A test case for the content-addressed document archive."""
+
+    def test_archive(self):
+        import zipfile, archive
+        from tests import td
+        src = os.path.join(td, 'simple_graphics.odt')
+        copy = os.path.join(self.tempdir, 'copy.odt')
+        doc = odf.load(src)
+        doc.replace('.', '!')
+        odf.dump(doc, copy)
+
+        store = archive.DocumentArchive(os.path.join(self.tempdir, 'a.sqlite'))
+        ids = [store.add(src), store.add(copy), store.add(src)]
+        self.assertEqual([name for id, name in store.documents()], [src, copy, src])
+        total, stored = store.sizes()
+        self.assertTrue(stored < total / 2)
+
+        name = os.path.join(self.tempdir, 'rebuilt.odt')
+        store.write(ids[1], name)
+        zf1, zf2 = zipfile.ZipFile(copy), zipfile.ZipFile(name)
+        self.assertEqual(zf1.namelist(), zf2.namelist())
+        for filename in zf1.namelist():
+            self.assertEqual(zf1.read(filename), zf2.read(filename))
+        zf1.close()
+        zf2.close()
+        self.assertEqual(len(store.load(ids[2]).get_embedded()), 2)
+
+        store.remove(ids[0])
+        store.remove(ids[2])
+        self.assertEqual(store.sizes()[1], store.sizes()[0])
+        store.close()
+        # Errors of BEGIN aren't hidden by the failing ROLLBACK
+        self.assertRaises(archive.ArchiveError, store.remove, ids[1])
+
+    def test_corrupt_member(self):
+        import zipfile, archive
+        from tests import td
+        name = os.path.join(self.tempdir, 'corrupt.odt')
+        zf = zipfile.ZipFile(name, 'w', zipfile.ZIP_DEFLATED)
+        zf.writestr('mimetype', 'application/vnd.oasis.opendocument.text')
+        zf.writestr('content.xml', '<x>%s</x>' % ('text ' * 1000))
+        offset = zf.getinfo('content.xml').header_offset + 30 + len('content.xml')
+        zf.close()
+        f = open(name, 'r+b')
+        f.seek(offset + 2)
+        f.write('\xff' * 16)
+        f.close()
+
+        store = archive.DocumentArchive(os.path.join(self.tempdir, 'a.sqlite'))
+        self.assertRaises(archive.odfmeta.ReadError, store.add, name)
+        # The transaction has been rolled back
+        src = os.path.join(td, 'simple_text.odt')
+        store.add(src)
+        self.assertEqual([name for id, name in store.documents()], [src])
+        store.close()
+
+
+class TestCaseSearch(TestCaseOdfTempdir):
+    """A test case for the full-text search index."""
+
+    def test_search(self):
+        import search
+        names = [self._copy('simple_text.odt', 'a.odt'),
+                 self._copy('formatted_text.odt', 'b.odt')]
+        self.assertEqual(list(odf.load(names[0]).iter_paragraphs()),
+                         [(0, simple_text)])
+
+        index = search.SearchIndex(os.path.join(self.tempdir, 'index'))
+        self.assertEqual(index.update(names), 2)
+        self.assertEqual(index.update(names), 0)
+        self.assertEqual(index.search('"serves for test"'),
+                         [(names[0], 0, simple_text)])
+        self.assertEqual(index.search('sentence NOT purposes'), [])
+        self.assertEqual(index.search('"test serves"'), [])
+        self.assertRaises(search.SearchError, index.search, '"unbalanced')
+
+        os.utime(names[0], (0, 0))
+        self.assertEqual(index.update(names), 1)
+        self.assertEqual(len(index.search('serves')), 1)
+        os.remove(names[0])
+        self.assertEqual(index.purge(), 1)
+        self.assertEqual(index.search('serves'), [])
+
+        # Deleted files don't stop an update and are removed from the index
+        self._copy('simple_text.odt', 'a.odt')
+        self.assertEqual(index.update(names), 1)
+        os.remove(names[0])
+        os.utime(names[1], (0, 0))
+        self.assertEqual(index.update(names), 1)
+        self.assertEqual(index.search('serves'), [])
+        self.assertEqual(index.purge(), 0)
+        index.close()
+
+
+class TestCaseDiff(TestCaseOdfTempdir):
+    """A test case for comparing documents."""
+
+    def test_diff_sequences(self):
+        import random
+        rng = random.Random(1234) # reproducible failures
+        for n in range(50):
+            a = [rng.choice('abcdefghij') for i in range(rng.randint(0, 30))]
+            b = a[:]
+            for i in range(rng.randint(0, 5)):
+                pos = rng.randint(0, len(b))
+                b[pos:pos + rng.randint(0, 3)] = rng.sample('ABCDEFGHIJ', 2)
+            result = []
+            for tag, i1, i2, j1, j2 in diff.diff_sequences(a, b):
+                if tag == 'equal':
+                    self.assertEqual(a[i1:i2], b[j1:j2])
+                result.extend(b[j1:j2])
+            self.assertEqual(result, b)
+
+    def test_diff(self):
+        from tests import td
+        src = os.path.join(td, 'formatted_text.odt')
+        name = os.path.join(self.tempdir, 'changed.odt')
+        doc = odf.load(src)
+        doc.replace('different', 'other')
+        odf.dump(doc, name)
+
+        doc1, doc2 = odf.load(src, lazy=True), odf.load(src, lazy=True)
+        self.assertTrue(diff.diff(doc1, doc2).is_equal())
+        self.assertFalse(doc1.content.is_parsed())
+        doc2 = odf.load(name, lazy=True)
+        result = diff.diff(doc1, doc2)
+        self.assertEqual(result.parts, [('content.xml', 'changed')])
+        self.assertEqual([op[0] for op in result.opcodes],
+                         ['equal', 'replace', 'equal'])
+        lines = list(result.unified(n=0))
+        self.assertEqual(lines[3:], [u'-This paragraph uses a different style (Text body).',
+                                     u'+This paragraph uses a other style (Text body).'])
+        doc1.close()
+        doc2.close()
+
+
+class TestCaseDedup(TestCaseOdfTempdir):
+    """A test case for finding duplicate documents."""
+
+    def test_find_duplicates(self):
+        import dedup
+        from tests import td
+        src = os.path.join(td, 'formatted_text.odt')
+        names = [os.path.join(self.tempdir, name) for name in
+                 ('copy.odt', 'dumped.odt', 'changed.odt', 'other.odt')]
+        self._copy('formatted_text.odt', 'copy.odt')
+        odf.dump(odf.load(src), names[1])
+        doc = odf.load(src)
+        doc.replace('different', 'other')
+        odf.dump(doc, names[2])
+        self._copy('simple_text.odt', 'other.odt')
+
+        self.assertEqual(dedup.fingerprint(src)[1:3],
+                         dedup.fingerprint(names[1])[1:3])
+        self.assertNotEqual(dedup.fingerprint(src)[1],
+                            dedup.fingerprint(names[2])[1])
+        self.assertEqual(dedup.find_duplicates([src] + names, 0),
+                         [('exact', sorted([src] + names[:2]))])
+        self.assertEqual(dedup.find_duplicates([src] + names, 0.5),
+                         [('exact', sorted([src] + names[:2])),
+                          ('similar', sorted([src] + names[:3]))])
+        self.assertEqual(dedup.similarity(dedup.minhash(u'a b'.split()),
+                                          dedup.minhash(u'a b'.split())), 1.0)
+        self.assertEqual(dedup.minhash([]), None)
+
+
+def _hanging_convert(kind, path, directory):
+    """Run service._convert(), hanging on the document "hang"."""
+    import time
+    if open(path, 'rb').read() == 'hang':
+        time.sleep(600)
+    return _hanging_convert.convert(kind, path, directory)
+
+
+class TestCaseService(TestCaseOdfTempdir):
+    """A test case for the HTTP conversion service."""
+
+    def test_service(self):
+        import httplib, json, threading, service
+        from tests import td
+        server = service.DocumentServer(('localhost', 0), processes=1,
+                                        max_size=1 << 20, directory=self.tempdir)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        def post(path, body):
+            connection = httplib.HTTPConnection('localhost', server.server_port)
+            connection.request('POST', path, body)
+            response = connection.getresponse()
+            result = response.status, response.read()
+            connection.close()
+            return result
+        try:
+            data = self._load(os.path.join(td, 'simple_text.odt'))
+            status, text = post('/text', data)
+            self.assertEqual(status, 200)
+            self.assertEqual(text.decode('utf-8'), simple_text)
+            status, metadata = post('/metadata', data)
+            self.assertEqual(json.loads(metadata)['dc:creator'],
+                             u'Ren\xe9 Leonhardt')
+            self.assertEqual(post('/pdf', data)[0], 404)
+            self.assertEqual(post('/text', 'no document')[0], 422)
+            self.assertEqual(post('/text', ' ' * (2 << 20))[0], 413)
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        self.assertEqual(os.listdir(self.tempdir), [])
+
+    def test_timeout(self):
+        import httplib, threading, service
+        from tests import td
+        # The workers are forked with the hanging conversion
+        _hanging_convert.convert = convert = service._convert
+        service._convert = _hanging_convert
+        try:
+            server = service.DocumentServer(('localhost', 0), processes=1,
+                                            timeout=1, directory=self.tempdir)
+        finally:
+            service._convert = convert
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        def post(path, body):
+            connection = httplib.HTTPConnection('localhost', server.server_port)
+            connection.request('POST', path, body)
+            response = connection.getresponse()
+            result = response.status, response.read()
+            connection.close()
+            return result
+        try:
+            self.assertEqual(post('/text', 'hang')[0], 504)
+            # The hanging worker has been replaced
+            data = self._load(os.path.join(td, 'simple_text.odt'))
+            status, text = post('/text', data)
+            self.assertEqual(status, 200)
+            self.assertEqual(text.decode('utf-8'), simple_text)
+        finally:
+            server.shutdown()
+            thread.join()
+            server.server_close()
+        self.assertEqual(os.listdir(self.tempdir), [])
+
 
 class TestCaseFormatting(TestCaseOdfText):
     """A test case for odf documents with tables, lists and formatted text."""
 
+    def setUp(self):
+        super(TestCaseFormatting, self).setUp()
+        from tests import td
+        self.file = os.path.join(td, 'formatted_text.odt')
+
     def test_text(self):
         doc = odf.load(self.file)
         text = doc.totext()
@@ -137,6 +1001,91 @@ class TestCaseFormatting(TestCaseOdfText):
         doc = odf.load(self.file)
         html = doc.tohtml()
         self.assertTrue(formatted_html in html)
+        doc = odf.load(self.file, lazy=True)
+        self.assertEqual(doc.tohtml(), html)
+        self.assertFalse(doc.content.is_parsed())
+        doc.close()
+
+    def test_css(self):
+        doc = odf.load(self.file, lazy=True)
+        css = doc.tocss()
+        self.assertFalse(doc.content.is_parsed())
+        self.assertTrue('p.Heading_20_1, h1.Heading_20_1' in css)
+        self.assertTrue('font-family: Arial, sans-serif; font-size: 16.1pt;'
+                        ' font-weight: bold' in css) # 115% of Heading
+        self.assertTrue('td.Table1\\.A1 {' in css) # automatic style
+        self.assertTrue('span.T3, a.T3 { text-decoration: underline }' in css)
+        self.assertTrue(css in doc.tohtml())
+        other = odf.load(self.file)
+        self.assertTrue(other.styles.get_stylesheet() is
+                        doc.styles.get_stylesheet())
+        self.assertEqual(other.tocss(), css)
+        doc.close()
+
+    def test_style_index(self):
+        from components import styles
+        doc = odf.load(self.file)
+        index = doc.get_style_index()
+        self.assertTrue(doc.get_style_index() is index)
+        properties = index.get_properties('paragraph', 'P4') # automatic
+        self.assertEqual(properties['fo:font-weight'], 'bold')
+        self.assertEqual(properties['fo:text-align'], 'center')
+        self.assertEqual(properties['style:font-name'], 'Times New Roman')
+        self.assertEqual(index.get_properties('paragraph', 'Heading_20_1')
+                         ['fo:font-size'], '16.1pt')
+        self.assertEqual(index.get_style('paragraph', 'Standard')
+                         .get('{%s}class' % styles.STYLE_NS[1:-1]), 'text')
+        self.assertEqual(index.get_style('paragraph', 'Unknown'), None)
+        fonts = [index.get_element_properties(node).get('style:font-name')
+                 for node in doc.content.iter('text:h')]
+        self.assertTrue(fonts)
+        self.assertEqual(set(fonts), set(['Arial']))
+
+        # Inheritance loops and unknown parents end at the default style
+        xml = ('<office:document-styles xmlns:office="%s" xmlns:style="%s">'
+               '<office:styles><style:default-style style:family="text">'
+               '<style:text-properties style:font-name="X"/>'
+               '</style:default-style>'
+               '<style:style style:name="A" style:family="text"'
+               ' style:parent-style-name="B"/>'
+               '<style:style style:name="B" style:family="text"'
+               ' style:parent-style-name="A"/>'
+               '<style:style style:name="C" style:family="text"'
+               ' style:parent-style-name="D"/>'
+               '</office:styles></office:document-styles>'
+               % (styles.OFFICE_NS[1:-1], styles.STYLE_NS[1:-1]))
+        stylesheet = styles.get_stylesheet(xml)
+        for name in 'ABC':
+            self.assertEqual(stylesheet.resolve('text', name).values(), ['X'])
+
+    def test_html_nesting(self):
+        from components.content import Content
+        from components.namespaces import namespaces
+        depth = sys.getrecursionlimit() + 100
+        xml = ('<office:document-content xmlns:office="%s" xmlns:text="%s">'
+               '<office:body>%s&lt;deep&gt;%s</office:body>'
+               '</office:document-content>'
+               % (namespaces['office'], namespaces['text'],
+                  '<text:span>' * depth, '</text:span>' * depth))
+        html = u''.join(Content(xml).iter_html())
+        self.assertEqual(html, '<span>' * depth + '&lt;deep&gt;' + '</span>' * depth)
+
+    def test_html_links(self):
+        from components.content import Content
+        from components.namespaces import namespaces
+        links = ['http://example.com/', 'mailto:a@example.com', '#top',
+                 'other.odt', 'javascript:alert(1)', ' JavaScript:alert(1)',
+                 'java\tscript:alert(1)', 'data:text/html,x']
+        xml = ('<office:document-content xmlns:office="%s" xmlns:text="%s"'
+               ' xmlns:xlink="%s"><office:body>%s</office:body>'
+               '</office:document-content>'
+               % (namespaces['office'], namespaces['text'], namespaces['xlink'],
+                  ''.join(['<text:a xlink:href="%s">x</text:a>' % link
+                           for link in links])))
+        html = u''.join(Content(xml).iter_html())
+        self.assertEqual(html, ''.join(['<a href="%s">x</a>' % link
+                                        for link in links[:4]] +
+                                       ['<a>x</a>'] * 4))
 
 
 # ---------------------------
@@ -144,24 +1093,45 @@ class TestCaseFormatting(TestCaseOdfText):
 
 simple_text= 'This sentence serves for test purposes.'
 
-simple_html = """<html>
-    <head/>
-    <body class="">
-        <p class="">
-            <p class=""/>
-            <p class="">
-                <p class=""/>
-                <p class=""/>
-
-                <p class=""/>
-                <p class=""/>
-            </p>
-            <p class="">
-                This sentence serves for test purposes.
-            </p>
-        </p>
-    </body>
-</html>"""
+TABLE_NS = '{urn:oasis:names:tc:opendocument:xmlns:table:1.0}'
+
+spreadsheet_xml = """<?xml version="1.0" encoding="UTF-8"?>
+<office:document-content
+    xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0"
+    xmlns:table="urn:oasis:names:tc:opendocument:xmlns:table:1.0"
+    xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0">
+<office:body><office:spreadsheet>
+<table:table table:name="Sheet1">
+<table:table-column table:number-columns-repeated="1024"/>
+<table:table-row>
+<table:table-cell office:value-type="string"><text:p>Name</text:p></table:table-cell>
+<table:table-cell office:value-type="string"><text:p>Value</text:p></table:table-cell>
+<table:table-cell table:number-columns-repeated="1022"/>
+</table:table-row>
+<table:table-row table:number-rows-repeated="999">
+<table:table-cell/>
+<table:table-cell office:value-type="float" office:value="2.5"><text:p>2,5</text:p></table:table-cell>
+<table:table-cell/>
+<table:table-cell><text:p>a<text:s text:c="2"/>b</text:p></table:table-cell>
+<table:table-cell table:number-columns-repeated="1020"/>
+</table:table-row>
+<table:table-row>
+<table:table-cell table:number-columns-repeated="2"/>
+<table:table-cell office:value-type="boolean" office:boolean-value="true"><text:p>TRUE</text:p></table:table-cell>
+</table:table-row>
+<table:table-row>
+<table:table-cell office:value-type="date" office:date-value="2008-01-31"><text:p>31.01.08</text:p></table:table-cell>
+</table:table-row>
+<table:table-row table:number-rows-repeated="1048572">
+<table:table-cell table:number-columns-repeated="1024"/>
+</table:table-row>
+</table:table>
+<table:table table:name="Empty"/>
+</office:spreadsheet></office:body>
+</office:document-content>
+"""
+
+simple_html = """<body><p class="Standard">This sentence serves for test purposes.</p></body>"""
 
 
 formatted_text = """Test Sentences
@@ -191,163 +1161,34 @@ r
 Rr
 rr"""
 
-formatted_html = """<html>
-    <head/>
-    <body class="">
-        <p class="">
-            <p class="">
-                <p class=""/>
-                <p class=""/>
-                <p class=""/>
-
-                <p class=""/>
-            </p>
-            <h1 class="">
-                Test Sentences
-            </h1>
-            <p class="">
-                This document tests basic formatting.
-            </p>
-            <p class="">
-                This line tests 
-                <span class="">
-
-                    bold
-                </span>
-                , 
-                <span class="">
-                    italic
-                </span>
-                and 
-                <span class="">
-                    underline
-                </span>
-                formatting.
-            </p>
-
-            <p class="">
-                This paragraph uses a different style (Text body).
-            </p>
-            <p class="">
-                Visit the project homepage at: 
-                <a class="">
-                    http://code.google.com/p/py-odftools/
-                </a>
-            </p>
-            <h1 class="">
-
-                Test List
-            </h1>
-            <p class="">
-                Unordered list:
-            </p>
-            <ol class="">
-                <li class="">
-                    <p class="">
-                        One
-                    </p>
-
-                </li>
-                <li class="">
-                    <p class="">
-                        Two
-                    </p>
-                </li>
-                <li class="">
-                    <p class="">
-                        Three
-                    </p>
-
-                </li>
-            </ol>
-            <p class="">
-                Ordered list:
-            </p>
-            <ol class="">
-                <li class="">
-                    <p class="">
-                        First
-                    </p>
-
-                </li>
-                <li class="">
-                    <p class="">
-                        Second
-                    </p>
-                </li>
-                <li class="">
-                    <p class="">
-                        Third
-                    </p>
-
-                </li>
-            </ol>
-            <p class=""/>
-            <h1 class="">
-                Test Table
-            </h1>
-            <table class="">
-                <p class=""/>
-                <tr class="">
-
-                    <td class="">
-                        <p class=""/>
-                    </td>
-                    <td class="">
-                        <p class="">
-                            R
-                        </p>
-                    </td>
-                    <td class="">
-
-                        <p class="">
-                            r
-                        </p>
-                    </td>
-                </tr>
-                <tr class="">
-                    <td class="">
-                        <p class="">
-                            R
-                        </p>
-
-                    </td>
-                    <td class="">
-                        <p class="">
-                            RR
-                        </p>
-                    </td>
-                    <td class="">
-                        <p class="">
-                            Rr
-                        </p>
-
-                    </td>
-                </tr>
-                <tr class="">
-                    <td class="">
-                        <p class="">
-                            r
-                        </p>
-                    </td>
-                    <td class="">
-
-                        <p class="">
-                            Rr
-                        </p>
-                    </td>
-                    <td class="">
-                        <p class="">
-                            rr
-                        </p>
-                    </td>
-                </tr>
-
-            </table>
-            <p class=""/>
-        </p>
-    </body>
-</html>"""
+formatted_html = (
+    '<body><h1 class="Heading_20_1">Test Sentences</h1>'
+    '<p class="Standard">This document tests basic formatting.</p>'
+    '<p class="Standard">This line tests <span class="T1">bold</span>, '
+    '<span class="T2">italic</span> and <span class="T3">underline</span> '
+    'formatting.</p>'
+    '<p class="Text_20_body">This paragraph uses a different style (Text body).</p>'
+    '<p class="Text_20_body">Visit the project homepage at: '
+    '<a href="http://code.google.com/p/py-odftools/">'
+    'http://code.google.com/p/py-odftools/</a></p>'
+    '<h1 class="Heading_20_1">Test List</h1>'
+    '<p class="Standard">Unordered list:</p>'
+    '<ul class="L1"><li><p class="P1">One</p></li><li><p class="P1">Two</p></li>'
+    '<li><p class="P1">Three</p></li></ul>'
+    '<p class="Standard">Ordered list:</p>'
+    '<ol class="L2"><li><p class="P2">First</p></li><li><p class="P2">Second</p></li>'
+    '<li><p class="P2">Third</p></li></ol>'
+    '<p class="Standard"></p><h1 class="Heading_20_1">Test Table</h1>'
+    '<table class="Table1"><tr><td class="Table1.A1"><p class="P3"></p></td>'
+    '<td class="Table1.A1"><p class="P4">R</p></td>'
+    '<td class="Table1.C1"><p class="P4">r</p></td></tr>'
+    '<tr><td class="Table1.A2"><p class="P4">R</p></td>'
+    '<td class="Table1.A2"><p class="P3">RR</p></td>'
+    '<td class="Table1.C2"><p class="P3">Rr</p></td></tr>'
+    '<tr><td class="Table1.A2"><p class="P4">r</p></td>'
+    '<td class="Table1.A2"><p class="P3">Rr</p></td>'
+    '<td class="Table1.C2"><p class="P3">rr</p></td></tr></table>'
+    '<p class="Standard"></p></body>')
 
 
 